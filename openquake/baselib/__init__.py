@@ -100,7 +100,8 @@ def boolean(flag):
 
 
 config.read(soft_mem_limit=int, hard_mem_limit=int, port=int,
-            multi_user=boolean, multi_node=boolean)
+            multi_user=boolean, multi_node=boolean, share_arrays=boolean,
+            worker_cache_size=int, pmap_max_mb=int)
 
 if config.directory.custom_tmp:
     os.environ['TMPDIR'] = config.directory.custom_tmp
@@ -80,6 +80,12 @@ available at the moment:
 `OQ_DISTRIBUTE` set tp "zmq"
    use the zmq concurrency mechanism (experimental)
 
+If `share_arrays` is true in the `[distribution]` section of openquake.cfg,
+with "processpool" and "threadpool" the large numpy arrays contained in the
+task arguments (for instance the arrays of a site collection) are written
+only once in memory-mapped files, which are attached by the workers instead
+of receiving a copy of the arrays for each task (see :class:`SharedArrays`).
+
 There is also an `OQ_DISTRIBUTE` = "threadpool"; however the
 performance of using threads instead of processes is normally bad for the
 kind of applications we are interested in (CPU-dominated, which large
@@ -137,16 +143,21 @@ the single core processing the slow task). The OpenQuake engine does
 a great deal of work trying to split slow sources in more manageable
 fast sources.
 """
+import io
 import os
 import sys
 import time
+import shutil
 import socket
+import hashlib
 import signal
 import pickle
+import tempfile
 import inspect
 import logging
 import operator
 import itertools
+import threading
 import traceback
 import collections
 import multiprocessing.dummy
@@ -180,7 +191,8 @@ if OQ_DISTRIBUTE not in ('no', 'processpool', 'threadpool', 'celery', 'zmq',
 task_info_dt = numpy.dtype(
     [('taskno', numpy.uint32), ('weight', numpy.float32),
      ('duration', numpy.float32), ('received', numpy.int64),
-     ('mem_gb', numpy.float32)])
+     ('mem_gb', numpy.float32), ('cache_hits', numpy.uint32),
+     ('cache_misses', numpy.uint32)])
 
 
 def oq_distribute(task=None):
@@ -199,12 +211,17 @@ class Pickled(object):
     of the pickled bytestring.
 
     :param obj: the object to pickle
+    :param shared: a :class:`SharedArrays` instance or None
     """
-    def __init__(self, obj):
+    def __init__(self, obj, shared=None):
         self.clsname = obj.__class__.__name__
         self.calc_id = str(getattr(obj, 'calc_id', ''))  # for monitors
+        self.shared = shared is not None
         try:
-            self.pik = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+            if shared is None:
+                self.pik = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+            else:
+                self.pik = shared.dumps(obj)
         except TypeError as exc:  # can't pickle, show the obj in the message
             raise TypeError('%s: %s' % (exc, obj))
 
@@ -219,6 +236,8 @@ class Pickled(object):
 
     def unpickle(self):
         """Unpickle the underlying object"""
+        if self.shared:
+            return _SharedUnpickler(io.BytesIO(self.pik)).load()
         return pickle.loads(self.pik)
 
 
@@ -244,7 +263,7 @@ def get_pickled_sizes(obj):
         sizes, key=lambda pair: pair[1], reverse=True)
 
 
-def pickle_sequence(objects):
+def pickle_sequence(objects, shared=None):
     """
     Convert an iterable of objects into a list of pickled objects.
     If the iterable contains copies, the pickling will be done only once.
@@ -252,6 +271,7 @@ def pickle_sequence(objects):
     pickled again.
 
     :param objects: a sequence of objects to pickle
+    :param shared: a :class:`SharedArrays` instance or None
     """
     cache = {}
     out = []
@@ -261,11 +281,173 @@ def pickle_sequence(objects):
             if isinstance(obj, Pickled):  # already pickled
                 cache[obj_id] = obj
             else:  # pickle the object
-                cache[obj_id] = Pickled(obj)
+                cache[obj_id] = Pickled(obj, shared)
         out.append(cache[obj_id])
     return out
 
 
+class SharedArrays(object):
+    """
+    Publish the large numpy arrays contained in the task arguments in
+    memory-mapped .npy files, so that each array is written only once and
+    the workers on the same machine attach to it by file name instead of
+    unpickling a copy of it. The arrays must not be modified while the
+    tasks are running; in the workers they are read-only.
+
+    :param dirname: the directory where to create the files (default $TMPDIR)
+    :param min_bytes: arrays smaller than that are pickled as usual
+
+    >>> shared = SharedArrays(min_bytes=0)
+    >>> arr = numpy.arange(5)
+    >>> pik = Pickled({'a': arr, 'b': arr}, shared)
+    >>> len(os.listdir(shared.tmpdir))  # the array is written once
+    1
+    >>> pik.unpickle()['b']
+    memmap([0, 1, 2, 3, 4])
+    >>> shared.close()
+    """
+    active = None  # instance used in the pickling in progress, if any
+
+    def __init__(self, dirname=None, min_bytes=1024 ** 2):
+        self.dirname = dirname
+        self.min_bytes = min_bytes
+        self.tmpdir = None  # created at the first publication
+        self.published = {}  # id(array) -> (array, fname)
+
+    def persistent_id(self, obj):
+        """
+        :returns: the name of the file associated to large arrays, or None
+        """
+        if (type(obj) is not numpy.ndarray or obj.nbytes < self.min_bytes
+                or obj.dtype.hasobject):
+            return  # pickle the object as usual
+        try:
+            return self.published[id(obj)][1]
+        except KeyError:
+            if self.tmpdir is None:
+                self.tmpdir = tempfile.mkdtemp(
+                    prefix='oqshared-', dir=self.dirname)
+            fname = os.path.join(
+                self.tmpdir, '%d.npy' % len(self.published))
+            numpy.save(fname, obj)
+            # keep a reference to the array, so that its id is not reused
+            self.published[id(obj)] = obj, fname
+            return fname
+
+    def dumps(self, obj):
+        """
+        :returns: the pickled object, with references to the shared arrays
+        """
+        buf = io.BytesIO()
+        pickler = pickle.Pickler(buf, pickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = self.persistent_id
+        SharedArrays.active = self
+        try:
+            pickler.dump(obj)
+        finally:
+            SharedArrays.active = None
+        return buf.getvalue()
+
+    def close(self):
+        """
+        Remove the files; the workers having them already mapped in
+        memory can still use them
+        """
+        self.published.clear()
+        if self.tmpdir:
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
+            self.tmpdir = None
+
+
+_attached = {}  # fname -> memory-mapped array, one dictionary per process
+
+
+class _SharedUnpickler(pickle.Unpickler):
+    def persistent_load(self, fname):
+        try:
+            return _attached[fname]
+        except KeyError:
+            # forget the arrays of the calculations which are finished
+            for name in [n for n in _attached if not os.path.exists(n)]:
+                del _attached[name]
+            _attached[fname] = arr = numpy.load(fname, mmap_mode='r')
+            return arr
+
+
+class WorkerCache(object):
+    """
+    A LRU cache of unpickled task arguments living in the worker processes.
+    The keys are the SHA1 digests of the pickled bytestrings, so that
+    later tasks of the same calculation receiving the same GSIMs, site
+    collection or risk model reuse the objects built by the previous ones,
+    including the tables read from the disk. The task functions must not
+    modify the cached arguments, i.e. the arguments after the first one.
+    The cache is bounded by the number of objects, since the size of the
+    pickles says nothing about the size of the unpickled objects, and it
+    is cleared when a task of a different calculation arrives.
+
+    :param maxsize: maximum number of objects in the cache
+
+    >>> cache = WorkerCache(maxsize=2)
+    >>> gsims = cache.unpickle(Pickled(['BooreAtkinson2008']))
+    >>> cache.unpickle(Pickled(['BooreAtkinson2008'])) is gsims
+    True
+    >>> cache.hits, cache.misses
+    (1, 1)
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.calc_id = None
+        self.hits = 0
+        self.misses = 0
+        self.objects = collections.OrderedDict()  # key -> obj
+        self.lock = threading.Lock()
+
+    def set_calc_id(self, calc_id):
+        """
+        Clear the cache if the calculation has changed
+        """
+        if calc_id != self.calc_id:
+            self.clear()
+            self.calc_id = calc_id
+
+    def unpickle(self, pickled):
+        """
+        :param pickled: a :class:`Pickled` instance
+        :returns: the cached object or a newly unpickled one
+        """
+        key = hashlib.sha1(pickled.pik).digest()
+        with self.lock:
+            try:
+                obj = self.objects[key]
+            except KeyError:
+                pass
+            else:
+                self.objects.move_to_end(key)
+                self.hits += 1
+                return obj
+        obj = pickled.unpickle()
+        with self.lock:
+            self.misses += 1
+            self.objects[key] = obj
+            while len(self.objects) > self.maxsize:  # discard the oldest
+                self.objects.popitem(last=False)
+        return obj
+
+    def clear(self):
+        """
+        Empty the cache and reset the counters
+        """
+        with self.lock:
+            self.objects.clear()
+            self.hits = self.misses = 0
+
+
+# one cache per worker process; with the threadpool the arguments are not
+# cached, since they would be shared between concurrent tasks
+worker_cache = WorkerCache(config.distribution.get('worker_cache_size', 0))
+
+
 class Result(object):
     """
     :param val: value to return or exception instance
@@ -355,7 +537,17 @@ def safely_call(func, args, task_no=0, mon=dummy_mon):
     """
     isgenfunc = inspect.isgeneratorfunction(func)
     mon.operation = 'total ' + func.__name__
-    if hasattr(args[0], 'unpickle'):
+    use_cache = hasattr(args[0], 'unpickle') and (
+        worker_cache.maxsize and oq_distribute() != 'threadpool')
+    if use_cache:  # forget the objects of the previous calculations
+        worker_cache.set_calc_id(mon.calc_id)
+    hits, misses = worker_cache.hits, worker_cache.misses
+    if use_cache:
+        # args is a list of Pickled objects; the first one is different
+        # for each task, the others are usually the same and are cached
+        args = [args[0].unpickle()] + [
+            worker_cache.unpickle(a) for a in args[1:]]
+    elif hasattr(args[0], 'unpickle'):
         # args is a list of Pickled objects
         args = [a.unpickle() for a in args]
     if mon is dummy_mon:  # in the DbServer
@@ -365,6 +557,8 @@ def safely_call(func, args, task_no=0, mon=dummy_mon):
     mon.measuremem = True
     mon.weight = getattr(args[0], 'weight', 1.)  # used in task_info
     mon.task_no = task_no
+    mon.cache_hits = worker_cache.hits - hits  # used in task_info
+    mon.cache_misses = worker_cache.misses - misses
     args += (mon,)
     with Socket(mon.backurl, zmq.PUSH, 'connect') as zsocket:
         msg = check_mem_usage()  # warn if too much memory is used
@@ -435,32 +629,37 @@ class IterResult(object):
         self.received = []
         first_time = True
         nbytes = AccumDict()
-        for result in self.iresults:
-            msg = check_mem_usage()  # log a warning if too much memory is used
-            if msg and first_time:
-                logging.warning(msg)
-                first_time = False  # warn only once
-            if isinstance(result, BaseException):
-                # this happens with WorkerLostError with celery
-                raise result
-            elif isinstance(result, Result):
-                val = result.get()
-                self.received.append(len(result.pik))
-                if hasattr(result, 'nbytes'):
-                    nbytes += result.nbytes
-            else:  # this should never happen
-                raise ValueError(result)
-            if OQ_DISTRIBUTE == 'processpool' and sys.platform != 'darwin':
-                # it normally works on macOS, but not in notebooks calling
-                # notebooks, which is the case relevant for Marco Pagani
-                mem_gb = (memory_rss(os.getpid()) + sum(
-                    memory_rss(pid) for pid in Starmap.pids)) / GB
-            else:
-                # measure only the memory used by the main process
-                mem_gb = memory_rss(os.getpid()) / GB
-            save_task_info(self, result, mem_gb)
-            if not result.func_args:  # not subtask
-                yield val
+        try:
+            for result in self.iresults:
+                # log a warning if too much memory is used
+                msg = check_mem_usage()
+                if msg and first_time:
+                    logging.warning(msg)
+                    first_time = False  # warn only once
+                if isinstance(result, BaseException):
+                    # this happens with WorkerLostError with celery
+                    raise result
+                elif isinstance(result, Result):
+                    val = result.get()
+                    self.received.append(len(result.pik))
+                    if hasattr(result, 'nbytes'):
+                        nbytes += result.nbytes
+                else:  # this should never happen
+                    raise ValueError(result)
+                if OQ_DISTRIBUTE == 'processpool' and sys.platform != 'darwin':
+                    # it normally works on macOS, but not in notebooks calling
+                    # notebooks, which is the case relevant for Marco Pagani
+                    mem_gb = (memory_rss(os.getpid()) + sum(
+                        memory_rss(pid) for pid in Starmap.pids)) / GB
+                else:
+                    # measure only the memory used by the main process
+                    mem_gb = memory_rss(os.getpid()) / GB
+                save_task_info(self, result, mem_gb)
+                if not result.func_args:  # not subtask
+                    yield val
+        finally:  # release the socket and the shared arrays
+            if hasattr(self.iresults, 'close'):
+                self.iresults.close()
         if self.received:
             tot = sum(self.received)
             max_per_output = max(self.received)
@@ -475,8 +674,12 @@ class IterResult(object):
     def reduce(self, agg=operator.add, acc=None):
         if acc is None:
             acc = AccumDict()
-        for result in self:
-            acc = agg(acc, result)
+        results = iter(self)
+        try:
+            for result in results:
+                acc = agg(acc, result)
+        finally:  # release the underlying resources also in case of errors
+            results.close()
         return acc
 
     @classmethod
@@ -508,7 +711,8 @@ def save_task_info(self, res, mem_gb=0):
     name = mon.operation[6:]  # strip 'total '
     if self.hdf5:
         mon.hdf5 = self.hdf5  # needed for the flush below
-        t = (mon.task_no, mon.weight, mon.duration, len(res.pik), mem_gb)
+        t = (mon.task_no, mon.weight, mon.duration, len(res.pik), mem_gb,
+             getattr(mon, 'cache_hits', 0), getattr(mon, 'cache_misses', 0))
         data = numpy.array([t], task_info_dt)
         hdf5.extend3(self.hdf5.filename, 'task_info/' + name, data,
                      argnames=self.argnames, sent=self.sent)
@@ -625,6 +829,12 @@ class Starmap(object):
         self.sent = numpy.zeros(len(self.argnames) - 1)
         self.monitor.backurl = None  # overridden later
         self.tasks = []  # populated by .submit
+        # with the threadpool the tasks already share the memory
+        if (config.distribution.get('share_arrays') and
+                self.distribute == 'processpool'):
+            self.shared = SharedArrays()
+        else:
+            self.shared = None
         h5 = self.monitor.hdf5
         task_info = 'task_info/' + self.name
         if h5 and task_info not in h5:  # first time
@@ -667,7 +877,7 @@ class Starmap(object):
         assert not isinstance(args[-1], Monitor)  # sanity check
         dist = 'no' if self.num_tasks == 1 else self.distribute
         if dist != 'no':
-            args = pickle_sequence(args)
+            args = pickle_sequence(args, self.shared)
             self.sent += numpy.array([len(p) for p in args])
         res = getattr(self, dist + '_submit')(func, args, monitor)
         self.tasks.append(res)
@@ -732,27 +942,32 @@ class Starmap(object):
             self.sender.__exit__(None, None, None)
         isocket = iter(self.socket)
         self.total = self.todo = len(self.tasks)
-        while self.todo:
-            res = next(isocket)
-            if self.calc_id and self.calc_id != res.mon.calc_id:
-                logging.warning('Discarding a result from job %s, since this '
-                                'is job %d', res.mon.calc_id, self.calc_id)
-                continue
-            elif res.msg == 'TASK_ENDED':
-                self.log_percent()
-                self.todo -= 1
-            elif res.msg:
-                logging.warning(res.msg)
-            elif res.func_args:  # resubmit subtask
-                func, *args = res.func_args
-                self.submit(*args, func=func, monitor=res.mon)
-                yield res
-                self.todo += 1
-            else:
-                yield res
-        self.log_percent()
-        self.socket.__exit__(None, None, None)
-        self.tasks.clear()
+        try:
+            while self.todo:
+                res = next(isocket)
+                if self.calc_id and self.calc_id != res.mon.calc_id:
+                    logging.warning('Discarding a result from job %s, since '
+                                    'this is job %d', res.mon.calc_id,
+                                    self.calc_id)
+                    continue
+                elif res.msg == 'TASK_ENDED':
+                    self.log_percent()
+                    self.todo -= 1
+                elif res.msg:
+                    logging.warning(res.msg)
+                elif res.func_args:  # resubmit subtask
+                    func, *args = res.func_args
+                    self.submit(*args, func=func, monitor=res.mon)
+                    yield res
+                    self.todo += 1
+                else:
+                    yield res
+            self.log_percent()
+        finally:  # also if a task failed or the results were not all read
+            self.socket.__exit__(None, None, None)
+            self.tasks.clear()
+            if self.shared:
+                self.shared.close()
 
 
 def sequential_apply(task, args, concurrent_tasks=cpu_count * 3,
@@ -55,6 +55,20 @@ def supertask(text, monitor):
             yield get_length, k * v
 
 
+def get_array_info(array, monitor):
+    return {'memmap': isinstance(array, numpy.memmap), 'sum': array.sum()}
+
+
+def get_array_sum(array, monitor):
+    if len(array) < 10:
+        raise ValueError('array too short')
+    return array.sum()
+
+
+def get_ids(data, gsims):
+    return id(data), id(gsims)
+
+
 class StarmapTestCase(unittest.TestCase):
     monitor = parallel.Monitor()
 
@@ -128,6 +142,71 @@ class StarmapTestCase(unittest.TestCase):
             self.assertGreater(len(h5['task_info/supertask']), 0)
         shutil.rmtree(tmp.parent)
 
+    def test_share_arrays(self):
+        array = numpy.arange(200000.)  # 1.6 MB
+        allargs = [(array,), (array,), (numpy.arange(3.),)]
+        with mock.patch.dict(parallel.config.distribution, share_arrays=True):
+            smap = parallel.Starmap(get_array_info, allargs,
+                                    distribute='processpool')
+            res = sorted(smap, key=lambda dic: dic['sum'])
+            # the large array has been written only once and then removed
+            self.assertEqual(len(smap.shared.published), 0)
+        self.assertEqual(res, [{'memmap': False, 'sum': 3.},
+                               {'memmap': True, 'sum': array.sum()},
+                               {'memmap': True, 'sum': array.sum()}])
+
+    def test_share_arrays_failure(self):
+        # the shared arrays are removed also if a task fails
+        array = numpy.arange(200000.)  # 1.6 MB
+        allargs = [(array,), (array,), (numpy.arange(3.),)]
+        tmpdirs = []
+        mkdtemp = tempfile.mkdtemp
+
+        def record(**kw):
+            tmpdirs.append(mkdtemp(**kw))
+            return tmpdirs[-1]
+
+        with mock.patch.dict(parallel.config.distribution,
+                             share_arrays=True), \
+                mock.patch.object(tempfile, 'mkdtemp', record):
+            smap = parallel.Starmap(get_array_sum, allargs,
+                                    distribute='processpool')
+            with self.assertRaises(ValueError):
+                smap.reduce()
+        self.assertEqual(len(tmpdirs), 1)
+        self.assertFalse(os.path.exists(tmpdirs[0]))
+
+        # with the threadpool the arrays are not written on the disk
+        with mock.patch.dict(parallel.config.distribution,
+                             share_arrays=True):
+            smap = parallel.Starmap(get_array_sum, allargs[:2],
+                                    distribute='threadpool')
+        self.assertIsNone(smap.shared)
+
+    def test_worker_cache(self):
+        cache = parallel.WorkerCache(maxsize=2)
+        with mock.patch.object(parallel, 'worker_cache', cache):
+            args = parallel.pickle_sequence(('abc', ['GSIM1', 'GSIM2']))
+            ids1 = parallel.safely_call(get_ids, args).get()
+            ids2 = parallel.safely_call(get_ids, args).get()
+        # the first argument is unpickled again, the second one is cached
+        self.assertNotEqual(ids1[0], ids2[0])
+        self.assertEqual(ids1[1], ids2[1])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # the oldest objects are discarded when the cache is full
+        gsims3 = cache.unpickle(parallel.Pickled(['GSIM3']))
+        cache.unpickle(parallel.Pickled(['GSIM4']))
+        self.assertEqual(len(cache.objects), 2)
+        self.assertIs(cache.unpickle(parallel.Pickled(['GSIM3'])), gsims3)
+
+        # the cache is cleared when a new calculation starts
+        cache.set_calc_id(None)
+        self.assertEqual(len(cache.objects), 2)
+        cache.set_calc_id(42)
+        self.assertEqual(len(cache.objects), 0)
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+
     @classmethod
     def tearDownClass(cls):
         parallel.Starmap.shutdown()
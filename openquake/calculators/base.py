@@ -56,6 +56,7 @@ U64 = numpy.uint64
 F32 = numpy.float32
 TWO16 = 2 ** 16
 RUPTURES_PER_BLOCK = 10000  # used in split_filter
+GMF_BLOCK_ROWS = 5 * 10 ** 6  # max GMF rows sorted at once in columnar mode
 
 
 class InvalidCalculationID(Exception):
@@ -937,10 +938,13 @@ class RiskCalculator(HazardCalculator):
             getter = self.get_getter(kind, sid)
             for block in general.block_splitter(
                     assets, self.oqparam.assets_per_site_limit):
-                # dictionary of epsilons for the reduced assets
-                reduced_eps = {ass.ordinal: eps[ass.ordinal]
-                               for ass in block
-                               if eps is not None and len(eps)}
+                if isinstance(eps, riskinput.LazyEpsilons):
+                    reduced_eps = eps  # computed on demand, nothing to store
+                else:
+                    # dictionary of epsilons for the reduced assets
+                    reduced_eps = {ass.ordinal: eps[ass.ordinal]
+                                   for ass in block
+                                   if eps is not None and len(eps)}
                 yield riskinput.RiskInput(getter, [block], reduced_eps)
             rinfo.append((sid, len(block)))
             if len(block) >= TWO16:
@@ -1043,6 +1047,59 @@ def save_gmf_data(dstore, sitecol, gmfs, imts, events=()):
     dstore['gmf_data/indices'] = numpy.array(lst, U32)
 
 
+def _merge_slices(slices):
+    # merge the adjacent slices, to reduce the number of reads
+    merged = []
+    for start, stop in sorted(slices):
+        if merged and merged[-1][1] == start:
+            merged[-1][1] = stop
+        else:
+            merged.append([start, stop])
+    return merged
+
+
+def save_gmf_columns(dstore, rows, slices_by_sid, num_sites, imts):
+    """
+    Save the GMFs in columnar layout, i.e. in the datasets gmf_data/sid,
+    gmf_data/eid, gmf_data/rlzi and gmf_data/gmv_<imt>, sorted by site ID,
+    plus a CSR-style index gmf_data/offsets of length N + 1: the GMFs of
+    the site `sid` are in the slice offsets[sid]:offsets[sid + 1].
+
+    :param dstore: a :class:`openquake.baselib.datastore.DataStore` instance
+    :param rows: a dataset of GMFs with fields rlzi, sid, eid, gmv
+    :param slices_by_sid: a dictionary sid -> list of (start, stop) in rows
+    :param num_sites: the total number of sites N
+    :param imts: a list of IMT strings
+    :returns: an array with the number of GMFs per site
+    """
+    counts = numpy.zeros(num_sites, U32)
+    for sid, slices in slices_by_sid.items():
+        counts[sid] = sum(stop - start for start, stop in slices)
+    offsets = numpy.zeros(num_sites + 1, U64)
+    numpy.cumsum(counts, out=offsets[1:])
+    dstore['gmf_data/offsets'] = offsets
+    dstore['gmf_data/imts'] = ' '.join(imts)
+    names = ['sid', 'eid', 'rlzi'] + ['gmv_' + imt for imt in imts]
+    for name in names:
+        dt = rows.dtype['gmv'].base if name.startswith('gmv_') else (
+            rows.dtype[name])
+        dstore.create_dset('gmf_data/' + name, dt)
+    # the sites are read in blocks of contiguous site IDs, so that the
+    # sorted GMFs can be simply appended to the datasets
+    for block in general.block_splitter(
+            range(num_sites), GMF_BLOCK_ROWS, counts.__getitem__):
+        slices = [s for sid in block for s in slices_by_sid[sid]]
+        data = numpy.concatenate([rows[start:stop] for start, stop
+                                  in _merge_slices(slices)])
+        data = data[data['sid'].argsort(kind='mergesort')]
+        for name in names[:3]:
+            hdf5.extend(dstore['gmf_data/' + name], data[name])
+        for m, imt in enumerate(imts):
+            hdf5.extend(dstore['gmf_data/gmv_' + imt],
+                        numpy.ascontiguousarray(data['gmv'][:, m]))
+    return counts
+
+
 def get_idxs(data, eid2idx):
     """
     Convert from event IDs to event indices.
@@ -15,11 +15,12 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
+import os
 import logging
 import operator
 import numpy
 
-from openquake.baselib import parallel, hdf5, datastore
+from openquake.baselib import parallel, hdf5, datastore, config
 from openquake.baselib.python3compat import encode
 from openquake.baselib.general import AccumDict
 from openquake.hazardlib.contexts import FEWSITES
@@ -38,6 +39,8 @@ grp_source_dt = numpy.dtype([('grp_id', U16), ('source_id', hdf5.vstr),
                              ('source_name', hdf5.vstr)])
 source_data_dt = numpy.dtype(
     [('taskno', U16), ('nsites', U32), ('nruptures', U32), ('weight', F32)])
+MB = 1024 ** 2
+SHARD_BYTES = 16 * MB  # size of the site shards in the temporary file
 
 
 def get_src_ids(sources):
@@ -57,6 +60,114 @@ def get_src_ids(sources):
     return ' '.join(set(src_ids))
 
 
+class PmapAccumulator(dict):
+    """
+    A dictionary grp_id -> ProbabilityMap used as accumulator in the
+    classical calculator. When the size of the maps in memory exceeds
+    `max_bytes` they are flushed into a temporary HDF5 file, composing
+    them with the curves already there, one shard of sites at the time.
+    In this way the memory occupation of the master is bounded by
+    `max_bytes` and not by the number of source groups.
+
+    :param shapes: a dictionary grp_id -> (num_levels, num_gsims)
+    :param num_sites: the total number of sites
+    :param max_bytes: the memory budget (0 means no budget)
+    """
+    def __init__(self, shapes, num_sites, max_bytes=0):
+        super().__init__()
+        for grp_id, (L, G) in shapes.items():
+            self[grp_id] = ProbabilityMap(L, G)
+        self.num_sites = num_sites
+        self.max_bytes = max_bytes
+        self.eff_ruptures = AccumDict()  # grp_id -> eff_ruptures
+        self.h5 = None  # temporary file, created at the first flush
+
+    @property
+    def nbytes(self):
+        """The size of the maps in memory"""
+        return sum(pmap.nbytes for pmap in dict.values(self))
+
+    def flush_if_needed(self):
+        """
+        Flush the maps in memory if they exceed the budget
+        """
+        if self.max_bytes and self.nbytes > self.max_bytes:
+            self.flush()
+
+    def _shard(self, pmap):
+        # number of sites in a shard of the temporary datasets
+        return max(SHARD_BYTES // (pmap.shape_y * pmap.shape_z * 8), 1)
+
+    def flush(self):
+        """
+        Compose the maps in memory with the ones in the temporary file
+        and empty them
+        """
+        if self.h5 is None:
+            self.h5 = hdf5.File.temporary()
+        for grp_id, pmap in dict.items(self):
+            if not pmap:
+                continue
+            key = 'grp-%02d' % grp_id
+            shard = self._shard(pmap)
+            if key not in self.h5:
+                # the missing curves are zeros, the neutral element of |=
+                self.h5.create_dataset(
+                    key, (self.num_sites, pmap.shape_y, pmap.shape_z), F64,
+                    fillvalue=0, chunks=(min(shard, self.num_sites),
+                                         pmap.shape_y, pmap.shape_z))
+            dset = self.h5[key]
+            sids, array = pmap._sorted_array()
+            starts = numpy.searchsorted(
+                sids, numpy.arange(0, self.num_sites + shard, shard))
+            for i, (i1, i2) in enumerate(zip(starts[:-1], starts[1:])):
+                if i1 == i2:  # no curves in this shard
+                    continue
+                start = i * shard
+                stop = min(start + shard, self.num_sites)
+                block = dset[start:stop]
+                idx = sids[i1:i2] - start
+                block[idx] = 1. - (1. - block[idx]) * (1. - array[i1:i2])
+                dset[start:stop] = block
+            pmap.clear()
+        self.h5.flush()
+
+    def items(self):
+        """
+        Yield the pairs (grp_id, pmap), reading back the flushed curves
+        one group at the time
+        """
+        for grp_id, pmap in dict.items(self):
+            key = 'grp-%02d' % grp_id
+            if self.h5 is None or key not in self.h5:
+                yield grp_id, pmap
+                continue
+            dset = self.h5[key]
+            shard = self._shard(pmap)
+            sids, arrays = [], []
+            for start in range(0, self.num_sites, shard):
+                block = dset[start:start + shard]
+                ok = block.reshape(len(block), -1).any(axis=1)
+                sids.append(numpy.arange(start, start + len(block))[ok])
+                arrays.append(block[ok])
+            sids = numpy.concatenate(sids)
+            new = ProbabilityMap(pmap.shape_y, pmap.shape_z)
+            if len(sids):
+                new = ProbabilityMap.from_array(
+                    numpy.concatenate(arrays), sids)
+            new |= pmap
+            yield grp_id, new
+
+    def close(self):
+        """
+        Close and remove the temporary file, if any
+        """
+        if self.h5 is not None:
+            self.h5.close()
+            os.remove(self.h5.path)
+            self.h5 = None
+
+
 @base.calculators.add('classical')
 class ClassicalCalculator(base.HazardCalculator):
     """
@@ -81,6 +192,7 @@ class ClassicalCalculator(base.HazardCalculator):
             for grp_id, data in dic['rup_data'].items():
                 if len(data):
                     self.datastore.extend('rup/grp-%02d' % grp_id, data)
+            acc.flush_if_needed()
         self.calc_times += dic['calc_times']
         return acc
 
@@ -89,13 +201,13 @@ class ClassicalCalculator(base.HazardCalculator):
         Initial accumulator, a dict grp_id -> ProbabilityMap(L, G)
         """
         csm_info = self.csm.info
-        zd = AccumDict()
         num_levels = len(self.oqparam.imtls.array)
-        for grp in self.csm.src_groups:
-            num_gsims = len(csm_info.gsim_lt.get_gsims(grp.trt))
-            zd[grp.id] = ProbabilityMap(num_levels, num_gsims)
-        zd.eff_ruptures = AccumDict()  # grp_id -> eff_ruptures
-        return zd
+        shapes = {grp.id: (num_levels,
+                           len(csm_info.gsim_lt.get_gsims(grp.trt)))
+                  for grp in self.csm.src_groups}
+        max_mb = config.memory.get('pmap_max_mb', 0)
+        return PmapAccumulator(
+            shapes, len(self.sitecol.complete), max_mb * MB)
 
     def execute(self):
         """
@@ -125,9 +237,13 @@ class ClassicalCalculator(base.HazardCalculator):
                 'source_data', numpy.array(data, source_data_dt))
         self.nsites = []
         self.calc_times = AccumDict(accum=numpy.zeros(3, F32))
+        acc = self.acc0()
         try:
-            acc = smap.reduce(self.agg_dicts, self.acc0())
+            acc = smap.reduce(self.agg_dicts, acc)
             self.store_rlz_info(acc.eff_ruptures)
+        except Exception:
+            acc.close()  # remove the temporary file
+            raise
         finally:
             with self.monitor('store source_info', autoflush=True):
                 self.store_source_info(self.calc_times)
@@ -147,7 +263,9 @@ class ClassicalCalculator(base.HazardCalculator):
         param = dict(
             truncation_level=oq.truncation_level, imtls=oq.imtls,
             filter_distance=oq.filter_distance, reqv=oq.get_reqv(),
-            pointsource_distance=oq.pointsource_distance)
+            pointsource_distance=oq.pointsource_distance,
+            magdist_tolerance=oq.magdist_tolerance,
+            magdist_site_tolerance=oq.magdist_site_tolerance)
         num_tasks = 0
         num_sources = 0
 
@@ -212,17 +330,21 @@ class ClassicalCalculator(base.HazardCalculator):
                         for src in self.csm.get_sources()}
         data = []
         with self.monitor('saving probability maps', autoflush=True):
-            for grp_id, pmap in pmap_by_grp_id.items():
-                if pmap:  # pmap can be missing if the group is filtered away
-                    base.fix_ones(pmap)  # avoid saving PoEs == 1
-                    key = 'poes/grp-%02d' % grp_id
-                    self.datastore[key] = pmap
-                    self.datastore.set_attrs(key, trt=trt_by_grp[grp_id])
-                    if oq.disagg_by_src:
-                        data.append(
-                            (grp_id, grp_source[grp_id], src_name[grp_id]))
-                    if 'rup' in set(self.datastore):
-                        self.datastore.set_nbytes('rup/grp-%02d' % grp_id)
+            try:
+                for grp_id, pmap in pmap_by_grp_id.items():
+                    if pmap:  # pmap can be missing if the group is filtered
+                        base.fix_ones(pmap)  # avoid saving PoEs == 1
+                        key = 'poes/grp-%02d' % grp_id
+                        self.datastore[key] = pmap
+                        self.datastore.set_attrs(key, trt=trt_by_grp[grp_id])
+                        if oq.disagg_by_src:
+                            data.append(
+                                (grp_id, grp_source[grp_id], src_name[grp_id]))
+                        if 'rup' in set(self.datastore):
+                            self.datastore.set_nbytes('rup/grp-%02d' % grp_id)
+            finally:
+                if isinstance(pmap_by_grp_id, PmapAccumulator):
+                    pmap_by_grp_id.close()  # remove the temporary file
         if oq.hazard_calculation_id is None and 'poes' in self.datastore:
             self.datastore.set_nbytes('poes')
             if oq.disagg_by_src and csm_info.get_num_rlzs() == 1:
@@ -44,6 +44,39 @@ def start_ebrisk(rupgetter, srcfilter, param, monitor):
             yield ebrisk, rgetter, srcfilter, param
 
 
+def aggregate_losses(acc, losses_by_A, eidx, assets, ratios, loss_types,
+                     ws_by_lti, tagnames):
+    """
+    Aggregate by event and tags the losses of the assets of a given taxonomy
+    on a given site; works by side effect on `acc` and `losses_by_A`.
+
+    :param acc: an array of shape (E, L, T...)
+    :param losses_by_A: an array of shape (A, L) or None
+    :param eidx: E' event indices
+    :param assets: an array with fields ordinal, tagidxs and loss types
+    :param ratios: L arrays of E' loss ratios
+    :param loss_types: L loss types
+    :param ws_by_lti: L arrays of E' weights, used for the average losses
+    :param tagnames: the tags to aggregate by
+    """
+    aids = assets['ordinal']
+    # the loss ratios are the same for all the assets of a given
+    # taxonomy on the site, so the losses can be aggregated by
+    # summing the values of the assets with the same tags
+    tags = assets['tagidxs']
+    if tagnames:
+        uniq, inv = numpy.unique(tags, axis=0, return_inverse=True)
+    else:  # a single group with all the assets
+        uniq, inv = tags[:1], numpy.zeros(len(aids), int)
+    idx = (eidx[:, None],) + tuple(uniq.T[:, None, :])
+    for lti, loss_ratios in enumerate(ratios):
+        values = assets[loss_types[lti]]
+        tot = numpy.bincount(inv, values, len(uniq))
+        numpy.add.at(acc[:, lti], idx, numpy.outer(loss_ratios, tot))
+        if losses_by_A is not None:
+            losses_by_A[aids, lti] += values * (loss_ratios @ ws_by_lti[lti])
+
+
 def ebrisk(rupgetter, srcfilter, param, monitor):
     """
     :param rupgetter:
@@ -79,13 +112,13 @@ def ebrisk(rupgetter, srcfilter, param, monitor):
     if param['avg_losses']:
         losses_by_A = numpy.zeros((assgetter.num_assets, L), F32)
     else:
-        losses_by_A = 0
+        losses_by_A = None
     times = numpy.zeros(N)  # risk time per site_id
     for sid, haz in hazard.items():
         t0 = time.time()
         weights = getter.weights[haz['rlzi']]
-        assets_on_sid, tagidxs = assgetter.get(sid, tagnames)
-        eidx = [eid2idx[eid] for eid in haz['eid']]
+        assets_on_sid = assgetter.get_array(sid, tagnames)
+        eidx = numpy.array([eid2idx[eid] for eid in haz['eid']])
         mon.duration += time.time() - t0
         mon.counts += 1
         with mon_risk:
@@ -93,18 +126,11 @@ def ebrisk(rupgetter, srcfilter, param, monitor):
                 assets_on_sid, haz['gmv'], imts)
         with mon_agg:
             for assets, ratios in assets_ratios:
-                taxo = assets[0].taxonomy
+                taxo = assets['taxonomy'][0]
                 ws_by_lti = [weights[vf.imt]
                              for vf in riskmodel[taxo].risk_functions.values()]
-                for lti, loss_ratios in enumerate(ratios):
-                    ws = ws_by_lti[lti]
-                    lt = riskmodel.loss_types[lti]
-                    for asset in assets:
-                        aid = asset.ordinal
-                        losses = loss_ratios * asset.value(lt)
-                        acc[(eidx, lti) + tagidxs[aid]] += losses
-                        if param['avg_losses']:
-                            losses_by_A[aid, lti] += losses @ ws
+                aggregate_losses(acc, losses_by_A, eidx, assets, ratios,
+                                 riskmodel.loss_types, ws_by_lti, tagnames)
             times[sid] = time.time() - t0
     with monitor('building event loss table'):
         elt = numpy.fromiter(
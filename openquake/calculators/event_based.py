@@ -29,7 +29,6 @@ from openquake.hazardlib.probability_map import ProbabilityMap
 from openquake.hazardlib.stats import compute_pmap_stats
 from openquake.hazardlib.calc.stochastic import sample_ruptures
 from openquake.hazardlib.source import rupture
-from openquake.risklib.riskinput import str2rsi
 from openquake.baselib import parallel
 from openquake.commonlib import calc, util, logs
 from openquake.calculators import base, extract
@@ -99,6 +98,7 @@ class EventBasedCalculator(base.HazardCalculator):
     is_stochastic = True
     accept_precalc = ['event_based', 'event_based_risk', 'ucerf_hazard']
     build_ruptures = sample_ruptures
+    gmf_rows = None  # temporary file used in the columnar gmf_data layout
 
     @cached_property
     def csm_info(self):
@@ -238,10 +238,15 @@ class EventBasedCalculator(base.HazardCalculator):
                 return acc
             idxs = base.get_idxs(data, self.eid2idx)  # this has to be fast
             data['eid'] = idxs  # replace eid with idx
-            self.datastore.extend('gmf_data/data', data)
-            # it is important to save the number of bytes while the
-            # computation is going, to see the progress
-            update_nbytes(self.datastore, 'gmf_data/data', data)
+            if self.gmf_rows is None:  # rows layout
+                self.datastore.extend('gmf_data/data', data)
+                # it is important to save the number of bytes while the
+                # computation is going, to see the progress
+                update_nbytes(self.datastore, 'gmf_data/data', data)
+            else:  # columnar layout, the rows are sorted by site at the end
+                if 'data' not in self.gmf_rows:
+                    hdf5.create(self.gmf_rows, 'data', data.dtype)
+                hdf5.extend(self.gmf_rows['data'], data)
             for sid, start, stop in result['indices']:
                 self.indices[sid, 0].append(start + self.offset)
                 self.indices[sid, 1].append(stop + self.offset)
@@ -249,12 +254,11 @@ class EventBasedCalculator(base.HazardCalculator):
             if self.offset >= TWO32:
                 raise RuntimeError(
                     'The gmf_data table has more than %d rows' % TWO32)
-        imtls = self.oqparam.imtls
         with agg_mon:
-            for key, poes in result.get('hcurves', {}).items():
-                r, sid, imt = str2rsi(key)
-                array = acc[r].setdefault(sid, 0).array[imtls(imt), 0]
-                array[:] = 1. - (1. - array) * (1. - poes)
+            if result.get('hcurves'):
+                sids, rlzis, poes = result['hcurves']
+                for r, rlzi in enumerate(rlzis):
+                    acc[rlzi] |= ProbabilityMap.from_array(poes[:, r], sids)
         sav_mon.flush()
         agg_mon.flush()
         self.datastore.flush()
@@ -330,6 +334,45 @@ class EventBasedCalculator(base.HazardCalculator):
             imtls=oq.imtls, filter_distance=oq.filter_distance,
             ses_per_logic_tree_path=oq.ses_per_logic_tree_path, **kw)
 
+    def save_gmf_indices(self):
+        """
+        Save the indices of the GMFs by site, or the GMFs themselves sorted
+        by site in the columnar layout, and the number of events by site
+        """
+        oq = self.oqparam
+        N = len(self.sitecol.complete)
+        logging.info('Saving gmf_data/indices')
+        with self.monitor('saving gmf_data/indices', measuremem=True,
+                          autoflush=True):
+            if self.gmf_rows is None:  # rows layout
+                self.datastore['gmf_data/imts'] = ' '.join(oq.imtls)
+                dset = self.datastore.create_dset(
+                    'gmf_data/indices', hdf5.vuint32,
+                    shape=(N, 2), fillvalue=None)
+                num_evs = self.datastore.create_dset(
+                    'gmf_data/events_by_sid', U32, (N,))
+                for sid in self.sitecol.complete.sids:
+                    start = numpy.array(self.indices[sid, 0])
+                    stop = numpy.array(self.indices[sid, 1])
+                    dset[sid, 0] = start
+                    dset[sid, 1] = stop
+                    num_evs[sid] = (stop - start).sum()
+                num_evs = num_evs.value
+            else:  # columnar layout
+                slices_by_sid = {
+                    sid: list(zip(self.indices[sid, 0], self.indices[sid, 1]))
+                    for sid in self.sitecol.complete.sids}
+                num_evs = base.save_gmf_columns(
+                    self.datastore, self.gmf_rows['data'], slices_by_sid,
+                    N, list(oq.imtls))
+                self.datastore['gmf_data/events_by_sid'] = num_evs
+                self.datastore.set_nbytes('gmf_data')
+            avg_events_by_sid = num_evs.sum() / N
+            logging.info('Found ~%d GMVs per site', avg_events_by_sid)
+            self.datastore.set_attrs(
+                'gmf_data', avg_events_by_sid=avg_events_by_sid,
+                max_events_by_sid=num_evs.max())
+
     def execute(self):
         oq = self.oqparam
         self.set_param()
@@ -346,36 +389,23 @@ class EventBasedCalculator(base.HazardCalculator):
                 return {}
         iterargs = ((rgetter, self.src_filter, self.param)
                     for rgetter in self.gen_rupture_getters())
-        # call compute_gmfs in parallel
-        acc = parallel.Starmap(
-            self.core_task.__func__, iterargs, self.monitor()
-        ).reduce(self.agg_dicts, self.acc0())
-
-        if self.indices:
-            N = len(self.sitecol.complete)
-            logging.info('Saving gmf_data/indices')
-            with self.monitor('saving gmf_data/indices', measuremem=True,
-                              autoflush=True):
-                self.datastore['gmf_data/imts'] = ' '.join(oq.imtls)
-                dset = self.datastore.create_dset(
-                    'gmf_data/indices', hdf5.vuint32,
-                    shape=(N, 2), fillvalue=None)
-                num_evs = self.datastore.create_dset(
-                    'gmf_data/events_by_sid', U32, (N,))
-                for sid in self.sitecol.complete.sids:
-                    start = numpy.array(self.indices[sid, 0])
-                    stop = numpy.array(self.indices[sid, 1])
-                    dset[sid, 0] = start
-                    dset[sid, 1] = stop
-                    num_evs[sid] = (stop - start).sum()
-                avg_events_by_sid = num_evs.value.sum() / N
-                logging.info('Found ~%d GMVs per site', avg_events_by_sid)
-                self.datastore.set_attrs(
-                    'gmf_data', avg_events_by_sid=avg_events_by_sid,
-                    max_events_by_sid=num_evs.value.max())
-        elif oq.ground_motion_fields:
-            raise RuntimeError('No GMFs were generated, perhaps they were '
-                               'all below the minimum_intensity threshold')
+        if oq.gmf_data_layout == 'columns':
+            self.gmf_rows = hdf5.File.temporary()
+        try:
+            # call compute_gmfs in parallel
+            acc = parallel.Starmap(
+                self.core_task.__func__, iterargs, self.monitor()
+            ).reduce(self.agg_dicts, self.acc0())
+            if self.indices:
+                self.save_gmf_indices()
+            elif oq.ground_motion_fields:
+                raise RuntimeError('No GMFs were generated, perhaps they were '
+                                   'all below the minimum_intensity threshold')
+        finally:
+            if self.gmf_rows is not None:
+                self.gmf_rows.close()
+                os.remove(self.gmf_rows.path)
+                self.gmf_rows = None
         return acc
 
     def post_execute(self, result):
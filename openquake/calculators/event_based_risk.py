@@ -99,10 +99,13 @@ def event_based_risk(riskinputs, riskmodel, param, monitor):
                     continue
                 loss_type = riskmodel.loss_types[l]
                 ins = param['insured_losses'] and loss_type != 'occupants'
+                avals = numpy.zeros(len(out.assets))
+                idxs = numpy.zeros(len(out.assets), U32)
+                iratios_ = []  # insured loss ratios for each asset
                 for a, asset in enumerate(out.assets):
-                    aval = asset.value(loss_type)
+                    aval = avals[a] = asset.value(loss_type)
                     aid = asset.ordinal
-                    idx = aid2idx[aid]
+                    idx = idxs[a] = aid2idx[aid]
                     ratios = loss_ratios[a]  # length E
 
                     # average losses
@@ -119,14 +122,15 @@ def event_based_risk(riskinputs, riskmodel, param, monitor):
                         avg[idx, r, l + L] = (iratios.sum(axis=0) *
                                               param['ses_ratio'] * aval)
                         agglosses[:, l + L] += iratios * aval
-                    if 'builder' in param:
-                        with mon:  # this is the heaviest part
-                            all_curves[idx, r][loss_type] = (
-                                builder.build_curve(aval, ratios, r))
-                            if ins:
-                                lt = loss_type + '_ins'
-                                all_curves[idx, r][lt] = builder.build_curve(
-                                    aval, iratios, r)
+                        iratios_.append(iratios)
+                if 'builder' in param:
+                    with mon:  # this is the heaviest part
+                        all_curves[loss_type][idxs, r] = builder.build_curves(
+                            avals, loss_ratios, r)
+                        if ins:
+                            lt = loss_type + '_ins'
+                            all_curves[lt][idxs, r] = builder.build_curves(
+                                avals, numpy.array(iratios_), r)
 
             # NB: I could yield the agglosses per output, but then I would
             # have millions of small outputs with big data transfer and slow
@@ -247,7 +251,8 @@ class EbrCalculator(base.RiskCalculator):
             len(self.assetcol), self.E,
             self.oqparam.asset_correlation,
             self.oqparam.master_seed,
-            self.oqparam.ignore_covs or not self.riskmodel.covs)
+            self.oqparam.ignore_covs or not self.riskmodel.covs,
+            self.oqparam.random_streams)
 
     def save_losses(self, dic):
         """
@@ -32,7 +32,8 @@ from openquake.hazardlib.calc import disagg, filters
 from openquake.calculators.views import view
 from openquake.calculators.extract import extract, get_mesh
 from openquake.calculators.export import export
-from openquake.calculators.getters import GmfGetter, gen_rupture_getters
+from openquake.calculators.getters import (
+    GmfGetter, gen_rupture_getters, get_gmf_data)
 from openquake.commonlib import writers, hazard_writers, calc, util, source
 
 F32 = numpy.float32
@@ -600,7 +601,7 @@ def export_gmf_data_csv(ekey, dstore):
     else:
         arr = sc[['lon', 'lat']]
     eid = int(ekey[0].split('/')[1]) if '/' in ekey[0] else None
-    gmfa = dstore['gmf_data/data'].value[['eid', 'sid', 'gmv']].copy()
+    gmfa = get_gmf_data(dstore)[['eid', 'sid', 'gmv']].copy()
     event_id = dstore['events']['eid']
     gmfa['eid'] = event_id[gmfa['eid']]
     if eid is None:  # we cannot use extract here
@@ -617,7 +617,7 @@ def extract_gmf_scenario_npz(dstore, what):
     oq = dstore['oqparam']
     mesh = get_mesh(dstore['sitecol'])
     n = len(mesh)
-    data_by_rlzi = group_array(dstore['gmf_data/data'].value, 'rlzi')
+    data_by_rlzi = group_array(getters.get_gmf_data(dstore), 'rlzi')
     for rlzi in data_by_rlzi:
         gmfa, e = _gmf_scenario(data_by_rlzi[rlzi], n, oq.imtls)
         logging.info('Exporting array of shape %s for rlz %d',
@@ -26,13 +26,13 @@ from openquake.hazardlib.gsim.base import ContextMaker, FarAwayRupture
 from openquake.hazardlib import calc, geo, probability_map, stats, valid
 from openquake.hazardlib.geo.mesh import Mesh, RectangularMesh
 from openquake.hazardlib.source.rupture import EBRupture, classes
-from openquake.risklib.riskinput import rsi2str
 from openquake.risklib.asset import Asset
-from openquake.commonlib.calc import _gmvs_to_haz_curve
+from openquake.commonlib.calc import gmfdata_to_poes
 
 U16 = numpy.uint16
 U32 = numpy.uint32
 F32 = numpy.float32
+F64 = numpy.float64
 U64 = numpy.uint64
 by_taxonomy = operator.attrgetter('taxonomy')
 
@@ -102,14 +102,19 @@ class PmapGetter(object):
         self._pmap_by_grp = {}
         if 'poes' in self.dstore:
             # build probability maps restricted to the given sids
-            ok_sids = set(self.sids)
             for grp, dset in self.dstore['poes'].items():
                 ds = dset['array']
                 L, G = ds.shape[1:]
-                pmap = probability_map.ProbabilityMap(L, G)
-                for idx, sid in enumerate(dset['sids'].value):
-                    if sid in ok_sids:
-                        pmap[sid] = probability_map.ProbabilityCurve(ds[idx])
+                sids = dset['sids'].value
+                idxs, = numpy.in1d(sids, self.sids).nonzero()
+                if len(idxs) == len(sids):  # read all the curves at once
+                    pmap = probability_map.ProbabilityMap.from_array(
+                        ds.value, sids)
+                elif len(idxs):  # read only the required curves
+                    pmap = probability_map.ProbabilityMap.from_array(
+                        ds[list(idxs)], sids[idxs])
+                else:
+                    pmap = probability_map.ProbabilityMap(L, G)
                 self._pmap_by_grp[grp] = pmap
                 self.nbytes += pmap.nbytes
         return self._pmap_by_grp
@@ -199,11 +204,10 @@ class PmapGetter(object):
         if len(self.weights) == 1:  # one realization
             # the standard deviation is zero
             pmap = self.get(0, grp)
-            for sid, pcurve in pmap.items():
-                array = numpy.zeros(pcurve.array.shape[:-1] + (2,))
-                array[:, 0] = pcurve.array[:, 0]
-                pcurve.array = array
-            return pmap
+            mean = pmap.array
+            array = numpy.zeros(mean.shape[:-1] + (2,))
+            array[:, :, 0] = mean[:, :, 0]
+            return probability_map.ProbabilityMap.from_array(array, pmap.sids)
         else:  # multiple realizations
             dic = ({g: self.dstore['poes/' + g] for g in self.dstore['poes']}
                    if grp is None else {grp: self.dstore['poes/' + grp]})
@@ -213,6 +217,37 @@ class PmapGetter(object):
                 self.weights, self.imtls)
 
 
+def read_gmf_columns(dstore, start, stop):
+    """
+    Read a slice of GMFs stored in the columnar layout.
+
+    :param dstore: a DataStore with datasets gmf_data/sid, gmf_data/eid, ...
+    :param start: start index in the columns
+    :param stop: stop index in the columns
+    :returns: an array with fields rlzi, sid, eid, gmv
+    """
+    imts = dstore['gmf_data/imts'].value.split()
+    gmf_data_dt = numpy.dtype([('rlzi', U16), ('sid', U32), ('eid', U64),
+                               ('gmv', (F32, (len(imts),)))])
+    data = numpy.zeros(stop - start, gmf_data_dt)
+    for name in ('rlzi', 'sid', 'eid'):
+        data[name] = dstore['gmf_data/' + name][start:stop]
+    for m, imt in enumerate(imts):
+        data['gmv'][:, m] = dstore['gmf_data/gmv_' + imt][start:stop]
+    return data
+
+
+def get_gmf_data(dstore):
+    """
+    :param dstore: a DataStore with GMFs stored in rows or in columns
+    :returns: an array with fields rlzi, sid, eid, gmv
+    """
+    if 'gmf_data/offsets' in dstore:  # columnar layout
+        stop = int(dstore['gmf_data/offsets'][-1])
+        return read_gmf_columns(dstore, 0, stop)
+    return dstore['gmf_data/data'].value
+
+
 class GmfDataGetter(collections.Mapping):
     """
     A dictionary-like object {sid: dictionary by realization index}
@@ -231,8 +266,19 @@ class GmfDataGetter(collections.Mapping):
         except KeyError:  # engine < 3.3
             self.imts = list(self.dstore['oqparam'].imtls)
         self.data = {}
-        for sid in self.sids:
-            self.data[sid] = data = self[sid]
+        if 'gmf_data/offsets' in self.dstore:  # columnar layout
+            # read the GMFs of all the sites with a single contiguous read
+            offsets = self.dstore['gmf_data/offsets'].value.astype(int)
+            start = offsets[min(self.sids)]
+            gmfs = read_gmf_columns(
+                self.dstore, start, offsets[max(self.sids) + 1])
+            for sid in self.sids:
+                data = gmfs[offsets[sid] - start:offsets[sid + 1] - start]
+                self.data[sid] = general.group_array(data, 'rlzi')
+        else:
+            for sid in self.sids:
+                self.data[sid] = self[sid]
+        for sid, data in self.data.items():
             if not data:  # no GMVs, return 0, counted in no_damage
                 self.data[sid] = {rlzi: 0 for rlzi in range(self.num_rlzs)}
         # now some attributes set for API compatibility with the GmfGetter
@@ -248,6 +294,11 @@ class GmfDataGetter(collections.Mapping):
         return self.data
 
     def __getitem__(self, sid):
+        if 'gmf_data/offsets' in self.dstore:  # columnar layout
+            offsets = self.dstore['gmf_data/offsets'][sid:sid + 2]
+            data = read_gmf_columns(
+                self.dstore, int(offsets[0]), int(offsets[1]))
+            return general.group_array(data, 'rlzi')
         dset = self.dstore['gmf_data/data']
         idxs = self.dstore['gmf_data/indices'][sid]
         if idxs.dtype.name == 'uint32':  # scenario
@@ -269,26 +320,41 @@ class GmfDataGetter(collections.Mapping):
 # used only in ebrisk; does not support insured losses
 class AssetGetter(object):
     """
-    An object which is able to read the assets on a given site.
+    An object which is able to read the assets on a given site. The
+    asset ordinals are sorted by site, so that the assets on a site
+    are a slice start:stop of the index and can be read without scanning
+    the whole asset collection.
     """
     def __init__(self, dstore):
         self.dstore = dstore
         self.tagcol = dstore['assetcol/tagcol']
-        self.sids = dstore['assetcol/array']['site_id']
+        sids = dstore['assetcol/array']['site_id']
+        self.order = numpy.argsort(sids, kind='mergesort')  # stable
+        self.sids = sids[self.order]  # sorted site IDs
         self.cost_calculator = dstore['assetcol/cost_calculator']
         self.cost_calculator.tagi = {
             tagname: i for i, tagname in enumerate(self.tagcol.tagnames)}
-        self.num_assets = len(dstore['assetcol/array'])
+        self.num_assets = len(sids)
         self.loss_types = dstore.get_attr('assetcol', 'loss_types').split()
 
+    def _read(self, site_id):
+        # returns the ordinals and the records of the assets on the site
+        start = numpy.searchsorted(self.sids, site_id)
+        stop = numpy.searchsorted(self.sids, site_id, 'right')
+        aids = self.order[start:stop]  # increasing, since the sort is stable
+        dset = self.dstore['assetcol/array']
+        if len(aids) == 0:
+            return aids, dset[0:0]
+        elif aids[-1] - aids[0] == len(aids) - 1:  # contiguous assets
+            return aids, dset[aids[0]:aids[-1] + 1]
+        return aids, dset[aids]
+
     def get(self, site_id, tagnames):
         """
         :param site_id: the site of interest
         :returns: assets, ass_by_aid
         """
-        bools = site_id == self.sids
-        aids, = numpy.where(bools)
-        array = self.dstore['assetcol/array'][bools]
+        aids, array = self._read(site_id)
         tagidxs = {}  # aid -> tagidxs
         assets = []
         for aid, a in zip(aids, array):
@@ -311,6 +377,36 @@ class AssetGetter(object):
             assets.append(asset)
         return assets, tagidxs
 
+    def get_array(self, site_id, tagnames):
+        """
+        :param site_id: the site of interest
+        :param tagnames: the tags to aggregate by
+        :returns:
+            an array with fields ordinal, taxonomy, tagidxs and the total
+            value of each loss type, one record per asset on the site
+        """
+        aids, array = self._read(site_id)
+        dt = [('ordinal', U32), ('taxonomy', U16),
+              ('tagidxs', (int, (len(tagnames),)))] + [
+                  (lt, F64) for lt in self.loss_types]
+        arr = numpy.zeros(len(aids), dt)
+        arr['ordinal'] = aids
+        arr['taxonomy'] = array['taxonomy']
+        for i, tagname in enumerate(tagnames):
+            arr['tagidxs'][:, i] = array[tagname].astype(int) - 1
+        values = {lt: array['value-' + lt] for lt in self.loss_types
+                  if lt != 'occupants'}
+        for name in array.dtype.names:
+            if name.startswith('occupants_'):
+                values[name] = array[name]
+        for lt in self.loss_types:
+            if lt == 'occupants':  # as in Asset.value with no time_event
+                arr[lt] = values['occupants_None']
+            else:
+                arr[lt] = self.cost_calculator(
+                    lt, values, array['area'], array['number'])
+        return arr
+
 
 class GmfGetter(object):
     """
@@ -363,7 +459,8 @@ class GmfGetter(object):
             try:
                 computer = calc.gmf.GmfComputer(
                     ebr, sitecol, self.oqparam.imtls, self.cmaker,
-                    self.oqparam.truncation_level, self.correl_model)
+                    self.oqparam.truncation_level, self.correl_model,
+                    self.oqparam.random_streams)
             except FarAwayRupture:
                 # due to numeric errors, ruptures within the maximum_distance
                 # when written, can be outside when read; I found a case with
@@ -393,22 +490,26 @@ class GmfGetter(object):
                 for i, miniml in enumerate(self.min_iml):  # gmv < minimum
                     arr = array[:, i, :]
                     arr[arr < miniml] = 0
-                n = 0
-                for rlzi in rlzs:
-                    eids = eids_by_rlz[rlzi]
-                    e = len(eids)
-                    if not e:
-                        continue
-                    for ei, eid in enumerate(eids):
-                        gmf = array[:, :, n + ei]  # shape (N, M)
-                        tot = gmf.sum(axis=0)  # shape (M,)
-                        if not tot.sum():
-                            continue
-                        for sid, gmv in zip(sids, gmf):
-                            if gmv.sum():
-                                data.append((rlzi, sid, eid, gmv))
-                    n += e
-            yield numpy.array(data, self.gmv_dt)
+                data.append(self._pack(array, sids, rlzs, eids_by_rlz))
+            if data:
+                yield numpy.concatenate(data)
+            else:
+                yield numpy.zeros(0, self.gmv_dt)
+
+    def _pack(self, array, sids, rlzs, eids_by_rlz):
+        # convert an array of shape (N, M, E) into an array of dtype gmv_dt
+        # containing only the nonzero GMFs, ordered by event and site;
+        # the events are ordered by realization as in the input array
+        lens = [len(eids_by_rlz[rlzi]) for rlzi in rlzs]
+        rlzis = numpy.repeat(rlzs, lens)
+        eids = numpy.concatenate([eids_by_rlz[rlzi] for rlzi in rlzs])
+        eidx, sidx = (array.sum(axis=1) != 0).T.nonzero()
+        data = numpy.zeros(len(eidx), self.gmv_dt)
+        data['rlzi'] = rlzis[eidx]
+        data['sid'] = sids[sidx]
+        data['eid'] = eids[eidx]
+        data['gmv'] = array[sidx, :, eidx]
+        return data
 
     def get_gmfdata(self):
         """
@@ -435,28 +536,17 @@ class GmfGetter(object):
         oq = self.oqparam
         with monitor('GmfGetter.init', measuremem=True):
             self.init()
-        hcurves = {}  # key -> poes
-        if oq.hazard_curves_from_gmfs:
-            hc_mon = monitor('building hazard curves', measuremem=False)
-            duration = oq.investigation_time * oq.ses_per_logic_tree_path
-            with monitor('building hazard', measuremem=True):
-                gmfdata = self.get_gmfdata()  # returned later
-                hazard = self.get_hazard(data=gmfdata)
-            for sid, hazardr in hazard.items():
-                dic = general.group_array(hazardr, 'rlzi')
-                for rlzi, array in dic.items():
-                    with hc_mon:
-                        gmvs = array['gmv']
-                        for imti, imt in enumerate(oq.imtls):
-                            poes = _gmvs_to_haz_curve(
-                                gmvs[:, imti], oq.imtls[imt],
-                                oq.investigation_time, duration)
-                            hcurves[rsi2str(rlzi, sid, imt)] = poes
-        elif oq.ground_motion_fields:  # fast lane
+        if oq.hazard_curves_from_gmfs or oq.ground_motion_fields:
             with monitor('building hazard', measuremem=True):
                 gmfdata = self.get_gmfdata()
         else:
             return {}
+        hcurves = ()  # sids, rlzis, poes
+        if oq.hazard_curves_from_gmfs:
+            duration = oq.investigation_time * oq.ses_per_logic_tree_path
+            with monitor('building hazard curves', measuremem=False):
+                hcurves = gmfdata_to_poes(
+                    gmfdata, oq.imtls, oq.investigation_time, duration)
         indices = []
         gmfdata.sort(order=('sid', 'rlzi', 'eid'))
         start = stop = 0
@@ -75,7 +75,7 @@ class ScenarioCalculator(base.HazardCalculator):
         rupser.close()
         self.computer = GmfComputer(
             ebr, self.sitecol, oq.imtls, self.cmaker, oq.truncation_level,
-            oq.correl_model)
+            oq.correl_model, oq.random_streams)
 
     def init(self):
         pass
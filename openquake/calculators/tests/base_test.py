@@ -18,8 +18,10 @@
 
 import unittest
 import mock
+import numpy
 from openquake.baselib.general import gettemp
 from openquake.baselib import hdf5
+from openquake.risklib import riskinput
 from openquake.calculators import base
 
 
@@ -53,3 +55,27 @@ class BaseCalculatorTestCase(unittest.TestCase):
             self.assertRaises(ZeroDivisionError, calc.run)
         self.assertEqual(error.call_count, 0)
         self.assertEqual(critical.call_count, 1)
+
+
+class GenRiskInputsTestCase(unittest.TestCase):
+    # the path used by the event based risk with random_streams = true
+    def test_lazy_epsilons(self):
+        assets = [mock.Mock(ordinal=aid, taxonomy='tax') for aid in range(4)]
+        calc = mock.Mock(datastore={})
+        calc.assetcol.assets_by_site.return_value = [
+            assets[:2], [], assets[2:]]
+        calc.oqparam.assets_per_site_limit = 1000
+        eps = riskinput.make_epsilon_getter(
+            4, 10, 1, 42, False, lazy=True)(5, 10)
+        ris = list(base.RiskCalculator._gen_riskinputs(calc, 'gmf', eps, 5))
+        self.assertEqual([list(ri.aids) for ri in ris], [[0, 1], [2, 3]])
+        eids = numpy.array([0, 3, 4])
+        for ri in ris:
+            self.assertIs(ri.eps, eps)  # nothing is stored
+            for aid in ri.aids:
+                numpy.testing.assert_equal(
+                    ri.epsilon_getter(aid, eids),
+                    riskinput.LazyEpsilons(4, 10, 1, 42).get(
+                        [aid], eids + 5)[0])
+        numpy.testing.assert_equal(
+            calc.datastore['riskinput_info']['sid'], [0, 2])
@@ -19,12 +19,16 @@
 import os
 import mock
 import numpy
+import unittest
 from openquake.baselib import parallel
 from openquake.hazardlib import InvalidFile
+from openquake.hazardlib.probability_map import ProbabilityMap
 from openquake.calculators.views import view
 from openquake.calculators.export import export
 from openquake.calculators.extract import extract
 from openquake.calculators.tests import CalculatorTestCase, NOT_DARWIN
+from openquake.calculators.classical import (
+    PmapAccumulator, ClassicalCalculator)
 from openquake.qa_tests_data.classical import (
     case_1, case_2, case_3, case_4, case_5, case_6, case_7, case_8, case_9,
     case_10, case_11, case_12, case_13, case_14, case_15, case_16, case_17,
@@ -33,6 +37,43 @@ from openquake.qa_tests_data.classical import (
     case_34, case_35, case_36, case_37)
 
 
+class PmapAccumulatorTestCase(unittest.TestCase):
+    def test_flush(self):
+        acc = PmapAccumulator({0: (3, 2), 1: (3, 1)}, num_sites=10,
+                              max_bytes=100)
+        expected = ProbabilityMap(3, 2)
+        with mock.patch('openquake.calculators.classical.SHARD_BYTES', 96):
+            for sids in ([1, 8], [8, 9, 4], [2]):
+                pmap = ProbabilityMap.build(3, 2, sids, initvalue=.1)
+                acc[0] |= pmap
+                expected |= pmap
+                acc.flush_if_needed()
+            self.assertIsNotNone(acc.h5)  # the curves have been flushed
+            self.assertLess(acc.nbytes, 100)
+            acc[1] |= ProbabilityMap.build(3, 1, [5], initvalue=.2)
+            pmaps = dict(acc.items())
+        self.assertEqual(sorted(pmaps[0]), [1, 2, 4, 8, 9])
+        numpy.testing.assert_allclose(pmaps[0].array, expected.array)
+        numpy.testing.assert_allclose(pmaps[1][5].array, .2)
+        path = acc.h5.path
+        acc.close()
+        self.assertFalse(os.path.exists(path))
+
+    def test_close_on_failure(self):
+        acc = PmapAccumulator({0: (3, 1)}, num_sites=10, max_bytes=1)
+        acc[0] |= ProbabilityMap.build(3, 1, [1, 2], initvalue=.1)
+        acc.flush_if_needed()
+        path = acc.h5.path
+        calc = mock.MagicMock()
+        calc.oqparam.disagg_by_src = False
+        calc.datastore.__setitem__.side_effect = OSError('disk full')
+        with self.assertRaises(OSError):
+            ClassicalCalculator.post_execute(calc, acc)
+        self.assertIsNone(acc.h5)
+        self.assertFalse(os.path.exists(path))
+        acc.close()  # closing twice is harmless
+
+
 class ClassicalTestCase(CalculatorTestCase):
 
     def assert_curves_ok(self, expected, test_dir, delta=None, **kw):
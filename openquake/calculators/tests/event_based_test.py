@@ -18,11 +18,12 @@
 import os
 import re
 import math
+import unittest
 
 import numpy.testing
 
 from openquake.baselib.general import group_array, gettemp
-from openquake.baselib.datastore import read
+from openquake.baselib.datastore import read, DataStore
 from openquake.hazardlib import nrml
 from openquake.hazardlib.sourceconverter import RuptureConverter
 from openquake.commonlib.util import max_rel_diff_index
@@ -30,6 +31,9 @@ from openquake.calculators.views import view
 from openquake.calculators.export import export
 from openquake.calculators.extract import extract
 from openquake.calculators.event_based import get_mean_curves
+from openquake.calculators.base import save_gmf_columns
+from openquake.calculators.getters import (
+    GmfDataGetter, GmfGetter, get_gmf_data)
 from openquake.calculators.tests import CalculatorTestCase
 from openquake.qa_tests_data.classical import case_18 as gmpe_tables
 from openquake.qa_tests_data.event_based import (
@@ -80,6 +84,96 @@ def joint_prob_of_occurrence(gmvs_site_1, gmvs_site_2, gmv, time_span,
     return prob
 
 
+class GmfColumnsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dstore = DataStore()
+
+    def tearDown(self):
+        self.dstore.clear()
+
+    def test_save_gmf_columns(self):
+        # rows produced by two tasks, each one sorted by site
+        rows = numpy.zeros(6, [('rlzi', numpy.uint16), ('sid', numpy.uint32),
+                               ('eid', numpy.uint64),
+                               ('gmv', (numpy.float32, (2,)))])
+        rows['sid'] = [0, 2, 2, 0, 1, 2]
+        rows['eid'] = [0, 1, 2, 3, 4, 5]
+        rows['rlzi'] = [0, 0, 1, 1, 1, 1]
+        rows['gmv'][:, 0] = rows['eid'] / 10.
+        rows['gmv'][:, 1] = rows['eid'] / 100.
+        slices_by_sid = {0: [(0, 1), (3, 4)], 1: [(4, 5)],
+                         2: [(1, 3), (5, 6)]}
+        self.dstore['events'] = numpy.zeros(6)
+        counts = save_gmf_columns(self.dstore, rows, slices_by_sid, 4,
+                                  ['PGA', 'SA(0.1)'])
+        numpy.testing.assert_equal(counts, [2, 1, 3, 0])
+        numpy.testing.assert_equal(self.dstore['gmf_data/offsets'].value,
+                                   [0, 2, 3, 6, 6])
+        numpy.testing.assert_equal(self.dstore['gmf_data/eid'].value,
+                                   [0, 3, 4, 1, 2, 5])
+        gmvs = self.dstore['gmf_data/gmv_SA(0.1)'].value
+        numpy.testing.assert_allclose(gmvs, [0, .03, .04, .01, .02, .05])
+        data = get_gmf_data(self.dstore)
+        numpy.testing.assert_equal(data['sid'], [0, 0, 1, 2, 2, 2])
+        numpy.testing.assert_allclose(data['gmv'], rows['gmv'][data['eid']])
+
+        getter = GmfDataGetter(self.dstore, [1, 3, 2], 2)
+        getter.init()
+        self.assertEqual(getter.data[3], {0: 0, 1: 0})  # no GMFs
+        numpy.testing.assert_equal(getter.data[1][1]['eid'], [4])
+        numpy.testing.assert_equal(getter.data[2][1]['eid'], [2, 5])
+        numpy.testing.assert_equal(getter[0][1]['eid'], [3])
+
+
+class GmfPackTestCase(unittest.TestCase):
+    def test_same_as_loop(self):
+        # compare GmfGetter._pack with the original loop on realizations,
+        # events and sites
+        rng = numpy.random.RandomState(42)
+        N, M = 6, 2
+        sids = numpy.array([1, 3, 4, 7, 8, 11], numpy.uint32)
+        rlzs = [0, 2, 3, 5]
+        eids_by_rlz = {0: numpy.array([10, 14, 15], numpy.uint64),
+                       2: numpy.array([], numpy.uint64),  # no events
+                       3: numpy.array([11, 12], numpy.uint64),
+                       5: numpy.array([13, 16, 17, 18], numpy.uint64)}
+        E = 9
+        array = rng.lognormal(-3, 1, (N, M, E)).astype(numpy.float32)
+        min_iml = [.05, .02]  # zeros below the minimum intensity
+        for i, miniml in enumerate(min_iml):
+            arr = array[:, i, :]
+            arr[arr < miniml] = 0
+        array[:, :, 4] = 0  # an event with no GMFs
+        self.assertTrue((array == 0).any() and (array != 0).any())
+
+        getter = GmfGetter.__new__(GmfGetter)
+        getter.gmv_dt = numpy.dtype(
+            [('rlzi', numpy.uint16), ('sid', numpy.uint32),
+             ('eid', numpy.uint64), ('gmv', (numpy.float32, (M,)))])
+        data = []
+        n = 0
+        for rlzi in rlzs:
+            eids = eids_by_rlz[rlzi]
+            e = len(eids)
+            if not e:
+                continue
+            for ei, eid in enumerate(eids):
+                gmf = array[:, :, n + ei]  # shape (N, M)
+                tot = gmf.sum(axis=0)  # shape (M,)
+                if not tot.sum():
+                    continue
+                for sid, gmv in zip(sids, gmf):
+                    if gmv.sum():
+                        data.append((rlzi, sid, eid, gmv))
+            n += e
+        expected = numpy.array(data, getter.gmv_dt)
+        got = getter._pack(array, sids, rlzs, eids_by_rlz)
+        self.assertEqual(got.dtype, expected.dtype)
+        self.assertGreater(len(got), 0)
+        self.assertLess(len(got), N * E)  # some zeros were discarded
+        numpy.testing.assert_array_equal(got, expected)
+
+
 class EventBasedTestCase(CalculatorTestCase):
 
     def test_spatial_correlation(self):
@@ -20,6 +20,10 @@ import sys
 import unittest
 import numpy
 from openquake.baselib.general import gettemp
+from openquake.baselib.datastore import DataStore
+from openquake.risklib.asset import TagCollection, CostCalculator
+from openquake.calculators.getters import AssetGetter
+from openquake.calculators.ebrisk import aggregate_losses
 from openquake.calculators.views import view
 from openquake.calculators.export import export
 from openquake.calculators.tests import CalculatorTestCase, strip_calc_id
@@ -39,6 +43,112 @@ def check_csm_info(calc1, calc2):
                 aae(val1[name], val2[name])
 
 
+class AssetGetterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.dstore = DataStore()
+
+    def tearDown(self):
+        self.dstore.clear()
+
+    def test_get_array(self):
+        tagcol = TagCollection(['taxonomy', 'state'])
+        for taxo in ('RC', 'W'):
+            tagcol.add('taxonomy', taxo)
+        tagcol.add('state', 'Lazio')
+        calc = CostCalculator({'structural': 'per_area'},
+                              {'structural': 'per_asset'},
+                              {'structural': 'EUR'})
+        # the assets on site 1 are not contiguous
+        array = numpy.zeros(5, [
+            ('lon', float), ('lat', float), ('site_id', numpy.uint32),
+            ('number', float), ('area', float), ('value-structural', float),
+            ('occupants_None', float), ('taxonomy', numpy.uint16),
+            ('state', numpy.uint16)])
+        array['site_id'] = [0, 1, 2, 1, 2]
+        array['number'] = [1, 2, 3, 4, 5]
+        array['area'] = 10
+        array['value-structural'] = [100, 200, 300, 400, 500]
+        array['occupants_None'] = [1, 2, 3, 4, 5]
+        array['taxonomy'] = [1, 2, 2, 1, 1]
+        array['state'] = [1, 0, 1, 1, 1]
+        self.dstore['assetcol/array'] = array
+        self.dstore['assetcol/tagcol'] = tagcol
+        self.dstore['assetcol/cost_calculator'] = calc
+        self.dstore.set_attrs('assetcol', loss_types='occupants structural')
+
+        getter = AssetGetter(self.dstore)
+        for sid in range(4):
+            assets, tagidxs = getter.get(sid, ['state'])
+            arr = getter.get_array(sid, ['state'])
+            self.assertEqual([a.ordinal for a in assets], list(arr['ordinal']))
+            self.assertEqual([a.taxonomy for a in assets],
+                             list(arr['taxonomy']))
+            self.assertEqual([tagidxs[a.ordinal] for a in assets],
+                             [tuple(idx) for idx in arr['tagidxs']])
+            for lt in getter.loss_types:
+                self.assertEqual([a.value(lt) for a in assets], list(arr[lt]))
+        arr = getter.get_array(1, [])
+        numpy.testing.assert_equal(arr['ordinal'], [1, 3])
+        numpy.testing.assert_equal(arr['structural'], [4000, 16000])
+        self.assertEqual(arr['tagidxs'].shape, (2, 0))
+
+
+class AggregateLossesTestCase(unittest.TestCase):
+    loss_types = ['structural', 'occupants']
+
+    def aggregate(self, tagnames, shape):
+        # compare aggregate_losses with the original loop on the assets
+        rng = numpy.random.RandomState(42)
+        E, L, A = 7, len(self.loss_types), 10
+        eidx = numpy.array([5, 0, 3, 6])  # the events affecting the site
+        assets = numpy.zeros(8, [
+            ('ordinal', numpy.uint32), ('tagidxs', (int, (len(tagnames),))),
+            ('structural', float), ('occupants', float)])
+        assets['ordinal'] = [0, 2, 3, 4, 5, 7, 8, 9]
+        for i, size in enumerate(shape):
+            assets['tagidxs'][:, i] = rng.randint(size, size=8)
+        assets['structural'] = rng.uniform(100, 1000, 8)
+        assets['occupants'] = rng.randint(1, 10, 8)
+        ratios = rng.uniform(0, 1, (L, len(eidx)))
+        ws_by_lti = rng.uniform(0, 1, (L, len(eidx)))
+
+        acc = numpy.zeros((E, L) + shape, numpy.float32)
+        losses_by_A = numpy.zeros((A, L), numpy.float32)
+        aggregate_losses(acc, losses_by_A, eidx, assets, ratios,
+                         self.loss_types, ws_by_lti, tagnames)
+
+        expected = numpy.zeros((E, L) + shape, numpy.float32)
+        expected_by_A = numpy.zeros((A, L), numpy.float32)
+        for lti, loss_ratios in enumerate(ratios):
+            for asset in assets:
+                aid = asset['ordinal']
+                losses = loss_ratios * asset[self.loss_types[lti]]
+                expected[(eidx, lti) + tuple(asset['tagidxs'])] += losses
+                expected_by_A[aid, lti] += losses @ ws_by_lti[lti]
+        self.assertGreater(acc.sum(), 0)
+        numpy.testing.assert_allclose(acc, expected, rtol=1E-6)
+        numpy.testing.assert_allclose(losses_by_A, expected_by_A, rtol=1E-6)
+
+        # without average losses
+        acc2 = numpy.zeros((E, L) + shape, numpy.float32)
+        aggregate_losses(acc2, None, eidx, assets, ratios,
+                         self.loss_types, ws_by_lti, tagnames)
+        numpy.testing.assert_equal(acc2, acc)
+        return assets
+
+    def test_two_tags(self):
+        assets = self.aggregate(['taxonomy', 'state'], (2, 3))
+        # there are repeated tag combinations
+        ntags = len(numpy.unique(assets['tagidxs'], axis=0))
+        self.assertLess(ntags, len(assets))
+
+    def test_one_tag(self):
+        self.aggregate(['state'], (4,))
+
+    def test_no_tags(self):
+        self.aggregate([], ())
+
+
 class GmfEbRiskTestCase(CalculatorTestCase):
     def test_case_1(self):
         self.run_calc(case_1.__file__, 'job_risk.ini')
@@ -752,7 +752,7 @@ def view_global_gmfs(token, dstore):
     Display GMFs averaged on everything for debugging purposes
     """
     imtls = dstore['oqparam'].imtls
-    row = dstore['gmf_data/data']['gmv'].mean(axis=0)
+    row = getters.get_gmf_data(dstore)['gmv'].mean(axis=0)
     return rst_table([row], header=imtls)
 
 
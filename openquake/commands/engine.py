@@ -167,7 +167,9 @@ def engine(log_file, no_distribute, yes, config_file, make_html_report,
     if config_file:
         config.read(os.path.abspath(os.path.expanduser(config_file)),
                     soft_mem_limit=int, hard_mem_limit=int, port=int,
-                    multi_user=valid.boolean, multi_node=valid.boolean)
+                    multi_user=valid.boolean, multi_node=valid.boolean,
+                    share_arrays=valid.boolean, worker_cache_size=int,
+                    pmap_max_mb=int)
 
     if no_distribute:
         os.environ['OQ_DISTRIBUTE'] = 'no'
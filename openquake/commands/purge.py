@@ -23,6 +23,9 @@ from openquake.baselib import sap, datastore
 from openquake.commonlib.logs import dbcmd
 
 datadir = datastore.get_datadir()
+# the rtree indices of the sites cached by the RtreeFilter
+# the temporary files of an index build which died have a _<pid> suffix
+RTREE_REGEX = r'rtree_[0-9a-f]{40}(_\d+)?\.(idx|dat)$'
 
 
 def purge_one(calc_id, user):
@@ -38,6 +41,17 @@ def purge_one(calc_id, user):
         print('Removed %s' % filename)
 
 
+def purge_rtree():
+    """
+    Remove the rtree indices cached in the datadir
+    """
+    if os.path.exists(datadir):
+        for fname in os.listdir(datadir):
+            if re.match(RTREE_REGEX, fname):
+                os.remove(os.path.join(datadir, fname))
+                print('Removed %s' % fname)
+
+
 # used in the reset command
 def purge_all(user=None, fast=False):
     """
@@ -54,6 +68,7 @@ def purge_all(user=None, fast=False):
                 if mo is not None:
                     calc_id = int(mo.group(1))
                     purge_one(calc_id, user)
+            purge_rtree()
 
 
 @sap.Script
@@ -69,6 +84,8 @@ def purge(calc_id):
             print('Calculation %d not found' % calc_id)
             return
     purge_one(calc_id, getpass.getuser())
+    if not datastore.get_calc_ids(datadir):  # no calculations are left
+        purge_rtree()
 
 
 purge.arg('calc_id', 'calculation ID', type=int)
@@ -30,6 +30,7 @@ from openquake import commonlib
 from openquake.commonlib.readinput import read_csv, get_oqparam
 from openquake.commands.info import info
 from openquake.commands.tidy import tidy
+from openquake.commands.purge import purge_rtree
 from openquake.commands.show import show
 from openquake.commands.show_attrs import show_attrs
 from openquake.commands.export import export
@@ -488,3 +489,17 @@ class PrepareSiteModelTestCase(unittest.TestCase):
         sc = prepare_site_model.func([exposure_xml], [vs30_csv],
                                      True, True, False, 0, 5, output)
         self.assertEqual(len(sc), 148)  # 148 sites within 5 km from the params
+
+
+class PurgeRtreeTestCase(unittest.TestCase):
+    def test(self):
+        datadir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, datadir)
+        fnames = ['rtree_%s.%s' % ('a' * 40, ext) for ext in ('idx', 'dat')]
+        fnames.append('rtree_%s_1234.idx' % ('b' * 40))  # a build which died
+        for fname in fnames + ['calc_1.hdf5']:
+            open(os.path.join(datadir, fname), 'w').close()
+        with mock.patch('openquake.commands.purge.datadir', datadir), \
+                Print.patch():
+            purge_rtree()
+        self.assertEqual(os.listdir(datadir), ['calc_1.hdf5'])
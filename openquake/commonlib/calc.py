@@ -142,41 +142,51 @@ def compute_hazard_maps(curves, imls, poes):
 # #########################  GMF->curves #################################### #
 
 # NB (MS): the approach used here will not work for non-poissonian models
-def _gmvs_to_haz_curve(gmvs, imls, invest_time, duration):
+def gmfdata_to_poes(data, imtls, invest_time, duration):
     """
-    Given a set of ground motion values (``gmvs``) and intensity measure levels
-    (``imls``), compute hazard curve probabilities of exceedance.
-
-    :param gmvs:
-        A list of ground motion values, as floats.
-    :param imls:
-        A list of intensity measure levels, as floats.
+    Compute the hazard curves associated to a set of ground motion values,
+    by counting how many of them meet or exceed the intensity measure levels.
+    The counts for all sites, realizations, IMTs and levels are computed
+    with a single `numpy.bincount` per IMT.
+
+    :param data:
+        an array with fields sid, rlzi and gmv, an array of M floats
+    :param imtls:
+        a DictArray with M IMTs and L levels in total
     :param float invest_time:
         Investigation time, in years. It is with this time span that we compute
         probabilities of exceedance.
-
-        Another way to put it is the following. When computing a hazard curve,
-        we want to answer the question: What is the probability of ground
-        motion meeting or exceeding the specified levels (``imls``) in a given
-        time span (``invest_time``).
     :param float duration:
-        Time window during which GMFs occur. Another was to say it is, the
-        period of time over which we simulate ground motion occurrences.
-
-        NOTE: Duration is computed as the calculation investigation time
+        Time window during which GMFs occur, i.e. the investigation time
         multiplied by the number of stochastic event sets.
-
     :returns:
-        Numpy array of PoEs (probabilities of exceedance).
+        the unique site IDs, the unique realization indices and an array
+        of PoEs of shape (num_sids, num_rlzs, L)
+
+    >>> dt = [('sid', int), ('rlzi', int), ('gmv', (float, (1,)))]
+    >>> data = numpy.zeros(3, dt)
+    >>> data['gmv'][:, 0] = [.04, .05, .01]
+    >>> imtls = general.DictArray({'PGA': [.03, .04, .05]})
+    >>> sids, rlzis, poes = gmfdata_to_poes(data, imtls, numpy.log(2), 1)
+    >>> poes  # 2 gmvs exceed the first and second level, 1 the third level
+    array([[[0.75, 0.75, 0.5 ]]])
     """
-    # convert to numpy array and redimension so that it can be broadcast with
-    # the gmvs for computing PoE values; there is a gmv for each rupture
-    # here is an example: imls = [0.03, 0.04, 0.05], gmvs=[0.04750576]
-    # => num_exceeding = [1, 1, 0] coming from 0.04750576 > [0.03, 0.04, 0.05]
-    imls = numpy.array(imls).reshape((len(imls), 1))
-    num_exceeding = numpy.sum(numpy.array(gmvs) >= imls, axis=1)
-    poes = 1 - numpy.exp(- (invest_time / duration) * num_exceeding)
-    return poes
+    sids, sidx = numpy.unique(data['sid'], return_inverse=True)
+    rlzis, ridx = numpy.unique(data['rlzi'], return_inverse=True)
+    N, R, L = len(sids), len(rlzis), len(imtls.array)
+    counts = numpy.zeros((N, R, L))
+    for m, imt in enumerate(imtls):
+        imls = imtls[imt]
+        n = len(imls) + 1
+        # index of the first level which is not exceeded by each gmv
+        idx = numpy.searchsorted(imls, data['gmv'][:, m], side='right')
+        hist = numpy.bincount((sidx * R + ridx) * n + idx,
+                              minlength=N * R * n).reshape(N, R, n)
+        # the gmvs exceeding the level j are the ones with idx > j
+        counts[:, :, imtls(imt)] = hist[:, :, :0:-1].cumsum(axis=2)[
+            :, :, ::-1]
+    poes = 1. - numpy.exp(- invest_time / duration * counts)
+    return sids, rlzis, poes
 
 
 # ################## utilities for classical calculators ################ #
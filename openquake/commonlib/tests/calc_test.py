@@ -64,3 +64,35 @@ class HazardMapsTestCase(unittest.TestCase):
         ]
         actual = calc.compute_hazard_maps(numpy.array(curves), imls, poes)
         aaae(expected, actual.T)
+
+
+class GmfDataToPoesTestCase(unittest.TestCase):
+
+    def test_same_as_counting(self):
+        # compare with the counting of the exceedances site by site,
+        # realization by realization and IMT by IMT
+        rng = numpy.random.RandomState(42)
+        imtls = general.DictArray({'PGA': [.01, .05, .1, .2],
+                                   'SA(0.5)': [.02, .1, .3]})
+        dt = [('sid', numpy.uint32), ('rlzi', numpy.uint16),
+              ('gmv', (numpy.float32, (2,)))]
+        data = numpy.zeros(1000, dt)
+        data['sid'] = rng.choice([0, 2, 5, 7], 1000)  # no data on 1, 3, ...
+        data['rlzi'] = rng.randint(3, size=1000)
+        data['rlzi'][data['sid'] == 7] = 1  # site 7 has a single rlz
+        data['gmv'] = rng.lognormal(-3, 1, (1000, 2))
+        data['gmv'][:10, 0] = .05  # gmvs equal to a level count as exceeding
+        sids, rlzis, poes = calc.gmfdata_to_poes(data, imtls, 50., 500.)
+        numpy.testing.assert_equal(sids, [0, 2, 5, 7])
+        numpy.testing.assert_equal(rlzis, [0, 1, 2])
+        self.assertEqual(poes.shape, (4, 3, 7))
+        for s, sid in enumerate(sids):
+            for r, rlzi in enumerate(rlzis):
+                ok = (data['sid'] == sid) & (data['rlzi'] == rlzi)
+                for m, imt in enumerate(imtls):
+                    imls = numpy.array(imtls[imt]).reshape(-1, 1)
+                    num_exceeding = numpy.sum(
+                        data['gmv'][ok, m] >= imls, axis=1)
+                    expected = 1 - numpy.exp(- .1 * num_exceeding)
+                    aaae(poes[s, r, imtls(imt)], expected)
+        self.assertEqual(poes[3, 0].sum(), 0)  # no data for rlz 0 on site 7
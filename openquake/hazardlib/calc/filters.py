@@ -18,20 +18,29 @@
 import os
 import sys
 import time
+import hashlib
 import operator
 import collections
 from contextlib import contextmanager
 import numpy
 import rtree
 from scipy.interpolate import interp1d
+from scipy.spatial import cKDTree
 
-from openquake.baselib import hdf5
-from openquake.baselib.general import gettemp, cached_property
+from openquake.baselib import hdf5, datastore
+from openquake.baselib.parallel import SharedArrays
+from openquake.baselib.general import cached_property
 from openquake.baselib.python3compat import raise_
 from openquake.hazardlib.geo.utils import (
     KM_TO_DEGREES, angular_distance, within, fix_lon, get_bounding_box)
+from openquake.hazardlib.geo.geodetic import (
+    EARTH_RADIUS, spherical_to_cartesian)
 
 MAX_DISTANCE = 2000  # km, ultra big distance used if there is no filter
+KDTREE_MIN_SITES = 1000  # use a KD-tree on the sites only above this size
+# distances which are never smaller than the horizontal distance between
+# the site and the surface projection of the rupture
+HORIZONTAL_DISTANCES = frozenset(['rrup', 'rjb', 'rhypo', 'repi'])
 src_group_id = operator.attrgetter('src_group_id')
 
 
@@ -183,6 +192,40 @@ class IntegrationDistance(collections.Mapping):
         return repr(self.dic)
 
 
+def prefilter_sites(sites, rupture, maxdist):
+    """
+    Discard the sites which are surely beyond `maxdist` from the rupture,
+    by querying a KD-tree on the ECEF coordinates of the sites. The tree
+    is built at the first call and stored in the site collection, so that
+    it is reused by all the ruptures of the same source.
+
+    :param sites: a (filtered) site collection
+    :param rupture: a rupture with a .surface
+    :param maxdist: the maximum horizontal distance in km
+    :returns:
+        the sites inside the bounding sphere of the rupture enlarged by
+        `maxdist`, or None if there are no such sites
+    """
+    try:
+        kdtree = vars(sites)['kdtree']
+    except KeyError:
+        kdtree = vars(sites)['kdtree'] = cKDTree(
+            spherical_to_cartesian(sites.lons, sites.lats))
+    mesh = rupture.surface.mesh
+    xyz = spherical_to_cartesian(mesh.lons.flatten(), mesh.lats.flatten())
+    center = xyz.mean(axis=0)
+    radius = numpy.sqrt(((xyz - center) ** 2).sum(axis=1)).max()
+    # the chord is not longer than the distance along the Earth surface;
+    # the last term takes into account the curvature of the surface
+    idxs = kdtree.query_ball_point(
+        center, radius + maxdist + 2 * radius ** 2 / EARTH_RADIUS)
+    if not idxs:
+        return
+    elif len(idxs) == len(sites):
+        return sites
+    return sites.filtered(idxs)
+
+
 def split_sources(srcs):
     """
     :param srcs: sources
@@ -269,8 +312,13 @@ class SourceFilter(object):
             self.__dict__['sitecol'] = sitecol
 
     def __getstate__(self):
-        return dict(filename=self.filename,
-                    integration_distance=self.integration_distance)
+        state = dict(filename=self.filename,
+                     integration_distance=self.integration_distance)
+        if SharedArrays.active and self.filename and self.sitecol:
+            # send the site collection, its arrays are published only once
+            # and the workers attach to them instead of reading the file
+            state['sitecol'] = self.sitecol
+        return state
 
     @property
     def sitecol(self):
@@ -373,12 +421,54 @@ class SourceFilter(object):
                 yield src
 
 
+def _gen_items(lons, lats):
+    # yields the items (id, bbox, obj) used in the bulk loading of an rtree
+    # index; libspatialindex packs them with the Sort-Tile-Recursive algorithm
+    for i, (lon, lat) in enumerate(zip(lons.tolist(), lats.tolist())):
+        yield i, (lon, lat, lon, lat), None
+
+
+def get_indexpath(sitecol, datadir=None):
+    """
+    Build an rtree index of the sites with bulk loading and store it in the
+    datadir, unless an index for the same site coordinates is already there.
+
+    :param sitecol: a site collection
+    :param datadir: the directory where to store the index (default oqdata)
+    :returns: the path of the index, without the .idx and .dat extensions
+    """
+    lons = numpy.array(sitecol.lons, numpy.float64)
+    lats = numpy.array(sitecol.lats, numpy.float64)
+    digest = hashlib.sha1(lons.tobytes() + lats.tobytes()).hexdigest()
+    datadir = datadir or datastore.get_datadir()
+    indexpath = os.path.join(datadir, 'rtree_%s' % digest)
+    if os.path.exists(indexpath + '.idx'):  # already built
+        return indexpath
+    if not os.path.exists(datadir):
+        os.makedirs(datadir)
+    # build the index in temporary files, so that a concurrent calculation
+    # on the same sites never sees an incomplete index
+    tmppath = '%s_%d' % (indexpath, os.getpid())
+    try:
+        rtree.index.Index(tmppath, _gen_items(lons, lats)).close()
+        os.rename(tmppath + '.dat', indexpath + '.dat')
+        os.rename(tmppath + '.idx', indexpath + '.idx')
+    except BaseException:  # remove the temporary files, if any
+        for ext in ('.dat', '.idx'):
+            if os.path.exists(tmppath + ext):
+                os.remove(tmppath + ext)
+        raise
+    return indexpath
+
+
 class RtreeFilter(SourceFilter):
     """
-    The RtreeFilter uses the rtree library. The index is generated at
-    instantiation time and stored in a temporary file. The filter should be
-    instantiated only once per calculation, after the site collection is
-    known. It should be used as follows::
+    The RtreeFilter uses the rtree library. The index is generated with
+    bulk loading at instantiation time and stored in the datadir, with a
+    name depending on the site coordinates, so that calculations on the
+    same sites can reuse it. The filter should be instantiated only once
+    per calculation, after the site collection is known. It should be used
+    as follows::
 
       rfilter = RtreeFilter(sitecol, integration_distance)
       for src, sites in rfilter(sources):
@@ -398,16 +488,16 @@ class RtreeFilter(SourceFilter):
         :class:`openquake.hazardlib.site.SiteCollection` instance
     :param integration_distance:
         Integration distance dictionary (TRT -> distance in km)
+    :param filename:
+        the path of the file containing the site collection, or None
+    :param datadir:
+        the directory where to store the index (default oqdata)
     """
-    def __init__(self, sitecol, integration_distance, filename=None):
+    def __init__(self, sitecol, integration_distance, filename=None,
+                 datadir=None):
         assert sitecol, 'Mandatory in an RtreeFilter'
         super().__init__(sitecol, integration_distance, filename)
-        self.indexpath = gettemp()
-        index = rtree.index.Index(self.indexpath)
-        lonlats = zip(sitecol.lons, sitecol.lats)
-        for i, (lon, lat) in enumerate(lonlats):
-            index.insert(i, (lon, lat, lon, lat))
-        index.close()
+        self.indexpath = get_indexpath(sitecol, datadir)
 
     @cached_property
     def index(self):
@@ -20,8 +20,10 @@
 Module :mod:`~openquake.hazardlib.calc.gmf` exports
 :func:`ground_motion_fields`.
 """
+import zlib
 import numpy
 import scipy.stats
+from scipy.special import ndtr, ndtri
 
 from openquake.hazardlib.const import StdDev
 from openquake.hazardlib.gsim.base import ContextMaker
@@ -48,6 +50,52 @@ def rvs(distribution, *size):
     return array
 
 
+try:  # numpy >= 1.17
+    from numpy.random import Generator, Philox
+except ImportError:
+    Generator = Philox = None
+
+
+def get_rng(seed, *keys):
+    """
+    :param seed: a non-negative integer, for instance a rupture serial
+    :param keys: objects identifying the random stream, like GSIM and IMT
+    :returns:
+        a random generator independent from the global numpy state,
+        depending only on the seed and the string representation of
+        the keys; it is a counter-based Philox generator if available
+        (numpy >= 1.17), otherwise a Mersenne Twister generator
+    """
+    ints = numpy.array([seed % 2 ** 32, seed // 2 ** 32] +
+                       [zlib.crc32(str(key).encode('utf8')) for key in keys],
+                       numpy.uint32)
+    if Generator is None:
+        return numpy.random.RandomState(ints)
+    return Generator(Philox(key=int.from_bytes(ints.tobytes(), 'little')))
+
+
+class TruncNorm(object):
+    """
+    Standard normal distribution truncated at +- truncation_level,
+    or not truncated if the truncation level is None. It is sampled with
+    the given random generator by inverting the cumulative distribution
+    function, which is a lot faster than `scipy.stats.truncnorm.rvs`.
+
+    >>> dist = TruncNorm(2, numpy.random.RandomState(42))
+    >>> abs(dist.rvs((3, 1000))).max() <= 2
+    True
+    """
+    def __init__(self, truncation_level, rng):
+        self.truncation_level = truncation_level
+        self.rng = rng
+
+    def rvs(self, size):
+        if self.truncation_level is None:
+            return self.rng.standard_normal(size)
+        p = ndtr(self.truncation_level)
+        return ndtri(self.rng.uniform(1. - p, p, size))
+
+
 class GmfComputer(object):
     """
     Given an earthquake rupture, the ground motion field computer computes
@@ -75,6 +123,11 @@ class GmfComputer(object):
         :mod:`openquake.hazardlib.correlation`. Can be ``None``, in which
         case non-correlated ground motion fields are calculated.
         Correlation model is not used if ``truncation_level`` is zero.
+
+    :param random_streams:
+        if True, sample the residuals with independent random generators
+        for each (seed, GSIM, IMT), see :func:`get_rng`, instead of
+        reseeding the global numpy generator
     """
     # The GmfComputer is called from the OpenQuake Engine. In that case
     # the rupture is an higher level containing a
@@ -84,7 +137,8 @@ class GmfComputer(object):
     # IMTs, N the number of affected sites and E the number of events. The
     # seed is extracted from the underlying rupture.
     def __init__(self, rupture, sitecol, imts, cmaker,
-                 truncation_level=None, correlation_model=None):
+                 truncation_level=None, correlation_model=None,
+                 random_streams=False):
         if len(sitecol) == 0:
             raise ValueError('No sites')
         elif len(imts) == 0:
@@ -96,6 +150,7 @@ class GmfComputer(object):
         self.gsims = sorted(cmaker.gsims)
         self.truncation_level = truncation_level
         self.correlation_model = correlation_model
+        self.random_streams = random_streams
         # `rupture` can be an EBRupture instance
         if hasattr(rupture, 'srcidx'):
             self.srcidx = rupture.srcidx  # the source the rupture comes from
@@ -121,7 +176,8 @@ class GmfComputer(object):
             seed = seed or self.rupture.serial
         except AttributeError:
             pass
-        if seed is not None:
+        streams = self.random_streams and seed is not None
+        if seed is not None and not streams:
             numpy.random.seed(seed)
         result = numpy.zeros(
             (len(self.imts), len(self.sids), num_events), numpy.float32)
@@ -130,20 +186,22 @@ class GmfComputer(object):
                 gs = gsim[str(imt)]  # MultiGMPE
             else:
                 gs = gsim  # regular GMPE
+            rng = get_rng(seed, gs, imt) if streams else None
             try:
-                result[imti] = self._compute(None, gs, num_events, imt)
+                result[imti] = self._compute(None, gs, num_events, imt, rng)
             except Exception as exc:
                 raise exc.__class__(
                     '%s for %s, %s, srcidx=%s' % (exc, gs, imt, self.srcidx)
                 ).with_traceback(exc.__traceback__)
         return result
 
-    def _compute(self, seed, gsim, num_events, imt):
+    def _compute(self, seed, gsim, num_events, imt, rng=None):
         """
         :param seed: a random seed or None if the seed is already set
         :param gsim: a GSIM instance
         :param num_events: the number of seismic events
         :param imt: an IMT instance
+        :param rng: a random generator or None to use the global one
         :returns: a 32 bit array of shape (num_sites, num_events)
         """
         rctx = getattr(self.rupture, 'rupture', self.rupture)
@@ -158,6 +216,8 @@ class GmfComputer(object):
             mean.shape += (1, )
             mean = mean.repeat(num_events, axis=1)
             return mean
+        elif rng is not None:
+            distribution = TruncNorm(self.truncation_level, rng)
         elif self.truncation_level is None:
             distribution = scipy.stats.norm()
         else:
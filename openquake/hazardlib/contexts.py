@@ -17,20 +17,34 @@
 #  along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
 
 import abc
+import collections
 import numpy
+from scipy.spatial.distance import cdist
 
 from openquake.baselib.hdf5 import vfloat64
 from openquake.baselib.general import AccumDict
 from openquake.baselib.performance import Monitor
-from openquake.hazardlib import imt as imt_module
-from openquake.hazardlib.calc.filters import IntegrationDistance
+from openquake.hazardlib.calc.filters import (
+    IntegrationDistance, HORIZONTAL_DISTANCES, KDTREE_MIN_SITES,
+    prefilter_sites, getdefault)
 from openquake.hazardlib.probability_map import ProbabilityMap
+from openquake.hazardlib.geo import geodetic
+from openquake.hazardlib.geo.mesh import Mesh
 from openquake.hazardlib.geo.surface import PlanarSurface
+from openquake.hazardlib.geo.surface.base import BaseSurface
+from openquake.hazardlib.geo.surface.planar import (
+    build_planes, min_distance_planes, closest_points_planes,
+    jb_distance_planes)
 
 FEWSITES = 10  # if there are few sites store the rupdata
+MAX_BLOCK = 100000  # max number of (rupture, site) pairs in a stacked block
 
 KNOWN_DISTANCES = frozenset(
     'rrup rx ry0 rjb rhypo repi rcdpp azimuth rvolc'.split())
+# the parameters which can be computed from arrays of planar ruptures
+PLANAR_DISTANCES = frozenset('rrup rjb rhypo repi'.split())
+PLANAR_RUPTURE_PARAMETERS = frozenset(
+    'mag strike dip rake ztor hypo_lon hypo_lat hypo_depth width'.split())
 
 
 def get_distances(rupture, mesh, param):
@@ -64,6 +78,104 @@ def get_distances(rupture, mesh, param):
     return dist
 
 
+def get_planar_distances(rups, planes, mesh, params):
+    """
+    :param rups: an array of K planar ruptures
+    :param planes: the K planes of the ruptures, as returned by build_planes
+    :param mesh: a mesh of N points or a site collection
+    :param params: an iterable over distance kinds in PLANAR_DISTANCES
+    :returns: a dictionary param -> array of distances of shape (K, N)
+    """
+    dic = {}
+    hypo = rups['hypo']
+    for param in params:
+        if param == 'rrup':
+            dic[param] = min_distance_planes(planes, mesh.xyz)[0]
+        elif param == 'rjb':
+            dic[param] = jb_distance_planes(planes, mesh)
+        elif param == 'rhypo':
+            depths = (numpy.zeros_like(mesh.lons) if mesh.depths is None
+                      else mesh.depths)
+            dic[param] = geodetic.distance(
+                hypo[:, 0:1], hypo[:, 1:2], hypo[:, 2:3],
+                mesh.lons, mesh.lats, depths)
+        elif param == 'repi':
+            dic[param] = geodetic.geodetic_distance(
+                hypo[:, 0:1], hypo[:, 1:2], mesh.lons, mesh.lats)
+        else:
+            raise ValueError('Unknown planar distance measure %r' % param)
+    return dic
+
+
+class DistancesMemo(object):
+    """
+    Compute the distances from a rupture to a complete site collection on
+    demand, at most once for each kind of distance, and serve them to the
+    filter, the contexts and the rupdata. The distances of a subset of the
+    sites are extracted by site ID.
+
+    :param rupture: a rupture
+    :param sitecol: a complete site collection
+    """
+    def __init__(self, rupture, sitecol):
+        self.rupture = rupture
+        self.sitecol = sitecol
+        self.dist = {}  # distance kind -> array of N distances
+        self.closest = None  # closest points of the rupture to the sites
+
+    def _mesh_based(self):
+        # True if rrup and the closest points come from the same distance
+        # matrix between the rupture mesh and the sites, or from a single
+        # pass on the planes of a multi surface
+        surface = self.rupture.surface
+        if hasattr(surface, 'get_min_distance_closest_points'):
+            return True
+        cls = type(surface)
+        return (cls.get_min_distance is BaseSurface.get_min_distance and
+                cls.get_closest_points is BaseSurface.get_closest_points)
+
+    def _set_rrup_closest(self):
+        surface = self.rupture.surface
+        if hasattr(surface, 'get_min_distance_closest_points'):
+            self.dist['rrup'], _, self.closest = (
+                surface.get_min_distance_closest_points(self.sitecol))
+            return
+        mesh = surface.mesh
+        dists = cdist(mesh.xyz, self.sitecol.xyz)
+        idx = dists.argmin(axis=0)
+        self.dist['rrup'] = dists[idx, numpy.arange(len(idx))]
+        self.closest = Mesh(mesh.lons.take(idx), mesh.lats.take(idx),
+                            mesh.depths.take(idx))
+
+    def get(self, param, sites=None):
+        """
+        :param param: the kind of distance
+        :param sites: a subset of the site collection (default all sites)
+        :returns: an array of distances, one per site
+        """
+        if param not in self.dist:
+            if param == 'rrup' and self._mesh_based():
+                self._set_rrup_closest()
+            else:
+                self.dist[param] = get_distances(
+                    self.rupture, self.sitecol, param)
+        if sites is None:
+            return self.dist[param]
+        return self.dist[param][sites.sids]
+
+    def get_closest_points(self):
+        """
+        :returns: a mesh with the closest points of the rupture to the sites
+        """
+        if self.closest is None:
+            if self._mesh_based():
+                self._set_rrup_closest()
+            else:
+                self.closest = self.rupture.surface.get_closest_points(
+                    self.sitecol)
+        return self.closest
+
+
 class FarAwayRupture(Exception):
     """Raised if the rupture is outside the maximum distance for all sites"""
 
@@ -83,6 +195,7 @@ class ContextMaker(object):
     A class to manage the creation of contexts for distances, sites, rupture.
     """
     REQUIRES = ['DISTANCES', 'SITES_PARAMETERS', 'RUPTURE_PARAMETERS']
+    table_bytes = 256 * 1024 ** 2  # max size of the magdist lookup tables
 
     def __init__(self, trt, gsims, maximum_distance=None, param=None,
                  monitor=Monitor()):
@@ -106,6 +219,33 @@ class ContextMaker(object):
                 filter_distance = 'rrup'
         self.filter_distance = filter_distance
         self.reqv = param.get('reqv')
+        # ruptures with the same parameters can be stacked together only
+        # if all the GSIMs depend on the rupture just via such parameters
+        self.collapse = param.get('collapse_ruptures', True) and all(
+            gsim.collapsible for gsim in gsims)
+        # the ruptures beyond the pointsource_distance use magnitude-distance
+        # lookup tables if the GSIMs require a single distance
+        tolerance = param.get('magdist_tolerance', 0)
+        pdist = self.pointsource_distance.get(trt) if tolerance else None
+        if pdist and self.collapse and len(self.REQUIRES_DISTANCES) == 1:
+            [self.table_distance] = self.REQUIRES_DISTANCES
+            self.dist_step = numpy.log1p(tolerance)
+            # the grid starts at the pointsource_distance, since there
+            # are no lookups for the ruptures closer than that
+            self.dist_start = int(numpy.log1p(pdist) / self.dist_step)
+            stop = numpy.ceil(numpy.log1p(self.maximum_distance(trt)) /
+                              self.dist_step) + 2
+            self.dist_grid = numpy.expm1(numpy.arange(
+                self.dist_start, max(stop, self.dist_start + 2)) *
+                                         self.dist_step)
+            # relative tolerance on the site parameters, used to bin them
+            self.site_tolerance = param.get(
+                'magdist_site_tolerance', {'default': .01})
+            # LRU cache (rupture params, site class) -> poes
+            self.poes_table = collections.OrderedDict()
+            self.table_nbytes = 0
+        else:
+            self.table_distance = None
         self.REQUIRES_DISTANCES.add(self.filter_distance)
         if self.reqv is not None:
             self.REQUIRES_DISTANCES.add('repi')
@@ -121,7 +261,7 @@ class ContextMaker(object):
         self.ctx_mon = monitor('make_contexts', measuremem=False)
         self.poe_mon = monitor('get_poes', measuremem=False)
 
-    def filter(self, sites, rupture):
+    def filter(self, sites, rupture, memo=None):
         """
         Filter the site collection with respect to the rupture.
 
@@ -130,13 +270,28 @@ class ContextMaker(object):
         :param rupture:
             Instance of
             :class:`openquake.hazardlib.source.rupture.BaseRupture`
+        :param memo:
+            a DistancesMemo for the rupture, or None
         :returns:
             (filtered sites, distance context)
         """
-        distances = get_distances(rupture, sites, self.filter_distance)
         if self.maximum_distance:
-            mask = distances <= self.maximum_distance(
+            maxdist = self.maximum_distance(
                 rupture.tectonic_region_type, rupture.mag)
+            if (memo is None and len(sites) >= KDTREE_MIN_SITES and
+                    self.filter_distance in HORIZONTAL_DISTANCES):
+                # compute the distances only for the sites close to the
+                # rupture; this matters for dense grids of sites
+                sites = prefilter_sites(sites, rupture, maxdist)
+                if sites is None:
+                    raise FarAwayRupture(
+                        '%d: beyond %d km' % (rupture.serial, maxdist))
+        if memo is None:
+            distances = get_distances(rupture, sites, self.filter_distance)
+        else:
+            distances = memo.get(self.filter_distance, sites)
+        if self.maximum_distance:
+            mask = distances <= maxdist
             if mask.any():
                 sites, distances = sites.filter(mask), distances[mask]
             else:
@@ -172,7 +327,7 @@ class ContextMaker(object):
                                  (type(self).__name__, param))
             setattr(rupture, param, value)
 
-    def make_contexts(self, sites, rupture):
+    def make_contexts(self, sites, rupture, memo=None):
         """
         Filter the site collection with respect to the rupture and
         create context objects.
@@ -184,6 +339,9 @@ class ContextMaker(object):
             Instance of
             :class:`openquake.hazardlib.source.rupture.BaseRupture`
 
+        :param memo:
+            a DistancesMemo for the rupture, or None
+
         :returns:
             Tuple of two items: sites and distances context.
 
@@ -191,9 +349,12 @@ class ContextMaker(object):
             If any of declared required parameters (site, rupture and
             distance parameters) is unknown.
         """
-        sites, dctx = self.filter(sites, rupture)
+        sites, dctx = self.filter(sites, rupture, memo)
         for param in self.REQUIRES_DISTANCES - set([self.filter_distance]):
-            distances = get_distances(rupture, sites, param)
+            if memo is None:
+                distances = get_distances(rupture, sites, param)
+            else:
+                distances = memo.get(param, sites)
             setattr(dctx, param, distances)
         reqv_obj = (self.reqv.get(rupture.tectonic_region_type)
                     if self.reqv else None)
@@ -216,17 +377,36 @@ class ContextMaker(object):
         :param sites: the sites affected by it
         :yields: (rup, sctx, dctx)
         """
+        for rup, sctx, dctx, far in self._gen_ctxs(src, sites):
+            yield rup, sctx, dctx
+
+    def _planar(self, src):
+        # True if the contexts of the ruptures of the source can be built
+        # directly from arrays of planar ruptures, without rupture objects
+        return (hasattr(src, 'iter_rupture_arrays') and not self.reqv and
+                all(gsim.collapsible for gsim in self.gsims) and
+                self.REQUIRES_DISTANCES <= PLANAR_DISTANCES and
+                self.REQUIRES_RUPTURE_PARAMETERS <= PLANAR_RUPTURE_PARAMETERS)
+
+    def _gen_ctxs(self, src, sites):
+        # yields (rup, sctx, dctx, far) and stores the rupdata
+        if self._planar(src):
+            yield from self._gen_planar_ctxs(src, sites)
+            return
         sitecol = sites.complete
         N = len(sitecol)
         fewsites = N <= FEWSITES
         rupdata = []  # rupture data
-        for rup, sites in self._gen_rup_sites(src, sites):
+        for rup, sites, far in self._gen_rup_sites(src, sites):
+            # with few sites all the distances are computed once on the
+            # complete site collection, since they are needed by the rupdata
+            memo = DistancesMemo(rup, sitecol) if fewsites else None
             try:
                 with self.ctx_mon:
-                    sctx, dctx = self.make_contexts(sites, rup)
+                    sctx, dctx = self.make_contexts(sites, rup, memo)
             except FarAwayRupture:
                 continue
-            yield rup, sctx, dctx
+            yield rup, sctx, dctx, far
             if fewsites:  # store rupdata
                 try:
                     rate = rup.occurrence_rate
@@ -238,13 +418,17 @@ class ContextMaker(object):
                 for rup_param in self.REQUIRES_RUPTURE_PARAMETERS:
                     row.append(getattr(rup, rup_param))
                 for dist_param in self.REQUIRES_DISTANCES:
-                    row.append(get_distances(rup, sitecol, dist_param))
-                closest = rup.surface.get_closest_points(sitecol)
+                    row.append(memo.get(dist_param))
+                closest = memo.get_closest_points()
                 row.append(closest.lons)
                 row.append(closest.lats)
                 row.append(rup.weight)
                 row.append(probs_occur)
                 rupdata.append(tuple(row))
+        self._set_rupdata(rupdata, N)
+
+    def _set_rupdata(self, rupdata, N):
+        # store the rupture data as a composite array
         if rupdata:
             dtlist = [('srcidx', numpy.uint32), ('occurrence_rate', float)]
             for rup_param in self.REQUIRES_RUPTURE_PARAMETERS:
@@ -259,25 +443,128 @@ class ContextMaker(object):
         else:
             self.rupdata = ()
 
-    def _gen_rup_sites(self, src, sites):
-        # implements the pointsource_distance feature
+    def _gen_planar_ctxs(self, src, sites):
+        # same as _gen_ctxs, but the distances of blocks of ruptures are
+        # computed with a single vectorized pass and the ruptures are
+        # replaced by RuptureContexts
+        sitecol = sites.complete
+        N = len(sitecol)
+        fewsites = N <= FEWSITES
+        trt = src.tectonic_region_type
+        rupdata = []  # rupture data
+        for rups, sites, far in self._gen_rup_sites(src, sites, arrays=True):
+            # with few sites all the distances are computed on the complete
+            # site collection, since they are needed by the rupdata
+            mesh = sitecol if fewsites else sites
+            K = max(MAX_BLOCK // len(mesh), 1)
+            for start in range(0, len(rups), K):
+                block = rups[start:start + K]
+                with self.ctx_mon:
+                    planes = build_planes(block['strike'], block['corners'])
+                    dists = get_planar_distances(
+                        block, planes, mesh, self.REQUIRES_DISTANCES)
+                    if fewsites:
+                        _d, xx, yy = min_distance_planes(planes, mesh.xyz)
+                        lons, lats, _d = closest_points_planes(
+                            planes, xx, yy)
+                for k, rec in enumerate(block):
+                    rup = RuptureContext()
+                    rup.mag = rec['mag']
+                    rup.strike = rec['strike']
+                    rup.dip = rec['dip']
+                    rup.rake = rec['rake']
+                    rup.ztor = rec['corners'][2, 0]
+                    rup.hypo_lon, rup.hypo_lat, rup.hypo_depth = rec['hypo']
+                    rup.width = planes['width'][k]
+                    rup.occurrence_rate = rec['rate']
+                    rup.temporal_occurrence_model = (
+                        src.temporal_occurrence_model)
+                    rup.tectonic_region_type = trt
+                    rup.weight = None
+                    dctx = DistancesContext(
+                        (param, dists[param][k][sites.sids] if fewsites
+                         else dists[param][k])
+                        for param in self.REQUIRES_DISTANCES)
+                    if self.maximum_distance:
+                        distances = getattr(dctx, self.filter_distance)
+                        mask = distances <= self.maximum_distance(
+                            trt, rup.mag)
+                        if not mask.any():
+                            continue
+                        r_sites = sites.filter(mask)
+                        for param in self.REQUIRES_DISTANCES:
+                            setattr(dctx, param, getattr(dctx, param)[mask])
+                    else:
+                        r_sites = sites
+                    sctx = SitesContext(
+                        self.REQUIRES_SITES_PARAMETERS, r_sites)
+                    yield rup, sctx, dctx, far
+                    if fewsites:  # store rupdata
+                        row = [src.id or 0, rup.occurrence_rate]
+                        for rup_param in self.REQUIRES_RUPTURE_PARAMETERS:
+                            row.append(getattr(rup, rup_param))
+                        for dist_param in self.REQUIRES_DISTANCES:
+                            row.append(dists[dist_param][k])
+                        row.append(lons[k])
+                        row.append(lats[k])
+                        row.append(rup.weight)
+                        row.append(numpy.zeros(0, numpy.float64))
+                        rupdata.append(tuple(row))
+        self._set_rupdata(rupdata, N)
+
+    def _gen_rup_sites(self, src, sites, arrays=False):
+        # implements the pointsource_distance feature; yields triples
+        # (rup, sites, far) with far=True for the sites beyond pdist;
+        # if arrays is True, yields arrays of planar ruptures instead
+        # of ruptures
+        iter_ruptures = (src.iter_rupture_arrays if arrays
+                         else src.iter_ruptures)
         pdist = self.pointsource_distance.get(src.tectonic_region_type)
         if hasattr(src, 'location') and pdist:
             close_sites, far_sites = sites.split(src.location, pdist)
             if close_sites is None:  # all is far
-                for rup in src.iter_ruptures(False, False):
-                    yield rup, far_sites
+                for rup in iter_ruptures(False, False):
+                    yield rup, far_sites, True
             elif far_sites is None:  # all is close
-                for rup in src.iter_ruptures(True, True):
-                    yield rup, close_sites
+                for rup in iter_ruptures(True, True):
+                    yield rup, close_sites, False
             else:
-                for rup in src.iter_ruptures(True, True):
-                    yield rup, close_sites
-                for rup in src.iter_ruptures(False, False):
-                    yield rup, far_sites
+                for rup in iter_ruptures(True, True):
+                    yield rup, close_sites, False
+                for rup in iter_ruptures(False, False):
+                    yield rup, far_sites, True
         else:
-            for rup in src.iter_ruptures():
-                yield rup, sites
+            for rup in iter_ruptures():
+                yield rup, sites, False
+
+    def gen_blocks(self, src, sites):
+        """
+        :param src: a hazardlib source
+        :param sites: the sites affected by it
+        :yields:
+            pairs (far, block) where block is a list of triples
+            (rup, sctx, dctx) with the same rupture parameters, so that
+            they can be stacked, and far is True for the ruptures
+            beyond the pointsource_distance
+        """
+        if not self.collapse:
+            for rup, sctx, dctx, far in self._gen_ctxs(src, sites):
+                yield far, [(rup, sctx, dctx)]
+            return
+        params = sorted(self.REQUIRES_RUPTURE_PARAMETERS)
+        acc = AccumDict(accum=[])  # (far, rupture parameters) -> triples
+        size = 0  # number of (rupture, site) pairs in acc
+        for rup, sctx, dctx, far in self._gen_ctxs(src, sites):
+            key = (far,) + tuple(getattr(rup, param) for param in params)
+            acc[key].append((rup, sctx, dctx))
+            size += len(sctx.sids)
+            if size > MAX_BLOCK:
+                for key, block in acc.items():
+                    yield key[0], block
+                acc.clear()
+                size = 0
+        for key, block in acc.items():
+            yield key[0], block
 
     def poe_map(self, src, s_sites, imtls, trunclevel, rup_indep=True):
         """
@@ -288,38 +575,126 @@ class ContextMaker(object):
         :param rup_indep: True if the ruptures are independent
         :returns: a ProbabilityMap instance
         """
-        pmap = ProbabilityMap.build(
-            len(imtls.array), len(self.gsims), s_sites.sids,
-            initvalue=rup_indep)
+        # the sids of a SiteCollection are ordered, so the rows associated
+        # to the sites affected by a rupture can be found with searchsorted
+        array = numpy.empty((len(s_sites), len(imtls.array), len(self.gsims)))
+        array.fill(rup_indep)
+        all_sids = s_sites.sids
         eff_ruptures = 0
-        for rup, sctx, dctx in self.gen_rup_contexts(src, s_sites):
-            eff_ruptures += 1
+        for far, block in self.gen_blocks(src, s_sites):
+            eff_ruptures += len(block)
             with self.poe_mon:
-                pnes = self._make_pnes(rup, sctx, dctx, imtls, trunclevel)
-                for sid, pne in zip(sctx.sids, pnes):
+                for rup, sids, pnes in self._gen_pnes(
+                        block, imtls, trunclevel, far):
+                    idx = numpy.searchsorted(all_sids, sids)
                     if rup_indep:
-                        pmap[sid].array *= pne
+                        array[idx] *= pnes
                     else:
-                        pmap[sid].array += (1.-pne) * rup.weight
+                        array[idx] += (1. - pnes) * rup.weight
+        pmap = ProbabilityMap.from_array(array, all_sids)
         if rup_indep:
             pmap = ~pmap
         pmap.eff_ruptures = eff_ruptures
         return pmap
 
     # NB: it is important for this to be fast since it is inside an inner loop
-    def _make_pnes(self, rupture, sctx, dctx, imtls, trunclevel):
-        pne_array = numpy.zeros(
-            (len(sctx.sids), len(imtls.array), len(self.gsims)))
+    def _gen_pnes(self, block, imtls, trunclevel, far=False):
+        # compute the PoEs for all the ruptures in the block with a single
+        # call to get_poes per GSIM and IMT, then split them by rupture
+        rupture = block[0][0]
+        if len(block) == 1:
+            sctx, dctx = block[0][1:]
+        else:
+            sctx = SitesContext.stack([ctxs[1] for ctxs in block])
+            dctx = DistancesContext.stack([ctxs[2] for ctxs in block])
+        if far and self.table_distance:
+            poes = self._lookup_poes(rupture, sctx, dctx, imtls, trunclevel)
+        else:
+            poes = self._get_poes(rupture, sctx, dctx, imtls, trunclevel)
+        start = 0
+        for rup, sctx, dctx in block:
+            stop = start + len(sctx.sids)
+            yield (rup, sctx.sids,
+                   rup.get_probability_no_exceedance(poes[start:stop]))
+            start = stop
+
+    def _get_poes(self, rupture, sctx, dctx, imtls, trunclevel):
+        # returns an array of shape (N, L, G); the PoEs of each GSIM are
+        # computed in place in a contiguous (N, L) slice of a single buffer
+        poes = numpy.empty(
+            (len(self.gsims), len(sctx.sids), len(imtls.array)))
         for i, gsim in enumerate(self.gsims):
             dctx_ = dctx.roundup(gsim.minimum_distance)
-            pnos = []  # list of arrays nsites x nlevels
-            for imt in imtls:
-                poes = gsim.get_poes(
-                    sctx, rupture, dctx_,
-                    imt_module.from_string(imt), imtls[imt], trunclevel)
-                pnos.append(rupture.get_probability_no_exceedance(poes))
-            pne_array[:, :, i] = numpy.concatenate(pnos, axis=1)
-        return pne_array
+            gsim.get_poes_many(sctx, rupture, dctx_, imtls, trunclevel,
+                               poes[i])
+        return poes.transpose(1, 2, 0)
+
+    def _site_classes(self, sctx):
+        # bin the float site parameters on a logarithmic grid with step
+        # log(1 + site_tolerance); returns the unique site classes and
+        # the index of the class of each site
+        params = sorted(self.REQUIRES_SITES_PARAMETERS)
+        sitedata = numpy.zeros(len(sctx.sids), [
+            (param, getattr(sctx, param).dtype) for param in params] or
+                               [('dummy', numpy.uint8)])
+        for param in params:
+            values = getattr(sctx, param)
+            tol = getdefault(self.site_tolerance, param)
+            if tol and values.dtype.kind == 'f':
+                step = numpy.log1p(tol)
+                values = numpy.sign(values) * numpy.expm1(numpy.round(
+                    numpy.log1p(numpy.abs(values)) / step) * step)
+            sitedata[param] = values
+        return numpy.unique(sitedata, return_inverse=True)
+
+    def _lookup_poes(self, rupture, sctx, dctx, imtls, trunclevel):
+        # interpolate the PoEs from tables on a logarithmic distance grid;
+        # there is a table for each combination of rupture parameters and
+        # site class, built only the first time it is needed and discarded
+        # when the cache exceeds `table_bytes` (least recently used first)
+        rupkey = tuple(getattr(rupture, param) for param in
+                       sorted(self.REQUIRES_RUPTURE_PARAMETERS))
+        params = sorted(self.REQUIRES_SITES_PARAMETERS)
+        uniq, inv = self._site_classes(sctx)
+        keys = [(rupkey, rec.tobytes()) for rec in uniq]
+        tables = [self.poes_table.pop(key, None) for key in keys]
+        missing = [u for u, table in enumerate(tables) if table is None]
+        D = len(self.dist_grid)
+        if missing:  # build the missing tables with a single call
+            gsctx = SitesContext(params)
+            gsctx.sids = numpy.zeros(len(missing) * D, numpy.uint32)
+            for param in params:
+                setattr(gsctx, param, numpy.repeat(uniq[param][missing], D))
+            gdctx = DistancesContext([(self.table_distance, numpy.tile(
+                self.dist_grid, len(missing)))])
+            gpoes = self._get_poes(rupture, gsctx, gdctx, imtls, trunclevel)
+            for u, array in zip(missing, numpy.split(gpoes, len(missing))):
+                tables[u] = array
+                self.table_nbytes += array.nbytes
+        for key, table in zip(keys, tables):
+            self.poes_table[key] = table  # now it is the most recently used
+        while (self.table_nbytes > self.table_bytes and
+               len(self.poes_table) > len(keys)):
+            self.table_nbytes -= self.poes_table.popitem(last=False)[1].nbytes
+        tables = numpy.array(tables)
+        # linear interpolation in log(1 + distance)
+        dist = getattr(dctx, self.table_distance)
+        x = numpy.minimum(numpy.log1p(dist) / self.dist_step -
+                          self.dist_start, D - 1)
+        near = x < 0  # closer than the start of the grid
+        x[near] = 0
+        idx = numpy.minimum(x.astype(int), D - 2)
+        frac = (x - idx).reshape(-1, 1, 1)
+        poes = tables[inv, idx] * (1. - frac) + tables[inv, idx + 1] * frac
+        if near.any():  # compute the PoEs of the near sites directly
+            nsctx = SitesContext(params)
+            nsctx.sids = sctx.sids[near]
+            for param in params:
+                setattr(nsctx, param, getattr(sctx, param)[near])
+            ndctx = DistancesContext([(self.table_distance, dist[near])])
+            poes[near] = self._get_poes(
+                rupture, nsctx, ndctx, imtls, trunclevel)
+        return poes
 
     def disaggregate(self, sitecol, ruptures, iml4, truncnorm, epsilons,
                      monitor=Monitor()):
@@ -340,13 +715,14 @@ class ContextMaker(object):
         pne_mon = monitor('disaggregate_pne', measuremem=False)
         clo_mon = monitor('get_closest', measuremem=False)
         for rupture in ruptures:
+            memo = DistancesMemo(rupture, sitecol)
             with ctx_mon:
                 orig_dctx = DistancesContext(
-                    (param, get_distances(rupture, sitecol, param))
+                    (param, memo.get(param))
                     for param in self.REQUIRES_DISTANCES)
                 self.add_rup_params(rupture)
             with clo_mon:  # this is faster than computing orig_dctx
-                closest_points = rupture.surface.get_closest_points(sitecol)
+                closest_points = memo.get_closest_points()
             cache = {}
             for rlz, gsim in self.gsim_by_rlzi.items():
                 dctx = orig_dctx.roundup(gsim.minimum_distance)
@@ -410,6 +786,20 @@ class SitesContext(BaseContext):
             for slot in slots:
                 setattr(self, slot, getattr(sitecol, slot))
 
+    @classmethod
+    def stack(cls, sctxs):
+        """
+        :param sctxs: a list of SitesContexts with the same slots
+        :returns: a SitesContext with the concatenated site parameters
+        """
+        slots = sctxs[0]._slots_
+        self = cls(slots)
+        self.sids = numpy.concatenate([sctx.sids for sctx in sctxs])
+        for slot in slots:
+            setattr(self, slot, numpy.concatenate(
+                [getattr(sctx, slot) for sctx in sctxs]))
+        return self
+
 
 class DistancesContext(BaseContext):
     """
@@ -430,6 +820,16 @@ class DistancesContext(BaseContext):
         for param, dist in param_dist_pairs:
             setattr(self, param, dist)
 
+    @classmethod
+    def stack(cls, dctxs):
+        """
+        :param dctxs: a list of DistancesContexts with the same distances
+        :returns: a DistancesContext with the concatenated distances
+        """
+        return cls((param, numpy.concatenate(
+            [getattr(dctx, param) for dctx in dctxs]))
+                   for param in vars(dctxs[0]))
+
     def roundup(self, minimum_distance):
         """
         If the minimum_distance is nonzero, returns a copy of the
@@ -443,7 +843,7 @@ class DistancesContext(BaseContext):
         for dist, array in vars(self).items():
             small_distances = array < minimum_distance
             if small_distances.any():
-                array = array[:]  # make a copy first
+                array = array.copy()  # the original may be shared
                 array[small_distances] = minimum_distance
             setattr(ctx, dist, array)
         return ctx
@@ -18,6 +18,8 @@ Module :mod:`openquake.hazardlib.correlation` defines correlation models for
 spatially-distributed ground-shaking intensities.
 """
 import abc
+import hashlib
+import collections
 import numpy
 
 
@@ -26,6 +28,61 @@ class BaseCorrelationModel(metaclass=abc.ABCMeta):
     Base class for correlation models for spatially-distributed ground-shaking
     intensities.
     """
+    max_error = 0  # exact factorization of the correlation matrix
+    cache_bytes = 256 * 1024 ** 2  # max size of the cached factors
+    cache_nbytes = 0  # current size of the cached factors
+
+    def _get_factor(self, sites, imt, factorize):
+        # LRU cache (imt, sids) -> factor of the correlation matrix, so that
+        # the factor is computed only once for all the ruptures affecting
+        # the same sites; the least recently used factors are discarded
+        # when the cache exceeds `cache_bytes`
+        key = (str(imt), hashlib.sha1(sites.sids.tobytes()).digest())
+        try:
+            factor = self.cache.pop(key)
+        except KeyError:
+            factor = factorize(sites, imt)
+            self.cache_nbytes += _nbytes(factor)
+        self.cache[key] = factor  # now it is the most recently used
+        while self.cache_nbytes > self.cache_bytes and len(self.cache) > 1:
+            self.cache_nbytes -= _nbytes(self.cache.popitem(last=False)[1])
+        return factor
+
+    def factorize(self, sites, imt):
+        """
+        :returns:
+            the lower triangle matrix of the correlation matrix of the
+            given sites or, if `max_error` is positive, a low rank
+            factorization, see :func:`low_rank_factor`
+        """
+        if self.max_error:
+            return low_rank_factor(
+                self._get_correlation_matrix(sites, imt), self.max_error)
+        return self.get_lower_triangle_correlation_matrix(sites, imt)
+
+    def get_lower_triangle_correlation_matrix(self, sites, imt):
+        """
+        Get lower-triangle matrix as a result of Cholesky-decomposition
+        of correlation matrix.
+
+        The resulting matrix should have zeros on values above
+        the main diagonal.
+
+        The actual implementations of :class:`BaseCorrelationModel` interface
+        might calculate the matrix considering site collection and IMT (like
+        :class:`JB2009CorrelationModel` does) or might have it pre-constructed
+        for a specific site collection and IMT, in which case they will need
+        to make sure that parameters to this function match parameters that
+        were used to pre-calculate decomposed correlation matrix.
+
+        :param sites:
+            :class:`~openquake.hazardlib.site.SiteCollection` to create
+            correlation matrix for.
+        :param imt:
+            Intensity measure type object, see :mod:`openquake.hazardlib.imt`.
+        """
+        return numpy.linalg.cholesky(self._get_correlation_matrix(sites, imt))
+
     def apply_correlation(self, sites, imt, residuals, stddev_intra=0):
         """
         Apply correlation to randomly sampled residuals.
@@ -46,29 +103,53 @@ class BaseCorrelationModel(metaclass=abc.ABCMeta):
             Array of the same structure and semantics as ``residuals``
             but with correlations applied.
 
-        NB: the correlation matrix is cached. It is computed only once
-        per IMT for the complete site collection and then the portion
-        corresponding to the sites is multiplied by the residuals.
+        NB: the correlation matrix is factorized only for the given sites
+        and the factor is cached, so that it is computed only once for all
+        the ruptures affecting the same sites.
         """
         # intra-event residual for a single relization is a product
         # of lower-triangle decomposed correlation matrix and vector
         # of N random numbers (where N is equal to number of sites).
         # we need to do that multiplication once per realization
         # with the same matrix and different vectors.
-        try:
-            corma = self.cache[imt]
-        except KeyError:
-            corma = self.get_lower_triangle_correlation_matrix(
-                sites.complete, imt)
-            self.cache[imt] = corma
-        if len(sites.complete) == len(sites):
-            return numpy.dot(corma, residuals)
-        # it is important to allocate little memory, this is why I am
-        # accumulating below; if S is the length of the complete sites
-        # the correlation matrix has shape (S, S) and the residuals (N, s),
-        # where s is the number of samples
-        return numpy.sum(corma[sites.sids, sid] * res
-                         for sid, res in zip(sites.sids, residuals))
+        factor = self._get_factor(sites, imt, self.factorize)
+        if isinstance(factor, tuple):  # low rank factor
+            vecs, sqrtvals = factor
+            return vecs.dot(sqrtvals[:, None] * vecs.T.dot(residuals))
+        return numpy.dot(factor, residuals)
+
+
+def _nbytes(factor):
+    # size of a factor of the correlation matrix
+    if isinstance(factor, tuple):
+        return sum(array.nbytes for array in factor)
+    return factor.nbytes
+
+
+def low_rank_factor(corma, max_error):
+    """
+    Approximate a correlation matrix C with the matrix C_k = V diag(l) V^T
+    of lower rank, where l are the eigenvalues of C larger than `max_error`
+    and V the corresponding eigenvectors. The spectral norm of C - C_k is
+    the largest discarded eigenvalue, therefore every element of C_k
+    differs from the corresponding element of C by at most `max_error`;
+    in particular the variances on the diagonal are never overestimated
+    and underestimated at most by `max_error`. The correlated residuals
+    are obtained by multiplying the sampled residuals by the symmetric
+    matrix V diag(sqrt(l)) V^T, with a cost proportional to the rank k
+    instead of the number of sites.
+
+    :param corma: a correlation matrix of shape (N, N)
+    :param max_error: the maximum error on the elements of the matrix
+    :returns: a pair of arrays V, sqrt(l) of shape (N, k) and (k,)
+
+    >>> vecs, sqrtvals = low_rank_factor(numpy.array([[1, .5], [.5, 1]]), .6)
+    >>> vecs.shape, sqrtvals ** 2
+    ((2, 1), array([1.5]))
+    """
+    vals, vecs = numpy.linalg.eigh(numpy.asarray(corma))
+    ok = vals > max_error
+    return vecs[:, ok], numpy.sqrt(vals[ok])
 
 
 class JB2009CorrelationModel(BaseCorrelationModel):
@@ -81,37 +162,19 @@ class JB2009CorrelationModel(BaseCorrelationModel):
         Boolean value to indicate whether "Case 1" or "Case 2" from page 1700
         should be applied. ``True`` value means that Vs 30 values show or are
         expected to show clustering ("Case 2"), ``False`` means otherwise.
+    :param max_error:
+        If positive, use a low rank approximation of the correlation matrix
+        with an error on its elements not larger than `max_error`, see
+        :func:`low_rank_factor`. The default is 0, i.e. no approximation.
     """
-    def __init__(self, vs30_clustering):
+    def __init__(self, vs30_clustering, max_error=0):
         self.vs30_clustering = vs30_clustering
-        self.cache = {}  # imt -> correlation model
+        self.max_error = max_error
+        self.cache = collections.OrderedDict()  # imt, sids -> factor
 
     def _get_correlation_matrix(self, sites, imt):
         return jbcorrelation(sites, imt, self.vs30_clustering)
 
-    def get_lower_triangle_correlation_matrix(self, sites, imt):
-        """
-        Get lower-triangle matrix as a result of Cholesky-decomposition
-        of correlation matrix.
-
-        The resulting matrix should have zeros on values above
-        the main diagonal.
-
-        The actual implementations of :class:`BaseCorrelationModel` interface
-        might calculate the matrix considering site collection and IMT (like
-        :class:`JB2009CorrelationModel` does) or might have it pre-constructed
-        for a specific site collection and IMT, in which case they will need
-        to make sure that parameters to this function match parameters that
-        were used to pre-calculate decomposed correlation matrix.
-
-        :param sites:
-            :class:`~openquake.hazardlib.site.SiteCollection` to create
-            correlation matrix for.
-        :param imt:
-            Intensity measure type object, see :mod:`openquake.hazardlib.imt`.
-        """
-        return numpy.linalg.cholesky(self._get_correlation_matrix(sites, imt))
-
 
 def jbcorrelation(sites_or_distances, imt, vs30_clustering=False):
         """
@@ -160,7 +223,7 @@ class HM2018CorrelationModel(BaseCorrelationModel):
     def __init__(self, uncertainty_multiplier=0):
         self.uncertainty_multiplier = uncertainty_multiplier
         self.distance_matrix = {}
-        self.cache = {}
+        self.cache = collections.OrderedDict()  # imt, sids -> factor
 
     def _get_correlation_matrix(self, sites, imt):
         return hmcorrelation(sites, imt, self.uncertainty_multiplier)
@@ -189,21 +252,12 @@ class HM2018CorrelationModel(BaseCorrelationModel):
             # corresponding standard deviation element.
             residuals_norm = residuals / stddev_intra[sites.sids, None]
 
-            # Lower diagonal of the Cholesky decomposition from/to cache
-            try:
-                cormaLow = self.cache[imt]
-            except KeyError:
-                # Note that instead of computing the whole correlation matrix
-                # corresponding to sites.complete, here we compute only the
-                # correlation matrix corresponding to sites.
-                cormaLow = numpy.linalg.cholesky(
-                       numpy.diag(stddev_intra[sites.sids]) *
-                       self._get_correlation_matrix(sites, imt) *
-                       numpy.diag(stddev_intra[sites.sids]))
-                self.cache[imt] = cormaLow
-
-            # Apply correlation
-            return numpy.dot(cormaLow, residuals_norm)
+            # Since chol(D C D) = D chol(C) for the diagonal matrix D of the
+            # standard deviations, only the factor of the correlation matrix
+            # C is cached (it does not depend on the rupture) and the
+            # correlated residuals are scaled by stddev_intra afterwards
+            return stddev_intra[sites.sids, None] * numpy.asarray(
+                super().apply_correlation(sites, imt, residuals_norm))
 
         else:   # Variability (uncertainty) is included
             nsim = len(residuals[1])
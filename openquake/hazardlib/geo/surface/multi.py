@@ -23,12 +23,15 @@ Module :mod:`openquake.hazardlib.geo.surface.multi` defines
 import numpy
 from copy import deepcopy
 from scipy.spatial.distance import pdist, squareform
+from openquake.baselib.general import cached_property
 from openquake.hazardlib.geo.surface.base import BaseSurface, downsample_trace
 from openquake.hazardlib.geo.mesh import Mesh
 from openquake.hazardlib.geo import utils
 from openquake.hazardlib.geo.surface import (
     PlanarSurface, SimpleFaultSurface, ComplexFaultSurface)
 from openquake.hazardlib.geo.surface.gridded import GriddedSurface
+from openquake.hazardlib.geo.surface.planar import (
+    min_distance_planes, closest_points_planes, jb_distance_planes)
 
 
 class MultiSurface(BaseSurface):
@@ -158,28 +161,43 @@ class MultiSurface(BaseSurface):
                 raise ValueError("Surface %s not recognised" % str(surface))
         return edges
 
-    def get_min_distance(self, mesh):
-        """
-        For each point in ``mesh`` compute the minimum distance to each
-        surface element and return the smallest value.
-
-        See :meth:`superclass method
-        <.base.BaseSurface.get_min_distance>`
-        for spec of input and result values.
-        """
-        dists = [surf.get_min_distance(mesh) for surf in self.surfaces]
-
-        return numpy.min(dists, axis=0)
-
-    def get_closest_points(self, mesh):
-        """
-        For each point in ``mesh`` find the closest surface element, and return
-        the corresponding closest point.
-
-        See :meth:`superclass method
-        <.base.BaseSurface.get_closest_points>`
-        for spec of input and result values.
+    @cached_property
+    def planes(self):
         """
+        :returns:
+            the parameters of the planes stacked in arrays of shape (P, ...)
+            if all the surfaces are planar, otherwise None
+        """
+        if not all(isinstance(surf, PlanarSurface) for surf in self.surfaces):
+            return None
+        dic = {}
+        for name in ('normal', 'd', 'zero_zero', 'uv1', 'uv2', 'length',
+                     'width', 'corner_lons', 'corner_lats', 'strike'):
+            dic[name] = numpy.array(
+                [getattr(surf, name) for surf in self.surfaces])
+        return dic
+
+    def get_min_distance_closest_points(self, mesh):
+        """
+        For each point in ``mesh`` compute the minimum distance to the
+        surface, the index of the closest surface element and the closest
+        point. If all the surface elements are planar the distances to all
+        the planes are computed in a single vectorized pass, otherwise the
+        distances to each surface element are computed only once.
+
+        :returns: (distances, surface indices, closest points mesh)
+        """
+        if self.planes is None:
+            return self._get_min_distance_closest_points(mesh)
+        dists, xx, yy = min_distance_planes(self.planes, mesh.xyz)
+        idx = dists.argmin(axis=0)
+        lons, lats, depths = closest_points_planes(self.planes, xx, yy, idx)
+        shape = mesh.lons.shape
+        closest = Mesh(lons.reshape(shape), lats.reshape(shape),
+                       None if mesh.depths is None else depths.reshape(shape))
+        return dists[idx, numpy.arange(len(idx))], idx, closest
+
+    def _get_min_distance_closest_points(self, mesh):
         # first, for each point in mesh compute minimum distance to each
         # surface. The distance matrix is flattend, because mesh can be of
         # an arbitrary shape. By flattening we obtain a ``distances`` matrix
@@ -190,9 +208,9 @@ class MultiSurface(BaseSurface):
         )
 
         # find for each point in mesh the index of closest surface
-        idx = dists == numpy.min(dists, axis=0)
+        idx = dists.argmin(axis=0)
 
-        # loop again over surfaces. For each surface compute the closest
+        # loop over the surfaces. For each surface compute the closest
         # points, and associate them to the mesh points for which the surface
         # is the closest. Note that if a surface is not the closest to any of
         # the mesh points then the calculation is skipped
@@ -201,19 +219,46 @@ class MultiSurface(BaseSurface):
         depths = None if mesh.depths is None else \
             numpy.empty_like(mesh.depths.flatten())
         for i, surf in enumerate(self.surfaces):
-            if not idx[i, :].any():
+            ok = idx == i
+            if not ok.any():
                 continue
             cps = surf.get_closest_points(mesh)
-            lons[idx[i, :]] = cps.lons.flatten()[idx[i, :]]
-            lats[idx[i, :]] = cps.lats.flatten()[idx[i, :]]
+            lons[ok] = cps.lons.flatten()[ok]
+            lats[ok] = cps.lats.flatten()[ok]
             if depths is not None:
-                depths[idx[i, :]] = cps.depths.flatten()[idx[i, :]]
+                depths[ok] = cps.depths.flatten()[ok]
         lons = lons.reshape(mesh.lons.shape)
         lats = lats.reshape(mesh.lats.shape)
         if depths is not None:
             depths = depths.reshape(mesh.depths.shape)
+        return (dists[idx, numpy.arange(len(idx))], idx,
+                Mesh(lons, lats, depths))
 
-        return Mesh(lons, lats, depths)
+    def get_min_distance(self, mesh):
+        """
+        For each point in ``mesh`` compute the minimum distance to each
+        surface element and return the smallest value.
+
+        See :meth:`superclass method
+        <.base.BaseSurface.get_min_distance>`
+        for spec of input and result values.
+        """
+        if self.planes is not None:
+            return self.get_min_distance_closest_points(mesh)[0]
+        dists = [surf.get_min_distance(mesh) for surf in self.surfaces]
+
+        return numpy.min(dists, axis=0)
+
+    def get_closest_points(self, mesh):
+        """
+        For each point in ``mesh`` find the closest surface element, and return
+        the corresponding closest point.
+
+        See :meth:`superclass method
+        <.base.BaseSurface.get_closest_points>`
+        for spec of input and result values.
+        """
+        return self.get_min_distance_closest_points(mesh)[2]
 
     def get_joyner_boore_distance(self, mesh):
         """
@@ -224,6 +269,9 @@ class MultiSurface(BaseSurface):
         <.base.BaseSurface.get_joyner_boore_distance>`
         for spec of input and result values.
         """
+        if self.planes is not None:
+            return jb_distance_planes(self.planes, mesh).min(axis=0).reshape(
+                mesh.lons.shape)
         # for each point in mesh compute the Joyner-Boore distance to all the
         # surfaces and return the shortest one.
         dists = [
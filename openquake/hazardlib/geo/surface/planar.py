@@ -22,6 +22,7 @@ Module :mod:`openquake.hazardlib.geo.surface.planar` contains
 """
 import logging
 import numpy
+from scipy.spatial.distance import cdist
 from openquake.baselib.node import Node
 from openquake.hazardlib.geo import Point
 from openquake.hazardlib.geo.surface.base import BaseSurface
@@ -620,3 +621,124 @@ class PlanarSurface(BaseSurface):
         """
         return [self.corner_lons.take([0, 1, 3, 2, 0])], \
                [self.corner_lats.take([0, 1, 3, 2, 0])]
+
+
+# vectorized versions of the PlanarSurface methods, working on P planes at
+# the same time; ``planes`` is a dictionary with keys normal, d, zero_zero,
+# uv1, uv2, length, width, corner_lons, corner_lats and strike, with values
+# the corresponding PlanarSurface attributes stacked in arrays of length P
+
+def _project_planes(planes, xyz):
+    # vectorized version of PlanarSurface._project; xyz is an array of
+    # shape (N, 3) or (P, N, 3); returns three arrays of shape (P, N)
+    normal = planes['normal'][:, None]
+    dists = (normal * xyz).sum(axis=-1) + planes['d'][:, None]
+    projs = xyz - normal * dists[:, :, None]
+    vectors2d = projs - planes['zero_zero'][:, None]
+    xx = (vectors2d * planes['uv1'][:, None]).sum(axis=-1)
+    yy = (vectors2d * planes['uv2'][:, None]).sum(axis=-1)
+    return dists, xx, yy
+
+
+def build_planes(strikes, corners):
+    """
+    :param strikes: an array of P strikes
+    :param corners:
+        an array of shape (P, 3, 4) with the longitudes, latitudes and depths
+        of the corners top left, top right, bottom left, bottom right
+    :returns: a dictionary of stacked plane parameters
+    """
+    # see PlanarSurface._init_plane and PlanarSurface.__init__
+    xyz = geo_utils.spherical_to_cartesian(
+        corners[:, 0], corners[:, 1], corners[:, 2])  # shape (P, 4, 3)
+    tl, tr, bl = xyz[:, 0], xyz[:, 1], xyz[:, 2]
+    normal = geo_utils.normalized(numpy.cross(tl - tr, tl - bl))
+    uv1 = geo_utils.normalized(tr - tl)
+    planes = dict(normal=normal, d=-(normal * tl).sum(axis=-1),
+                  zero_zero=tl, uv1=uv1, uv2=numpy.cross(normal, uv1),
+                  corner_lons=corners[:, 0], corner_lats=corners[:, 1],
+                  strike=strikes)
+    _dists, xx, yy = _project_planes(planes, xyz)
+    planes['length'] = ((xx[:, 1] - xx[:, 0]) + (xx[:, 3] - xx[:, 2])) / 2.0
+    planes['width'] = ((yy[:, 2] - yy[:, 0]) + (yy[:, 3] - yy[:, 1])) / 2.0
+    return planes
+
+
+def min_distance_planes(planes, xyz):
+    """
+    :param planes: a dictionary of stacked plane parameters
+    :param xyz: an array of N cartesian points
+    :returns:
+        the distances between the planes and the points, plus the
+        coordinates of the projections of the points on the planes,
+        as three arrays of shape (P, N)
+    """
+    # see PlanarSurface.get_min_distance for the meaning of the cases
+    dists, xx, yy = _project_planes(planes, xyz)
+    length = planes['length'][:, None]
+    width = planes['width'][:, None]
+    mxx = numpy.select([xx < 0, xx > length], [xx, xx - length], 0)
+    myy = numpy.select([yy < 0, yy > width], [yy, yy - width], 0)
+    return numpy.sqrt(dists ** 2 + (mxx ** 2 + myy ** 2)), xx, yy
+
+
+def closest_points_planes(planes, xx, yy, idx=None):
+    """
+    :param planes: a dictionary of stacked plane parameters
+    :param xx: an array of shape (P, N) as returned by min_distance_planes
+    :param yy: an array of shape (P, N) as returned by min_distance_planes
+    :param idx:
+        an array with the index of a plane for each of the N points, or None
+    :returns:
+        lons, lats and depths of the points of the given planes closest to
+        the N points; if idx is None, arrays of shape (P, N) with the points
+        of each plane closest to the N points
+    """
+    # see PlanarSurface.get_closest_points
+    if idx is None:
+        mxx = xx.clip(0, planes['length'][:, None])
+        myy = yy.clip(0, planes['width'][:, None])
+        vectors = (planes['zero_zero'][:, None] +
+                   planes['uv1'][:, None] * mxx[:, :, None] +
+                   planes['uv2'][:, None] * myy[:, :, None])
+        return [coords.reshape(xx.shape) for coords in
+                geo_utils.cartesian_to_spherical(vectors.reshape(-1, 3))]
+    sids = numpy.arange(len(idx))
+    mxx = xx[idx, sids].clip(0, planes['length'][idx])
+    myy = yy[idx, sids].clip(0, planes['width'][idx])
+    vectors = (planes['zero_zero'][idx] + planes['uv1'][idx] * mxx[:, None] +
+               planes['uv2'][idx] * myy[:, None])
+    return geo_utils.cartesian_to_spherical(vectors)
+
+
+def jb_distance_planes(planes, mesh):
+    """
+    :param planes: a dictionary of stacked plane parameters
+    :param mesh: a mesh of N points
+    :returns: the Joyner-Boore distances as an array of shape (P, N)
+    """
+    # see PlanarSurface.get_joyner_boore_distance for the meaning of the
+    # arcs and of the cases
+    P = len(planes['strike'])
+    arcs_lons = planes['corner_lons'][:, [0, 2, 0, 1]].flatten()
+    arcs_lats = planes['corner_lats'][:, [0, 2, 0, 1]].flatten()
+    downdip_azimuth = (planes['strike'] + 90) % 360
+    arcs_azimuths = numpy.array(
+        [planes['strike'], planes['strike'], downdip_azimuth, downdip_azimuth]
+    ).T.flatten()
+    dists_to_arcs = geodetic.distance_to_arc(
+        arcs_lons, arcs_lats, arcs_azimuths,
+        mesh.lons.reshape((-1, 1)), mesh.lats.reshape((-1, 1))
+    ).reshape(-1, P, 4)  # shape (N, P, 4)
+    corners = geo_utils.spherical_to_cartesian(
+        planes['corner_lons'].flatten(), planes['corner_lats'].flatten())
+    dists_to_corners = cdist(corners, mesh.xyz).reshape(
+        P, 4, -1).min(axis=1).T  # shape (N, P)
+    ds1, ds2, ds3, ds4 = numpy.sign(dists_to_arcs).transpose(2, 0, 1)
+    dists_to_arcs = numpy.abs(dists_to_arcs).reshape(
+        -1, P, 2, 2).min(axis=-1)
+    jb_dists = numpy.select(
+        [(ds1 == ds2) & (ds3 == ds4), ds1 == ds2, ds3 == ds4],
+        [dists_to_corners, dists_to_arcs[:, :, 0], dists_to_arcs[:, :, 1]],
+        0)
+    return jb_dists.T
@@ -502,10 +502,27 @@ def normalized(vector):
     return vector / length
 
 
+def _polygon_segments(polygon):
+    # returns the arrays x0, y0, x1, y1 of the segments of all the rings
+    # (exteriors and holes) of a Polygon or MultiPolygon
+    rings = []
+    for poly in getattr(polygon, 'geoms', [polygon]):
+        rings.append(poly.exterior)
+        rings.extend(poly.interiors)
+    segments = []
+    for ring in rings:
+        xy = numpy.array(ring.coords)[:, :2]
+        segments.append(numpy.concatenate([xy[:-1], xy[1:]], axis=1))
+    return numpy.concatenate(segments).T
+
+
 def point_to_polygon_distance(polygon, pxx, pyy):
     """
     Calculate the distance to polygon for each point of the collection
-    on the 2d Cartesian plane.
+    on the 2d Cartesian plane. The computation is vectorized with numpy:
+    a point is inside the polygon if a ray starting from it crosses the
+    rings an odd number of times, otherwise the distance is the minimum
+    distance from the segments of the rings.
 
     :param polygon:
         Shapely "Polygon" geometry object.
@@ -518,16 +535,35 @@ def point_to_polygon_distance(polygon, pxx, pyy):
         Numpy array of distances in units of coordinate system. Points
         that lie inside the polygon have zero distance.
     """
-    pxx = numpy.array(pxx)
-    pyy = numpy.array(pyy)
+    pxx = numpy.array(pxx, float)
+    pyy = numpy.array(pyy, float)
     assert pxx.shape == pyy.shape
     if pxx.ndim == 0:
         pxx = pxx.reshape((1, ))
         pyy = pyy.reshape((1, ))
-    result = numpy.array([
-        polygon.distance(shapely.geometry.Point(pxx.item(i), pyy.item(i)))
-        for i in range(pxx.size)
-    ])
+    x0, y0, x1, y1 = _polygon_segments(polygon)
+    dx, dy = x1 - x0, y1 - y0
+    sqlen = dx ** 2 + dy ** 2
+    sqlen[sqlen == 0] = 1  # degenerate segment, the projection is x0, y0
+    xs, ys = pxx.flatten(), pyy.flatten()
+    result = numpy.zeros(len(xs))
+    # process the points in blocks to keep the (points, segments)
+    # matrices small
+    blocksize = max(1, 1000000 // len(x0))
+    for start in range(0, len(xs), blocksize):
+        px = xs[start:start + blocksize, None]
+        py = ys[start:start + blocksize, None]
+        # distance from the closest point of each segment
+        t = numpy.clip(((px - x0) * dx + (py - y0) * dy) / sqlen, 0, 1)
+        dist = numpy.sqrt((x0 + t * dx - px) ** 2 +
+                          (y0 + t * dy - py) ** 2).min(axis=1)
+        # even-odd rule: count the segments crossed by a horizontal ray
+        # going from the point to the right
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            crosses = ((y0 > py) != (y1 > py)) & (
+                px < x0 + (py - y0) * dx / dy)
+        inside = crosses.sum(axis=1) % 2 == 1
+        result[start:start + blocksize] = numpy.where(inside, 0, dist)
     return result.reshape(pxx.shape)
 
 
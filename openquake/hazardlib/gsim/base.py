@@ -182,6 +182,10 @@ class GroundShakingIntensityModel(metaclass=MetaGSIM):
     minimum_distance = 0  # set by valid.gsim
     superseded_by = None
     non_verified = False
+    # set to False in GSIMs reading rupture attributes not listed in
+    # REQUIRES_RUPTURE_PARAMETERS, so that the ContextMaker will not
+    # stack together ruptures with the same parameters
+    collapsible = True
 
     @classmethod
     def __init_subclass__(cls):
@@ -340,6 +344,66 @@ class GroundShakingIntensityModel(metaclass=MetaGSIM):
             else:
                 return _truncnorm_sf(truncation_level, values)
 
+    def get_poes_many(self, sctx, rctx, dctx, imtls, truncation_level, out):
+        """
+        Calculate the PoEs for all the IMTs at once, by filling in place
+        a preallocated buffer. This is faster than calling :meth:`get_poes`
+        for each IMT, since there are no temporary arrays of shape (N, L)
+        and the survival function is applied only once, with the
+        normalization of the truncated distribution computed only once.
+
+        :param imtls:
+            a DictArray imt -> intensity measure levels
+        :param out:
+            a preallocated array of shape (N, L), where N is the number of
+            sites and L the total number of levels
+        :returns:
+            the array `out` filled with the PoEs
+
+        The other parameters are the same as for :meth:`get_poes`.
+        """
+        if truncation_level is not None and truncation_level < 0:
+            raise ValueError('truncation level must be zero, positive number '
+                             'or None')
+        if (self.__class__.get_poes is not
+                GroundShakingIntensityModel.get_poes):
+            # the GSIM has its own get_poes, as in the NSHMP GSIMs
+            for imt in imtls:
+                out[:, imtls(imt)] = self.get_poes(
+                    sctx, rctx, dctx, imt_module.from_string(imt),
+                    imtls[imt], truncation_level)
+            return out
+        if truncation_level == 0:
+            stddev_types = []
+        else:
+            assert (const.StdDev.TOTAL
+                    in self.DEFINED_FOR_STANDARD_DEVIATION_TYPES)
+            stddev_types = [const.StdDev.TOTAL]
+        for imt in imtls:
+            im = imt_module.from_string(imt)
+            self._check_imt(im)
+            mean, stddevs = self.get_mean_and_stddevs(
+                sctx, rctx, dctx, im, stddev_types)
+            mean = mean.reshape(mean.shape + (1, ))
+            values = out[:, imtls(imt)]
+            values[:] = self.to_distribution_values(imtls[imt])
+            if truncation_level == 0:
+                # zero truncation mode, just compare imls to mean
+                values[:] = values <= mean
+            else:
+                values -= mean
+                values /= stddevs[0].reshape(mean.shape)
+        if truncation_level is None:
+            # same as _norm_sf(out)
+            ndtr(numpy.negative(out, out), out)
+        elif truncation_level:
+            # same as _truncnorm_sf(truncation_level, out)
+            phi_b = ndtr(truncation_level)
+            numpy.subtract(phi_b, ndtr(out, out), out)
+            out /= phi_b * 2 - 1
+            numpy.clip(out, 0., 1., out)
+        return out
+
     def disaggregate_pne(self, rupture, sctx, dctx, imt, iml,
                          truncnorm, epsilons):
         """
@@ -695,6 +759,17 @@ class CoeffsTable(object):
     ...           imt.PGA(): {"a": 0.1, "b": 1.0},
     ...           imt.PGV(): {"a": 0.5, "b": 10.0}}
     >>> ct = CoeffsTable(sa_damping=5, table=coeffs)
+
+    The interpolated coefficients are cached, so that the interpolation
+    is performed only the first time a period is requested. It is also
+    possible to get the coefficients for a list of IMTs as a single
+    structured array, with a record per IMT:
+
+    >>> arr = ct.get_coeffs([imt.PGA(), imt.SA(0.5), imt.SA(1.0)])
+    >>> arr.dtype.names
+    ('a', 'b')
+    >>> arr['a']
+    array([0.1       , 2.39794001, 3.        ])
     """
     def __init__(self, **kwargs):
         if 'table' not in kwargs:
@@ -702,6 +777,7 @@ class CoeffsTable(object):
         table = kwargs.pop('table')
         self.sa_coeffs = {}
         self.non_sa_coeffs = {}
+        self._interpolated = {}  # SA -> interpolated coefficients
         sa_damping = kwargs.pop('sa_damping', None)
         if kwargs:
             raise TypeError('CoeffsTable got unexpected kwargs: %r' % kwargs)
@@ -766,7 +842,14 @@ class CoeffsTable(object):
             return self.sa_coeffs[imt]
         except KeyError:
             pass
+        try:
+            return self._interpolated[imt]
+        except KeyError:
+            coeffs = self._interpolated[imt] = self._interpolate(imt)
+            return coeffs
 
+    def _interpolate(self, imt):
+        # interpolate the coefficients for a SA period not in the table
         max_below = min_above = None
         for unscaled_imt in list(self.sa_coeffs):
             if unscaled_imt.damping != imt.damping:
@@ -790,3 +873,16 @@ class CoeffsTable(object):
         return dict(
             (co, (min_above[co] - max_below[co]) * ratio + max_below[co])
             for co in max_below)
+
+    def get_coeffs(self, imts):
+        """
+        :param imts: a list of IMT objects
+        :returns: a structured array of coefficients with a record per IMT
+        :raises KeyError: if the coefficients are not available for an IMT
+        """
+        rows = [self[imt] for imt in imts]
+        names = list(rows[0]) if rows else []
+        array = numpy.zeros(len(rows), [(name, float) for name in names])
+        for name in names:
+            array[name] = [row[name] for row in rows]
+        return array
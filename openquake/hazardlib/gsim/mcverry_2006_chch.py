@@ -38,6 +38,10 @@ class McVerry2006Chch(McVerry2006AscSC):
     #: published, nor is independent code available.
     non_verified = True
 
+    #: The stress drop adjustment depends on the rupture surface, so ruptures
+    #: with the same magnitude and rake cannot be stacked together
+    collapsible = False
+
     def get_mean_and_stddevs(self, sites, rup, dists, imt, stddev_types):
         """
         See :meth:`superclass method
@@ -125,6 +125,13 @@ class ProbabilityMap(dict):
     :class:`ProbabilityMap`. The map can be represented as 3D array of shape
     (shape_x, shape_y, shape_z) = (N, L, I), where N is the number of site IDs,
     L the total number of hazard levels and I the number of GSIMs.
+
+    Internally the curves are stored as rows of a single contiguous array
+    of shape (N, L, I) plus an index site_id -> row, so that the operators
+    work on all sites at once; the ProbabilityCurves in the dictionary are
+    views over such rows. Curves assigned directly with `pmap[sid] = pc`
+    are stored as they are and are moved into the contiguous array the
+    first time an operator needs it.
     """
     @classmethod
     def build(cls, shape_y, shape_z, sids, initvalue=0., dtype=F64):
@@ -135,9 +142,11 @@ class ProbabilityMap(dict):
         :param initvalue: the initial value of the probability (default 0)
         :returns: a ProbabilityMap dictionary
         """
+        sids = list(sids)
+        array = numpy.empty((len(sids), shape_y, shape_z), dtype)
+        array.fill(initvalue)
         dic = cls(shape_y, shape_z)
-        for sid in sids:
-            dic.setdefault(sid, initvalue, dtype)
+        dic._init(sids, array)
         return dic
 
     @classmethod
@@ -145,6 +154,8 @@ class ProbabilityMap(dict):
         """
         :param array: array of shape (N, L) or (N, L, I)
         :param sids: array of N site IDs
+
+        NB: the map is a view over the passed array, which is not copied
         """
         n_sites = len(sids)
         n = len(array)
@@ -154,13 +165,126 @@ class ProbabilityMap(dict):
         if len(array.shape) == 2:  # shape (N, L) -> (N, L, 1)
             array = array.reshape(array.shape + (1,))
         self = cls(*array.shape[1:])
-        for sid, poes in zip(sids, array):
-            self[sid] = ProbabilityCurve(poes)
+        self._init(sids, array)
         return self
 
     def __init__(self, shape_y, shape_z=1):
         self.shape_y = shape_y
         self.shape_z = shape_z
+        self._array = None  # contiguous array of shape (capacity, L, I)
+        self._rows = {}  # site_id -> row in the contiguous array
+        self._size = 0  # number of used rows
+        self._index = None  # sorted site IDs and rows, built on demand
+
+    def _init(self, sids, array):
+        # replace the content of the map with a view over the given array
+        sids = numpy.asarray(sids).tolist()  # python ints are faster keys
+        dict.clear(self)
+        self._array = array
+        self._rows = dict(zip(sids, range(len(array))))
+        self._size = len(array)
+        self._index = None
+        dict.update(self, zip(sids, [ProbabilityCurve(a) for a in array]))
+
+    def _extend(self, sids, array):
+        # copy the curves of the given new sites in the contiguous array
+        sids = numpy.asarray(sids).tolist()
+        size = self._size + len(sids)
+        if self._array is None or size > len(self._array):
+            # grow the contiguous array by doubling it, so that a sequence
+            # of extensions costs a linear amount of copying
+            dtype = array.dtype if self._array is None else self._array.dtype
+            new = numpy.empty((max(size, 2 * self._size),) + array.shape[1:],
+                              dtype)
+            if self._size:
+                new[:self._size] = self._array[:self._size]
+            self._array = new
+            for sid, row in self._rows.items():  # rebind the views
+                dict.__getitem__(self, sid).array = new[row]
+        self._array[self._size:size] = array
+        self._rows.update(zip(sids, range(self._size, size)))
+        self._index = None
+        dict.update(self, zip(sids, [ProbabilityCurve(a) for a in
+                                     self._array[self._size:size]]))
+        self._size = size
+
+    def _get_rows(self, sids):
+        # returns the rows in the contiguous array associated to the
+        # given site IDs, or -1 for the sites which are not there
+        rows = numpy.zeros(len(sids), int) - 1
+        n = len(self._rows)
+        if n == 0:
+            return rows
+        if self._index is None:
+            keys = numpy.fromiter(self._rows, numpy.uint32, n)
+            values = numpy.fromiter(self._rows.values(), int, n)
+            idx = keys.argsort()
+            self._index = keys[idx], values[idx]
+        keys, values = self._index
+        pos = numpy.searchsorted(keys, sids).clip(max=n - 1)
+        ok = keys[pos] == sids
+        rows[ok] = values[pos[ok]]
+        return rows
+
+    def _unlink(self, sid):
+        # remove the given site from the index of the contiguous array
+        if self._rows.pop(sid, None) is not None:
+            self._index = None
+
+    def _consolidate(self):
+        # make sure all the curves are stored in the contiguous array
+        if self._array is not None and len(self._rows) == len(self):
+            return
+        sids = list(self)
+        array = _get_array(self, sids)
+        self.clear()
+        if sids:
+            self._extend(sids, array)
+
+    def _sorted_array(self):
+        # returns the site IDs in order and the associated (N, L, I) array;
+        # it is a view over the contiguous array when possible
+        if not self:
+            return self.sids, numpy.zeros((0, self.shape_y, self.shape_z))
+        if self._array is not None and len(self._rows) == len(self):
+            sids = numpy.fromiter(self._rows, numpy.uint32, len(self._rows))
+            rows = numpy.fromiter(self._rows.values(), int, len(self._rows))
+            if (sids[1:] > sids[:-1]).all() and (
+                    rows == numpy.arange(self._size)).all():
+                return sids, self._array[:self._size]
+            idx = sids.argsort()
+            return sids[idx], self._array[rows[idx]]
+        sids = self.sids
+        return sids, _get_array(self, sids)
+
+    def __setitem__(self, sid, pcurve):
+        # the curve is stored as it is, outside of the contiguous array
+        self._unlink(sid)
+        dict.__setitem__(self, sid, pcurve)
+
+    def __delitem__(self, sid):
+        self._unlink(sid)
+        dict.__delitem__(self, sid)
+
+    def pop(self, sid, *default):
+        self._unlink(sid)
+        return dict.pop(self, sid, *default)
+
+    def popitem(self):
+        sid, pcurve = dict.popitem(self)
+        self._unlink(sid)
+        return sid, pcurve
+
+    def clear(self):
+        dict.clear(self)
+        self._array = None
+        self._rows = {}
+        self._size = 0
+        self._index = None
+
+    def update(self, *args, **kw):
+        for sid, pcurve in dict(*args, **kw).items():
+            self[sid] = pcurve
 
     def setdefault(self, sid, value, dtype=F64):
         """
@@ -190,7 +314,11 @@ class ProbabilityMap(dict):
         """
         The underlying array of shape (N, L, I)
         """
-        return numpy.array([self[sid].array for sid in sorted(self)])
+        array = self._sorted_array()[1]
+        if self._array is not None and numpy.may_share_memory(
+                array, self._array):
+            return array.copy()
+        return array
 
     @property
     def nbytes(self):
@@ -215,10 +343,11 @@ class ProbabilityMap(dict):
             index on the z-axis (default 0)
         """
         curves = numpy.zeros(nsites, imtls.dt)
+        if not self:
+            return curves
+        sids, array = self._sorted_array()
         for imt in curves.dtype.names:
-            curves_by_imt = curves[imt]
-            for sid in self:
-                curves_by_imt[sid] = self[sid].array[imtls(imt), idx]
+            curves[imt][sids] = array[:, imtls(imt), idx]
         return curves
 
     def convert2(self, imtls, sids):
@@ -235,15 +364,32 @@ class ProbabilityMap(dict):
         """
         assert self.shape_z == 1, self.shape_z
         curves = numpy.zeros(len(sids), imtls.dt)
+        if not self:
+            return curves  # the poes will be zeros
+        sids = numpy.asarray(sids)
+        pmap_sids, array = self._sorted_array()
+        idx = numpy.searchsorted(pmap_sids, sids)
+        ok = idx < len(pmap_sids)
+        ok[ok] = pmap_sids[idx[ok]] == sids[ok]
         for imt in curves.dtype.names:
-            curves_by_imt = curves[imt]
-            for i, sid in numpy.ndenumerate(sids):
-                try:
-                    pcurve = self[sid]
-                except KeyError:
-                    pass  # the poes will be zeros
-                else:
-                    curves_by_imt[i] = pcurve.array[imtls(imt), 0]
+            curves[imt][ok] = array[idx[ok], imtls(imt), 0]
+        return curves
+
+    def get_curves(self, sids, idx=0):
+        """
+        :param sids:
+            an array of N site IDs
+        :param idx:
+            index on the z-axis (default 0)
+        :returns:
+            an array of shape (N, L), with zeros for the missing sites
+        """
+        curves = numpy.zeros((len(sids), self.shape_y))
+        if self:
+            self._consolidate()
+            rows = self._get_rows(sids)
+            ok = rows >= 0
+            curves[ok] = self._array[rows[ok], :, idx]
         return curves
 
     def filter(self, sids):
@@ -263,25 +409,40 @@ class ProbabilityMap(dict):
         Extracts a component of the underlying ProbabilityCurves,
         specified by the index `inner_idx`.
         """
-        out = self.__class__(self.shape_y, 1)
-        for sid in self:
-            curve = self[sid]
-            array = curve.array[:, inner_idx].reshape(-1, 1)
-            out[sid] = ProbabilityCurve(array)
-        return out
+        if not self:
+            return self.__class__(self.shape_y, 1)
+        sids, array = self._sorted_array()
+        return self.__class__.from_array(array[:, :, [inner_idx]], sids)
 
     def __ior__(self, other):
-        self_sids = set(self)
-        other_sids = set(other)
-        for sid in self_sids & other_sids:
-            self[sid] = self[sid] | other[sid]
-        for sid in other_sids - self_sids:
-            self[sid] = other[sid]
+        if not other:
+            return self
+        self._consolidate()
+        if isinstance(other, ProbabilityMap):
+            sids, array = other._sorted_array()
+        else:
+            sids = numpy.array(sorted(other), numpy.uint32)
+            array = _get_array(other, sids)
+        rows = self._get_rows(sids)
+        old = rows >= 0
+        if old.any():
+            # compute 1 - (1 - p1) * (1 - p2) with a minimum of temporaries
+            rows = rows[old]
+            poes = self._array[rows]
+            numpy.subtract(1., poes, out=poes)
+            other_poes = array[old]
+            numpy.subtract(1., other_poes, out=other_poes)
+            poes *= other_poes
+            numpy.subtract(1., poes, out=poes)
+            self._array[rows] = poes
+        if not old.all():
+            new = ~old
+            self._extend(sids[new], array[new])
         return self
 
     def __or__(self, other):
         new = self.__class__(self.shape_y, self.shape_z)
-        new.update(self)
+        new |= self
         new |= other
         return new
 
@@ -306,53 +467,78 @@ class ProbabilityMap(dict):
         try:
             other.get
             is_pmap = True
-            sids = set(self) | set(other)
         except AttributeError:  # no .get method, assume a float
             is_pmap = False
             assert 0. <= other <= 1., other  # must be a probability
-            sids = set(self)
-        new = self.__class__(self.shape_y, self.shape_z)
-        for sid in sids:
-            prob = other.get(sid, 1) if is_pmap else other
-            new[sid] = self.get(sid, 1) * prob
-        return new
+        if not is_pmap:
+            sids, array = self._sorted_array()
+            return self._new(sids, array * other)
+        # the missing curves are considered to be equal to 1
+        sids = numpy.array(sorted(set(self) | set(other)), numpy.uint32)
+        return self._new(sids, _get_array(self, sids, 1.) *
+                         _get_array(other, sids, 1.))
 
     def __ipow__(self, n):
-        for sid, pcurve in self.items():
-            self[sid] = pcurve ** n
+        self._consolidate()
+        if self._array is not None:
+            self._array[:self._size] **= n
         return self
 
     def __pow__(self, n):
-        new = self.__class__(self.shape_y, self.shape_z)
-        for sid, pcurve in self.items():
-            new[sid] = pcurve ** n
-        return new
+        sids, array = self._sorted_array()
+        return self._new(sids, array ** n)
 
     def __invert__(self):
+        sids, array = self._sorted_array()
+        # store only nonzero probabilities
+        ok = (array != 1.).reshape(len(array), -1).any(axis=1)
+        return self._new(sids[ok], 1. - array[ok])
+
+    def _new(self, sids, array):
+        # build a new map with the same shape from the given array
         new = self.__class__(self.shape_y, self.shape_z)
-        for sid in self:
-            if (self[sid].array != 1.).any():
-                new[sid] = ~self[sid]  # store only nonzero probabilities
+        if len(sids):
+            new._init(sids, array)
         return new
 
+    def __reduce__(self):
+        # pickle the contiguous array and not the single curves
+        sids, array = self._sorted_array()
+        attrs = {k: v for k, v in vars(self).items()
+                 if k not in ('_array', '_rows', '_size', '_index')}
+        return self.__class__, (self.shape_y, self.shape_z), (
+            sids, array, attrs)
+
+    def __setstate__(self, state):
+        sids, array, attrs = state
+        vars(self).update(attrs)
+        if len(sids):
+            self._init(sids, array)
+
     def __toh5__(self):
         # converts to an array of shape (num_sids, shape_y, shape_z)
-        size = len(self)
-        sids = self.sids
-        shape = (size, self.shape_y, self.shape_z)
-        array = numpy.zeros(shape, F64)
-        for i, sid in numpy.ndenumerate(sids):
-            array[i] = self[sid].array
-        return dict(array=array, sids=sids), {}
+        if not self:
+            array = numpy.zeros((0, self.shape_y, self.shape_z), F64)
+            return dict(array=array, sids=self.sids), {}
+        sids, array = self._sorted_array()  # no copy if already sorted
+        return dict(array=numpy.asarray(array, F64), sids=sids), {}
 
     def __fromh5__(self, dic, attrs):
         # rebuild the map from sids and probs arrays
-        array = dic['array']
-        sids = dic['sids']
-        self.shape_y = array.shape[1]
-        self.shape_z = array.shape[2]
-        for sid, prob in zip(sids, array):
-            self[sid] = ProbabilityCurve(prob)
+        array = dic['array'][()]  # read the whole dataset at once
+        sids = dic['sids'][()]
+        self.__init__(array.shape[1], array.shape[2])
+        self._init(sids, array)
+
+
+def _get_array(pmap, sids, missing=None):
+    # returns an array of shape (N, L, I) with the curves of the given sites;
+    # if `missing` is not None, it is used to fill the missing curves
+    if missing is None:
+        return numpy.array([pmap[sid].array for sid in sids])
+    shape = (pmap.shape_y, pmap.shape_z)
+    return numpy.array([pmap[sid].array if sid in pmap
+                        else numpy.full(shape, missing) for sid in sids])
 
 
 def get_shape(pmaps):
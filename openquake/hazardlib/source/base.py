@@ -110,10 +110,23 @@ class BaseSeismicSource(metaclass=abc.ABCMeta):
         :yields: pairs (rupture, num_occurrences[num_samples])
         """
         mutex_weight = getattr(self, 'mutex_weight', 1)
-        with ir_monitor:
-            ruptures = list(self.iter_ruptures())
         tom = getattr(self, 'temporal_occurrence_model', None)
         serials = numpy.arange(self.serial, self.serial + self.num_ruptures)
+        if tom and hasattr(self, 'iter_rupture_arrays'):
+            # point sources: the rupture objects are built only for
+            # the ruptures which actually occur
+            with ir_monitor:
+                rups = numpy.concatenate(list(self.iter_rupture_arrays()))
+            numpy.random.seed(self.serial)
+            occurs = numpy.random.poisson(
+                rups['rate'] * tom.time_span * eff_num_ses)
+            for idx in occurs.nonzero()[0]:
+                rup = self.rupture_from_array(rups[idx])
+                rup.serial = serials[idx]  # used as seed
+                yield rup, occurs[idx]
+            return
+        with ir_monitor:
+            ruptures = list(self.iter_ruptures())
         if tom:  # time-independent source
             rates = numpy.array([rup.occurrence_rate for rup in ruptures])
             numpy.random.seed(self.serial)
@@ -23,13 +23,15 @@ from openquake.hazardlib.geo import utils, NodalPlane
 from openquake.hazardlib.geo.mesh import Mesh
 from openquake.hazardlib.pmf import PMF
 from openquake.hazardlib.valid import SCALEREL
-from openquake.hazardlib.source.point import PointSource
+from openquake.hazardlib.source.point import (
+    PointSource, _get_rupture_templates, build_planar_ruptures)
 
 F32 = numpy.float32
 npd_dt = numpy.dtype([('probability', F32),
                       ('strike', F32), ('dip', F32), ('rake', F32)])
 hdd_dt = numpy.dtype([('probability', F32), ('depth', F32)])
 mesh_dt = numpy.dtype([('lon', F32), ('lat', F32)])
+BLOCKSIZE = 10000  # number of ruptures in the arrays of planar ruptures
 
 
 def get(arr, i):
@@ -96,6 +98,38 @@ class MultiPointSource(ParametricSeismicSource):
             for rupture in ps.iter_ruptures():
                 yield rupture
 
+    def iter_rupture_arrays(self, hcdist=True, npdist=True):
+        """
+        Yield the ruptures of the underlying point sources as arrays of
+        dtype planar_rupture_dt, in blocks of at least BLOCKSIZE ruptures
+        (except the last one), in the same order as :meth:`iter_ruptures`
+        """
+        templates, lons, lats = [], [], []
+        size = 0
+        for ps in self:
+            tmpl = _get_rupture_templates(ps, hcdist, npdist)
+            templates.append(tmpl)
+            lons.append(numpy.repeat(ps.location.longitude, len(tmpl)))
+            lats.append(numpy.repeat(ps.location.latitude, len(tmpl)))
+            size += len(tmpl)
+            if size >= BLOCKSIZE:
+                yield build_planar_ruptures(numpy.concatenate(templates),
+                                            numpy.concatenate(lons),
+                                            numpy.concatenate(lats))
+                templates, lons, lats = [], [], []
+                size = 0
+        if size:
+            yield build_planar_ruptures(numpy.concatenate(templates),
+                                        numpy.concatenate(lons),
+                                        numpy.concatenate(lats))
+
+    def rupture_from_array(self, rec):
+        """
+        :param rec: a record of dtype planar_rupture_dt
+        :returns: a ParametricProbabilisticRupture
+        """
+        return PointSource.rupture_from_array(self, rec)
+
     def count_ruptures(self):
         """
         See
@@ -25,6 +25,18 @@ from openquake.hazardlib.source.base import ParametricSeismicSource
 from openquake.hazardlib.source.rupture import ParametricProbabilisticRupture
 from openquake.hazardlib.geo.utils import get_bounding_box
 
+F64 = numpy.float64
+# the corners are in the order top left, top right, bottom left, bottom right
+# as in PlanarSurface, with shape (3, 4) for longitudes, latitudes, depths
+planar_rupture_dt = numpy.dtype([
+    ('mag', F64), ('strike', F64), ('dip', F64), ('rake', F64),
+    ('rate', F64), ('hypo', (F64, 3)), ('corners', (F64, (3, 4)))])
+# the parameters of a rupture which do not depend on the location
+template_dt = numpy.dtype([
+    ('mag', F64), ('strike', F64), ('dip', F64), ('rake', F64),
+    ('rate', F64), ('depth', F64), ('hshift', F64), ('vshift', F64),
+    ('azimuth', F64), ('theta', F64), ('hor_dist', F64), ('hheight', F64)])
+
 
 def _get_rupture_dimensions(src, mag, nodal_plane):
     """
@@ -67,6 +79,88 @@ def _get_rupture_dimensions(src, mag, nodal_plane):
     return rup_length, rup_width
 
 
+def _get_rupture_templates(src, hcdist=True, npdist=True):
+    # returns an array of dtype template_dt, with a record for each rupture
+    # generated by the source in a given location, in the same order as
+    # PointSource.iter_ruptures; see PointSource._get_rupture_surface for
+    # the meaning of the parameters
+    usd = src.upper_seismogenic_depth
+    lsd = src.lower_seismogenic_depth
+    rows = []
+    for mag, mag_occ_rate in src.get_annual_occurrence_rates():
+        for np_prob, np in src.nodal_plane_distribution.data:
+            rup_length, rup_width = _get_rupture_dimensions(src, mag, np)
+            rdip = math.radians(np.dip)
+            rup_proj_height = rup_width * math.sin(rdip)
+            rup_proj_width = rup_width * math.cos(rdip)
+            hheight = rup_proj_height / 2.
+            theta = math.degrees(
+                math.atan((rup_proj_width / 2.) / (rup_length / 2.)))
+            hor_dist = math.sqrt(
+                (rup_length / 2.) ** 2 + (rup_proj_width / 2.) ** 2)
+            azimuth_down = (np.strike + 90) % 360
+            azimuth_up = (((azimuth_down + 90) % 360) + 90) % 360
+            for hc_prob, hc_depth in src.hypocenter_distribution.data:
+                occurrence_rate = (mag_occ_rate *
+                                   (np_prob if npdist else 1) *
+                                   (hc_prob if hcdist else 1))
+                vshift = usd - hc_depth + hheight
+                if vshift < 0:
+                    vshift = lsd - hc_depth - hheight
+                    if vshift > 0:
+                        vshift = 0
+                hshift = abs(vshift / math.tan(rdip)) if vshift else 0
+                rows.append((mag, np.strike, np.dip, np.rake, occurrence_rate,
+                             hc_depth, hshift, vshift,
+                             azimuth_up if vshift < 0 else azimuth_down,
+                             theta, hor_dist, hheight))
+                if not hcdist:
+                    break
+            if not npdist:
+                break
+    return numpy.array(rows, template_dt)
+
+
+def build_planar_ruptures(templates, lons, lats):
+    """
+    Build the ruptures of point sources with a vectorized computation of
+    the corners of the planar surfaces.
+
+    :param templates: an array of K records of dtype template_dt
+    :param lons: an array of K longitudes of the hypocenters
+    :param lats: an array of K latitudes of the hypocenters
+    :returns: an array of K records of dtype planar_rupture_dt
+    """
+    rups = numpy.zeros(len(templates), planar_rupture_dt)
+    for name in ('mag', 'strike', 'dip', 'rake', 'rate'):
+        rups[name] = templates[name]
+    depths = templates['depth']
+    rups['hypo'] = numpy.array([lons, lats, depths]).T
+    # move the rupture center to make the rupture fit inside the
+    # seismogenic layer
+    clons, clats = numpy.array(lons, F64), numpy.array(lats, F64)
+    cdepths = depths.copy()
+    shifted = templates['vshift'] != 0
+    if shifted.any():
+        tmpl = templates[shifted]
+        clons[shifted], clats[shifted] = geodetic.point_at(
+            clons[shifted], clats[shifted], tmpl['azimuth'], tmpl['hshift'])
+        cdepths[shifted] += tmpl['vshift']
+    # move from the center along the diagonals of the plane
+    strike, theta = templates['strike'], templates['theta']
+    hheight = templates['hheight']
+    azimuths = [(strike + 180 + theta) % 360,  # top left
+                (strike - theta) % 360,  # top right
+                (strike + 180 - theta) % 360,  # bottom left
+                (strike + theta) % 360]  # bottom right
+    for i, azimuth in enumerate(azimuths):
+        corners = rups['corners'][:, :, i]
+        corners[:, 0], corners[:, 1] = geodetic.point_at(
+            clons, clats, azimuth, templates['hor_dist'])
+        corners[:, 2] = cdepths + (hheight if i >= 2 else -hheight)
+    return rups
+
+
 @with_slots
 class PointSource(ParametricSeismicSource):
     """
@@ -190,6 +284,29 @@ class PointSource(ParametricSeismicSource):
                 if not npdist:
                     break
 
+    def iter_rupture_arrays(self, hcdist=True, npdist=True):
+        """
+        Generate the same ruptures as :meth:`iter_ruptures`, as a single
+        array of dtype planar_rupture_dt
+        """
+        templates = _get_rupture_templates(self, hcdist, npdist)
+        K = len(templates)
+        yield build_planar_ruptures(
+            templates, numpy.repeat(self.location.longitude, K),
+            numpy.repeat(self.location.latitude, K))
+
+    def rupture_from_array(self, rec):
+        """
+        :param rec: a record of dtype planar_rupture_dt
+        :returns: a ParametricProbabilisticRupture
+        """
+        tl, tr, bl, br = [Point(*xyz) for xyz in rec['corners'].T]
+        surface = PlanarSurface(rec['strike'], rec['dip'], tl, tr, br, bl)
+        return ParametricProbabilisticRupture(
+            rec['mag'], rec['rake'], self.tectonic_region_type,
+            Point(*rec['hypo']), surface, rec['rate'],
+            self.temporal_occurrence_model)
+
     def count_ruptures(self):
         """
         See :meth:
@@ -21,6 +21,8 @@ Utilities to compute mean and quantile curves
 import numpy
 from openquake.baselib.python3compat import encode
 
+MAX_BYTES = 100 * 1024 ** 2  # memory used by compute_pmap_stats per chunk
+
 
 def mean_curve(values, weights=None):
     """
@@ -62,16 +64,23 @@ def quantile_curve(quantile, curves, weights=None):
     else:
         weights = numpy.array(weights)
         assert len(weights) == R, (len(weights), R)
-    result = numpy.zeros(curves.shape[1:])
-    for idx, _ in numpy.ndenumerate(result):
-        data = numpy.array([a[idx] for a in curves])
-        sorted_idxs = numpy.argsort(data)
-        sorted_weights = weights[sorted_idxs]
-        sorted_data = data[sorted_idxs]
-        cum_weights = numpy.cumsum(sorted_weights)
-        # get the quantile from the interpolated CDF
-        result[idx] = numpy.interp(quantile, cum_weights, sorted_data)
-    return result
+    # sort the curves along the first axis and interpolate the quantile
+    # on the cumulative weights, for all the elements at once
+    shape = curves.shape[1:]
+    data = curves.reshape(R, -1)
+    cols = numpy.arange(data.shape[1])
+    sorted_idxs = numpy.argsort(data, axis=0)
+    sorted_data = data[sorted_idxs, cols]
+    cum_weights = numpy.cumsum(weights[sorted_idxs], axis=0)
+    # index of the last cumulative weight <= quantile, as in numpy.interp
+    j = (cum_weights <= quantile).sum(axis=0) - 1
+    result = numpy.where(j < 0, sorted_data[0], sorted_data[-1]).astype(float)
+    inner = (j >= 0) & (j < R - 1)
+    j, cols = j[inner], cols[inner]
+    x0, x1 = cum_weights[j, cols], cum_weights[j + 1, cols]
+    y0, y1 = sorted_data[j, cols], sorted_data[j + 1, cols]
+    result[inner] = (y1 - y0) / (x1 - x0) * (quantile - x0) + y0
+    return result.reshape(shape)
 
 
 def max_curve(values, weights=None):
@@ -99,29 +108,30 @@ def compute_pmap_stats(pmaps, stats, weights, imtls):
     :returns:
         a probability map with S internal values
     """
-    sids = set()
     p0 = next(iter(pmaps))
     L = p0.shape_y
     for pmap in pmaps:
-        sids.update(pmap)
         assert pmap.shape_y == L, (pmap.shape_y, L)
+    sids = numpy.unique(numpy.concatenate(
+        [numpy.fromiter(pmap, numpy.uint32, len(pmap)) for pmap in pmaps]))
     if len(sids) == 0:
         raise ValueError('All empty probability maps!')
-    sids = numpy.array(sorted(sids), numpy.uint32)
     nstats = len(stats)
-    curves = numpy.zeros((len(pmaps), len(sids), L), numpy.float64)
-    for i, pmap in enumerate(pmaps):
-        for j, sid in enumerate(sids):
-            if sid in pmap:
-                curves[i, j] = pmap[sid].array[:, 0]
-    out = p0.__class__.build(L, nstats, sids)
-    for imt in imtls:
-        slc = imtls(imt)
-        w = [weight[imt] for weight in weights]
-        for i, array in enumerate(compute_stats(curves[:, :, slc], stats, w)):
-            for j, sid in numpy.ndenumerate(sids):
-                out[sid].array[slc, i] = array[j]
-    return out
+    array = numpy.zeros((len(sids), L, nstats), numpy.float64)
+    w = {imt: [weight[imt] for weight in weights] for imt in imtls}
+    # the sites are processed in chunks, so that the intermediate arrays
+    # of shape (R, N, L) stay within MAX_BYTES
+    chunksize = max(MAX_BYTES // (8 * len(pmaps) * L), 1)
+    for start in range(0, len(sids), chunksize):
+        slc_sids = slice(start, start + chunksize)
+        curves = numpy.array(
+            [pmap.get_curves(sids[slc_sids]) for pmap in pmaps])
+        for imt in imtls:
+            slc = imtls(imt)
+            for i, arr in enumerate(
+                    compute_stats(curves[:, :, slc], stats, w[imt])):
+                array[slc_sids, slc, i] = arr
+    return p0.__class__.from_array(array, sids)
 
 
 # NB: this is a function linear in the array argument
@@ -16,14 +16,22 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
 import os
+import mock
+import shutil
+import tempfile
 import unittest
+import numpy
 from numpy.testing import assert_almost_equal as aae
 from openquake.baselib.general import gettemp
+from openquake.baselib.parallel import Pickled, SharedArrays
 from openquake.hazardlib import nrml
 from openquake.hazardlib.geo.point import Point
 from openquake.hazardlib.site import Site, SiteCollection
+from openquake.hazardlib.contexts import ContextMaker, FarAwayRupture
+from openquake.hazardlib.gsim.boore_atkinson_2008 import BooreAtkinson2008
 from openquake.hazardlib.calc.filters import (
-    IntegrationDistance, MAX_DISTANCE, SourceFilter, angular_distance)
+    IntegrationDistance, MAX_DISTANCE, SourceFilter, RtreeFilter,
+    angular_distance, prefilter_sites)
 
 
 class AngularDistanceTestCase(unittest.TestCase):
@@ -96,6 +104,97 @@ class SourceFilterTestCase(unittest.TestCase):
         sites = srcfilter.get_close_sites(src)
         self.assertIsNotNone(sites)
 
+    def test_shared_sitecol(self):
+        sitecol = SiteCollection.from_points(
+            numpy.arange(10.), numpy.zeros(10))
+        fname = gettemp(suffix='.hdf5')  # the sitecol is kept in memory
+        srcfilter = SourceFilter(sitecol, {'default': 200}, fname)
+        # by default the workers read the site collection from the file
+        self.assertNotIn('sitecol', vars(Pickled(srcfilter).unpickle()))
+        shared = SharedArrays(min_bytes=0)
+        new = Pickled(srcfilter, shared).unpickle()
+        self.assertIsInstance(new.sitecol.array, numpy.memmap)
+        numpy.testing.assert_equal(new.sitecol.array, sitecol.array)
+        shared.close()
+        os.remove(fname)
+
+
+class RtreeFilterTestCase(unittest.TestCase):
+    def test_cached_index(self):
+        fname = gettemp(characteric_source)
+        [[src]] = nrml.to_python(fname)
+        os.remove(fname)
+        lons, lats = numpy.meshgrid(numpy.linspace(174, 182, 30),
+                                    numpy.linspace(-44, -36, 30))
+        sitecol = SiteCollection.from_points(lons.flatten(), lats.flatten())
+        datadir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, datadir)
+        rfilter = RtreeFilter(sitecol, {'default': 200}, datadir=datadir)
+        [rsrc] = rfilter.filter([src])
+        indices = rsrc.indices
+        del src.indices
+        [ssrc] = SourceFilter(sitecol, {'default': 200}).filter([src])
+        numpy.testing.assert_equal(indices, ssrc.indices)
+
+        # a second filter on the same sites reuses the index
+        mtime = os.path.getmtime(rfilter.indexpath + '.idx')
+        rfilter2 = RtreeFilter(sitecol, {'default': 200}, datadir=datadir)
+        self.assertEqual(rfilter2.indexpath, rfilter.indexpath)
+        self.assertEqual(os.path.getmtime(rfilter.indexpath + '.idx'), mtime)
+        self.assertEqual(len(os.listdir(datadir)), 2)  # .idx and .dat
+
+    def test_failed_build(self):
+        # the temporary files are removed if the index build fails
+        sitecol = SiteCollection.from_points([174., 175.], [-40., -41.])
+        datadir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, datadir)
+
+        def gen_items(lons, lats):
+            yield 0, (lons[0], lats[0], lons[0], lats[0]), None
+            raise MemoryError
+
+        with mock.patch('openquake.hazardlib.calc.filters._gen_items',
+                        gen_items), self.assertRaises(MemoryError):
+            RtreeFilter(sitecol, {'default': 200}, datadir=datadir)
+        self.assertEqual(os.listdir(datadir), [])
+
+
+class PrefilterSitesTestCase(unittest.TestCase):
+    def filter(self, cmaker, sites, rup):
+        try:
+            sites, dctx = cmaker.filter(sites, rup)
+        except FarAwayRupture:
+            return [], []
+        return sites.sids, dctx.rjb
+
+    def test(self):
+        fname = gettemp(characteric_source)
+        [[src]] = nrml.to_python(fname)
+        os.remove(fname)
+        lons, lats = numpy.meshgrid(numpy.linspace(174, 182, 60),
+                                    numpy.linspace(-44, -36, 60))
+        sitecol = SiteCollection.from_points(lons.flatten(), lats.flatten())
+        cmaker = ContextMaker(
+            'Subduction Interface', [BooreAtkinson2008()],
+            IntegrationDistance({'default': 100}))
+        [rup] = src.iter_ruptures()
+        rup.serial = 1
+        expected = self.filter(cmaker, sitecol, rup)
+        # the KD-tree keeps a superset of the sites within the distance
+        close = prefilter_sites(sitecol, rup, 100)
+        self.assertLess(len(close), len(sitecol))
+        self.assertTrue(set(expected[0]) <= set(close.sids))
+        with mock.patch(
+                'openquake.hazardlib.contexts.KDTREE_MIN_SITES', 0):
+            sids, dists = self.filter(cmaker, sitecol, rup)
+        numpy.testing.assert_equal(sids, expected[0])
+        numpy.testing.assert_equal(dists, expected[1])
+
+        # far away sites
+        far = SiteCollection.from_points(numpy.zeros(10), numpy.zeros(10))
+        self.assertIsNone(prefilter_sites(far, rup, 100))
+
+
 # from https://groups.google.com/d/msg/openquake-users/P03SxJsfW_s/nCdcxj8WAAAJ
 characteric_source = '''\
 <?xml version="1.0" encoding="utf-8"?>
@@ -0,0 +1,62 @@
+# The Hazard Library
+# Copyright (C) 2012-2018 GEM Foundation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import unittest
+import numpy
+from openquake.hazardlib import const
+from openquake.hazardlib.geo import Point
+from openquake.hazardlib.geo.surface import PlanarSurface
+from openquake.hazardlib.site import Site, SiteCollection
+from openquake.hazardlib.source.rupture import BaseRupture
+from openquake.hazardlib.gsim.base import ContextMaker
+from openquake.hazardlib.gsim.boore_atkinson_2008 import BooreAtkinson2008
+from openquake.hazardlib.calc.gmf import GmfComputer, TruncNorm, get_rng
+
+
+class RandomStreamsTestCase(unittest.TestCase):
+    def setUp(self):
+        surface = PlanarSurface.from_corner_points(
+            Point(0, 0, 5), Point(.1, 0, 5), Point(.1, 0, 15), Point(0, 0, 15))
+        self.rupture = BaseRupture(
+            6, 0, const.TRT.ACTIVE_SHALLOW_CRUST, Point(.05, 0, 10),
+            surface)
+        self.sitecol = SiteCollection(
+            [Site(Point(lon, .1), 760, 100, 5) for lon in (0, .1, .2)])
+        self.cmaker = ContextMaker(const.TRT.ACTIVE_SHALLOW_CRUST,
+                                   [BooreAtkinson2008()])
+
+    def compute(self, imts, seed=42):
+        computer = GmfComputer(self.rupture, self.sitecol, imts, self.cmaker,
+                               truncation_level=3, random_streams=True)
+        return computer.compute(BooreAtkinson2008(), 10, seed)
+
+    def test_reproducible(self):
+        state = numpy.random.get_state()
+        gmfs = self.compute(['PGA', 'SA(0.1)'])
+        # the global numpy generator is not touched
+        numpy.testing.assert_equal(numpy.random.get_state()[1], state[1])
+        numpy.testing.assert_equal(self.compute(['PGA', 'SA(0.1)']), gmfs)
+        # the GMFs of an IMT do not depend on the other IMTs
+        numpy.testing.assert_equal(self.compute(['PGA'])[0], gmfs[0])
+        self.assertFalse((self.compute(['PGA'], seed=43) == gmfs[0]).any())
+
+    def test_truncnorm(self):
+        dist = TruncNorm(1.5, get_rng(1, 'a'))
+        values = dist.rvs((100, 1000))
+        self.assertLessEqual(abs(values).max(), 1.5)
+        # the standard deviation of the normal truncated at 1.5 is 0.7426
+        self.assertAlmostEqual(values.std(), .7426, delta=.005)
+        values = TruncNorm(None, get_rng(1, 'a')).rvs(100000)
+        self.assertAlmostEqual(values.std(), 1, delta=.01)
@@ -20,14 +20,16 @@ import numpy
 import numpy.testing as npt
 
 from openquake.baselib.general import DictArray
-from openquake.hazardlib.source import NonParametricSeismicSource
+from openquake.hazardlib.source import (
+    NonParametricSeismicSource, PointSource)
 from openquake.hazardlib.source.rupture import BaseRupture
 from openquake.hazardlib.sourceconverter import SourceConverter
 from openquake.hazardlib.const import TRT
 from openquake.hazardlib.geo.surface import PlanarSurface, SimpleFaultSurface
-from openquake.hazardlib.geo import Point, Line
+from openquake.hazardlib.geo import Point, Line, NodalPlane
 from openquake.hazardlib.geo.geodetic import point_at
-from openquake.hazardlib.calc.filters import SourceFilter
+from openquake.hazardlib.calc.filters import (
+    SourceFilter, IntegrationDistance)
 from openquake.hazardlib.calc.hazard_curve import calc_hazard_curves
 from openquake.hazardlib.calc.hazard_curve import classical
 from openquake.hazardlib.gsim.sadigh_1997 import SadighEtAl1997
@@ -35,6 +37,10 @@ from openquake.hazardlib.gsim.si_midorikawa_1999 import SiMidorikawa1999SInter
 from openquake.hazardlib.gsim.campbell_2003 import Campbell2003
 from openquake.hazardlib.site import Site, SiteCollection
 from openquake.hazardlib.pmf import PMF
+from openquake.hazardlib.mfd import TruncatedGRMFD
+from openquake.hazardlib.scalerel import WC1994
+from openquake.hazardlib.tom import PoissonTOM
+from openquake.hazardlib.contexts import ContextMaker
 from openquake.hazardlib.sourceconverter import SourceGroup
 from openquake.hazardlib import nrml
 
@@ -231,3 +237,113 @@ class MultiPointTestCase(unittest.TestCase):
         psources = list(mps1) + list(mps2)
         hcurves = calc_hazard_curves(psources, sitecol, imtls, gsim_by_trt)
         npt.assert_almost_equal(hcurves['PGA'][0], expected)
+
+
+class CollapseRupturesTestCase(unittest.TestCase):
+    # ruptures with the same magnitude and rake are stacked together
+    def test(self):
+        src = PointSource(
+            'src', 'point', TRT.ACTIVE_SHALLOW_CRUST,
+            TruncatedGRMFD(a_val=1, b_val=1, min_mag=5, max_mag=6.5,
+                           bin_width=.5),
+            2., WC1994(), 1.5, PoissonTOM(50.), 0., 20.,
+            Point(0.1, 0.1),
+            PMF([(.5, NodalPlane(0, 90, 0)), (.5, NodalPlane(90, 90, 0))]),
+            PMF([(.3, 5.), (.4, 10.), (.3, 15.)]))
+        sitecol = SiteCollection(
+            [Site(Point(lon, 0.), 760., z1pt0=100., z2pt5=1.)
+             for lon in (0., .1, .2, .5)])
+        imtls = DictArray({'PGA': [0.01, 0.1, 0.2], 'SA(0.1)': [0.1, 0.2]})
+        gsims = [SadighEtAl1997()]
+        cmaker = ContextMaker(src.tectonic_region_type, gsims)
+        blocks = list(cmaker.gen_blocks(src, sitecol))
+        self.assertEqual(len(blocks), 3)  # one per magnitude
+        self.assertEqual(sum(len(block) for far, block in blocks), 18)
+        pmap = cmaker.poe_map(src, sitecol, imtls, 3)
+        cmaker.collapse = False
+        blocks = list(cmaker.gen_blocks(src, sitecol))
+        self.assertEqual(len(blocks), 18)
+        expected = cmaker.poe_map(src, sitecol, imtls, 3)
+        npt.assert_allclose(pmap.array, expected.array)
+        self.assertEqual(pmap.eff_ruptures, expected.eff_ruptures)
+
+
+class MagDistTableTestCase(unittest.TestCase):
+    # the ruptures beyond the pointsource_distance use lookup tables
+    def test(self):
+        src = PointSource(
+            'src', 'point', TRT.ACTIVE_SHALLOW_CRUST,
+            TruncatedGRMFD(a_val=1, b_val=1, min_mag=5, max_mag=6.5,
+                           bin_width=.5),
+            2., WC1994(), 1.5, PoissonTOM(50.), 0., 20.,
+            Point(0.1, 0.1), PMF([(1, NodalPlane(0, 90, 0))]),
+            PMF([(1, 10.)]))
+        sitecol = SiteCollection(
+            [Site(Point(lon, 0.), vs30, z1pt0=100., z2pt5=1.)
+             for lon in (0.5, 0.6, 0.8, 1.2) for vs30 in (400., 760.)])
+        imtls = DictArray({'PGA': [0.01, 0.1, 0.2], 'SA(0.1)': [0.1, 0.2]})
+        gsims = [SadighEtAl1997()]
+        param = dict(pointsource_distance=IntegrationDistance(
+            {'default': 20.}))
+        expected = ContextMaker(src.tectonic_region_type, gsims, param=param
+                                ).poe_map(src, sitecol, imtls, 3)
+        param['magdist_tolerance'] = .001
+        cmaker = ContextMaker(src.tectonic_region_type, gsims, param=param)
+        self.assertEqual(cmaker.table_distance, 'rrup')
+        pmap = cmaker.poe_map(src, sitecol, imtls, 3)
+        # 3 magnitudes x 2 vs30 values
+        self.assertEqual(len(cmaker.poes_table), 6)
+        npt.assert_allclose(pmap.array, expected.array, rtol=1E-4)
+
+    def test_site_classes(self):
+        # heterogeneous vs30, as in a continuous site model; the values
+        # are below 750 m/s, where SadighEtAl1997 switches to rock
+        src = PointSource(
+            'src', 'point', TRT.ACTIVE_SHALLOW_CRUST,
+            TruncatedGRMFD(a_val=1, b_val=1, min_mag=5, max_mag=6.5,
+                           bin_width=.5),
+            2., WC1994(), 1.5, PoissonTOM(50.), 0., 20.,
+            Point(0.1, 0.1), PMF([(1, NodalPlane(0, 90, 0))]),
+            PMF([(1, 10.)]))
+        vs30s = numpy.random.RandomState(42).uniform(300., 700., 100)
+        sitecol = SiteCollection(
+            [Site(Point(0.5 + i * .01, 0.), vs30, z1pt0=100., z2pt5=1.)
+             for i, vs30 in enumerate(vs30s)])
+        imtls = DictArray({'PGA': [0.01, 0.1, 0.2], 'SA(0.1)': [0.1, 0.2]})
+        gsims = [SadighEtAl1997()]
+        maxdist = IntegrationDistance({'default': 300.})
+        param = dict(pointsource_distance=IntegrationDistance(
+            {'default': 20.}))
+        expected = ContextMaker(src.tectonic_region_type, gsims, maxdist,
+                                param).poe_map(src, sitecol, imtls, 3)
+        param['magdist_tolerance'] = .001
+        param['magdist_site_tolerance'] = {'default': .05}
+        cmaker = ContextMaker(src.tectonic_region_type, gsims, maxdist, param)
+        pmap = cmaker.poe_map(src, sitecol, imtls, 3)
+        # the vs30 values in the range 300-700 m/s fall in 18 classes
+        # with a tolerance of 5%, so there are 3 x 18 tables and not
+        # one for each site
+        nclasses = len(numpy.unique(numpy.round(
+            numpy.log1p(vs30s) / numpy.log1p(.05))))
+        self.assertEqual(nclasses, 18)
+        self.assertEqual(len(cmaker.poes_table), 3 * nclasses)
+        # the grid covers only the distances from 20 to 300 km, i.e.
+        # 2666 points instead of the 5711 points from 0 to 300 km
+        D = len(cmaker.dist_grid)
+        self.assertEqual(D, 2666)
+        self.assertLessEqual(cmaker.dist_grid[0], 20.)
+        self.assertGreater(cmaker.dist_grid[1], 20.)
+        self.assertGreaterEqual(cmaker.dist_grid[-1], 300.)
+        for table in cmaker.poes_table.values():
+            self.assertEqual(table.shape, (D, 5, 1))
+        self.assertEqual(cmaker.table_nbytes, 3 * nclasses * D * 5 * 8)
+        npt.assert_allclose(pmap.array, expected.array, rtol=5E-2, atol=1E-6)
+
+        # with a budget of 10 tables only the most recent ones are kept
+        cmaker = ContextMaker(src.tectonic_region_type, gsims, maxdist, param)
+        cmaker.table_bytes = 10 * D * 5 * 8
+        pmap2 = cmaker.poe_map(src, sitecol, imtls, 3)
+        self.assertLessEqual(len(cmaker.poes_table), nclasses)
+        self.assertEqual(cmaker.table_nbytes, sum(
+            table.nbytes for table in cmaker.poes_table.values()))
+        npt.assert_allclose(pmap2.array, pmap.array)
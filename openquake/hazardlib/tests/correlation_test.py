@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import unittest
+import mock
 
 import numpy
 
@@ -136,6 +137,58 @@ class JB2009ApplyCorrelationTestCase(unittest.TestCase):
                                           decimal=2)
 
 
+class JB2009CacheTestCase(unittest.TestCase):
+    SITECOL = SiteCollection([Site(Point(2, -40), 1, 1, 1),
+                              Site(Point(2, -40.1), 1, 1, 1),
+                              Site(Point(2, -39.9), 1, 1, 1),
+                              Site(Point(2.1, -40), 1, 1, 1)])
+
+    def test_subset(self):
+        cormo = JB2009CorrelationModel(vs30_clustering=False)
+        sites = self.SITECOL.filtered([0, 2, 3])
+        residuals = numpy.random.normal(size=(3, 5))
+        corr = cormo.apply_correlation(sites, PGA(), residuals)
+        # the factor is computed on the subset, not on the complete sites
+        lt = numpy.linalg.cholesky(cormo._get_correlation_matrix(sites, PGA()))
+        aaae(corr, lt.dot(residuals))
+        self.assertEqual(len(cormo.cache), 1)
+
+        # the factor is reused for the same subset of sites
+        with mock.patch.object(cormo, 'factorize') as factorize:
+            cormo.apply_correlation(sites, PGA(), residuals)
+        self.assertEqual(factorize.call_count, 0)
+        cormo.apply_correlation(self.SITECOL, PGA(), numpy.ones((4, 5)))
+        cormo.apply_correlation(self.SITECOL, SA(1.0), numpy.ones((4, 5)))
+        self.assertEqual(len(cormo.cache), 3)
+
+        self.assertEqual(cormo.cache_nbytes, sum(
+            f.nbytes for f in cormo.cache.values()))
+
+        # the least recently used factors are discarded
+        cormo.cache_bytes = 100
+        cormo.apply_correlation(sites, PGA(), residuals)
+        self.assertEqual(len(cormo.cache), 1)
+        self.assertEqual(cormo.cache_nbytes, 72)  # a 3x3 matrix of floats
+
+    def test_low_rank(self):
+        numpy.random.seed(42)
+        sites = SiteCollection([Site(Point(2 + i / 1000., -40 + j / 1000.),
+                                     1, 1, 1)
+                                for i in range(7) for j in range(7)])
+        cormo = JB2009CorrelationModel(vs30_clustering=False, max_error=.05)
+        vecs, sqrtvals = cormo.factorize(sites, PGA())
+        self.assertEqual(vecs.shape, (49, 14))  # rank 14 instead of 49
+        corma = cormo._get_correlation_matrix(sites, PGA())
+        approx = vecs.dot(numpy.diag(sqrtvals ** 2)).dot(vecs.T)
+        self.assertLessEqual(numpy.abs(corma - approx).max(), .05)
+        # the residuals are multiplied by a square root of the approximation
+        sqrt = vecs.dot(numpy.diag(sqrtvals)).dot(vecs.T)
+        aaae(sqrt.dot(sqrt), approx)
+        residuals = numpy.random.normal(size=(49, 5))
+        corr = cormo.apply_correlation(sites, PGA(), residuals)
+        aaae(corr, sqrt.dot(residuals))
+
+
 class HM2018CorrelationMatrixTestCase(unittest.TestCase):
     SITECOL = SiteCollection([Site(Point(2, -40), 1, 1, 1),
                               Site(Point(2, -40.1), 1, 1, 1),
@@ -263,6 +316,24 @@ class HM2018ApplyCorrelationTestCase(unittest.TestCase):
         actual_corrcoef = cormo._get_correlation_matrix(self.SITECOL, imt)
         aaae(inferred_corrcoef, actual_corrcoef, 2)
 
+    def test_different_stddevs(self):
+        # two ruptures affecting the same sites with different stddevs:
+        # the cached factor must not depend on the stddevs of the first
+        imt = SA(period=2.0, damping=5)
+        cormo = HM2018CorrelationModel(uncertainty_multiplier=0)
+        corma = numpy.asarray(
+            cormo._get_correlation_matrix(self.SITECOL, imt))
+        residuals = numpy.random.RandomState(42).normal(size=(3, 4))
+        for stddev_intra in (numpy.array([0.5, 0.6, 0.7]),
+                             numpy.array([0.2, 0.9, 0.4])):
+            cov = stddev_intra[:, None] * corma * stddev_intra
+            expected = numpy.linalg.cholesky(cov).dot(
+                residuals / stddev_intra[:, None])
+            corr = cormo.apply_correlation(
+                self.SITECOL, imt, residuals, stddev_intra)
+            aaae(corr, expected)
+        self.assertEqual(len(cormo.cache), 1)
+
     def test_with_uncertainty(self):
         numpy.random.seed(1)
         Nsim = 100000
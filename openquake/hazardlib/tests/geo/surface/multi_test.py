@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+# The Hazard Library
+# Copyright (C) 2018 GEM Foundation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import unittest
+import numpy
+from openquake.hazardlib.geo import Mesh, Point, PlanarSurface
+from openquake.hazardlib.geo.surface.multi import MultiSurface
+
+
+class MultiPlanarSurfaceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.surfaces = [
+            PlanarSurface.from_corner_points(
+                Point(0, 0, 2), Point(.2, 0, 2),
+                Point(.2, -.1, 10), Point(0, -.1, 10)),
+            PlanarSurface.from_corner_points(
+                Point(.2, 0, 2), Point(.3, .15, 2),
+                Point(.35, .12, 12), Point(.25, -.03, 12))]
+        self.multi = MultiSurface(self.surfaces)
+        lons, lats = numpy.meshgrid(numpy.linspace(-.3, .6, 13),
+                                    numpy.linspace(-.4, .4, 11))
+        self.mesh = Mesh(lons, lats, numpy.zeros_like(lons))
+
+    def test_planes(self):
+        self.assertEqual(self.multi.planes['normal'].shape, (2, 3))
+        dists = [surf.get_min_distance(self.mesh) for surf in self.surfaces]
+        aac = numpy.testing.assert_allclose
+        aac(self.multi.get_min_distance(self.mesh),
+            numpy.min(dists, axis=0).flatten())
+        jb = [surf.get_joyner_boore_distance(self.mesh)
+              for surf in self.surfaces]
+        aac(self.multi.get_joyner_boore_distance(self.mesh),
+            numpy.min(jb, axis=0))
+
+        # the closest points are the ones on the closest plane
+        dist, idx, closest = self.multi.get_min_distance_closest_points(
+            self.mesh)
+        self.assertEqual(closest.lons.shape, self.mesh.lons.shape)
+        numpy.testing.assert_equal(idx, numpy.argmin(dists, axis=0).flatten())
+        for i, surf in enumerate(self.surfaces):
+            ok = idx == i
+            expected = surf.get_closest_points(self.mesh)
+            aac(closest.lons.flatten()[ok], expected.lons.flatten()[ok])
+            aac(closest.lats.flatten()[ok], expected.lats.flatten()[ok])
+            aac(closest.depths.flatten()[ok], expected.depths.flatten()[ok],
+                atol=1E-9)
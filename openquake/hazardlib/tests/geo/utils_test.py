@@ -372,6 +372,16 @@ class ConvexToPointDistanceTestCase(unittest.TestCase):
             dist = utils.point_to_polygon_distance(polygon, pxx, pyy)
             numpy.testing.assert_almost_equal(dist, [0.5, 1, 2])
 
+    def test_polygon_with_hole(self):
+        polygon = shapely.geometry.Polygon(
+            [(0, 0), (4, 0), (4, 4), (0, 4)],
+            [[(1, 1), (3, 1), (3, 3), (1, 3)]])
+        pxx = numpy.array([2.0, 2.5, 0.5, 5.0, 1.0, 4.0])
+        pyy = numpy.array([2.0, 2.0, 0.5, 5.0, 2.0, 2.0])
+        dist = utils.point_to_polygon_distance(polygon, pxx, pyy)
+        numpy.testing.assert_almost_equal(
+            dist, [1, 0.5, 0, numpy.sqrt(2), 0, 0])
+
 
 class WithinTestCase(unittest.TestCase):
     """
@@ -23,6 +23,7 @@ import mock
 import numpy
 from copy import deepcopy
 
+from openquake.baselib.general import DictArray
 from openquake.hazardlib import const
 from openquake.hazardlib.gsim.base import (
     GMPE, IPE, CoeffsTable, SitesContext, RuptureContext, DistancesContext,
@@ -32,6 +33,13 @@ from openquake.hazardlib.imt import PGA, PGV, SA
 from openquake.hazardlib.site import Site, SiteCollection
 from openquake.hazardlib.source.rupture import BaseRupture
 from openquake.hazardlib.gsim.base import ContextMaker
+from openquake.hazardlib.contexts import DistancesMemo, FEWSITES
+from openquake.hazardlib.calc.filters import IntegrationDistance
+from openquake.hazardlib.geo.nodalplane import NodalPlane
+from openquake.hazardlib.pmf import PMF
+from openquake.hazardlib.gsim.boore_atkinson_2008 import BooreAtkinson2008
+from openquake.hazardlib.gsim.zhao_2006 import ZhaoEtAl2006Asc
+from openquake.hazardlib.tests.source.point_test import make_point_source
 
 aac = numpy.testing.assert_allclose
 
@@ -166,6 +174,30 @@ class GetPoEsTestCase(_FakeGSIMTestCase):
         self.assertAlmostEqual(poe22, 0.6034116)
         self.assertAlmostEqual(poe23, 0.5521092)
 
+    def test_get_poes_many(self):
+        self.gsim_class.DEFINED_FOR_STANDARD_DEVIATION_TYPES = frozenset(
+            self.gsim_class.DEFINED_FOR_STANDARD_DEVIATION_TYPES |
+            {const.StdDev.TOTAL})
+        self.gsim.DEFINED_FOR_INTENSITY_MEASURE_TYPES = frozenset(
+            [PGA, PGV])
+
+        def get_mean_and_stddevs(sites, rup, dists, imt, stddev_types):
+            shift = 1 if imt.name == 'PGV' else 0
+            return (numpy.array([3., 4., 5.]) + shift,
+                    [numpy.array([4., 5., 6.])])
+        self.gsim.get_mean_and_stddevs = get_mean_and_stddevs
+        imtls = DictArray({'PGA': [2., 3., 4.], 'PGV': [1., 5.]})
+        for trunclevel in (None, 0, 2.):
+            out = numpy.empty((3, 5))
+            self.gsim.get_poes_many(SitesContext(), RuptureContext(),
+                                    DistancesContext(), imtls, trunclevel,
+                                    out)
+            for imt in imtls:
+                imt_obj = PGA() if imt == 'PGA' else PGV()
+                aac(out[:, imtls(imt)], self._get_poes(
+                    imt=imt_obj, imls=imtls[imt],
+                    truncation_level=trunclevel))
+
 
 class TGMPE(GMPE):
     DEFINED_FOR_TECTONIC_REGION_TYPE = None
@@ -360,6 +392,57 @@ class MakeContextsTestCase(_FakeGSIMTestCase):
                           'get_joyner_boore_distance': 1,
                           'get_strike': 1})
 
+    def test_memo(self):
+        self.gsim_class.REQUIRES_DISTANCES = set('rjb rx'.split())
+        self.gsim_class.REQUIRES_RUPTURE_PARAMETERS = set(['mag'])
+        self.gsim_class.REQUIRES_SITES_PARAMETERS = set(['vs30'])
+        sites = SiteCollection([self.site1, self.site2])
+        memo = DistancesMemo(self.rupture, sites)
+        cmaker = ContextMaker('faketrt', [self.gsim_class])
+        sctx, dctx = cmaker.make_contexts(
+            sites.filtered([1]), self.rupture, memo)
+        aac(sctx.vs30, [1456])
+        aac(dctx.rjb, [7])
+        aac(dctx.rx, [5])
+        # the distances of all sites are computed only once
+        aac(memo.get('rjb'), [6, 7])
+        aac(memo.get('rx'), [4, 5])
+        self.assertEqual(self.fake_surface.call_counts,
+                         {'get_rx_distance': 1,
+                          'get_joyner_boore_distance': 1})
+
+
+class PlanarRupturesTestCase(unittest.TestCase):
+    def test_poe_map(self):
+        src = make_point_source(
+            nodal_plane_distribution=PMF([(.3, NodalPlane(45, 90, 0)),
+                                          (.7, NodalPlane(10, 30, 90))]),
+            hypocenter_distribution=PMF([(.5, 2.), (.5, 4.)]))
+        src.id = 0
+        imtls = DictArray({'PGA': [.01, .1, .2]})
+        gsims = [BooreAtkinson2008(), ZhaoEtAl2006Asc()]
+        maxdist = IntegrationDistance({'default': 100})
+        for lons in ([1.2, 1.3, 1.6], numpy.linspace(.5, 2, 20)):
+            sites = SiteCollection.from_points(
+                lons, numpy.repeat(3.3, len(lons)),
+                req_site_params=['vs30'])
+            sites.array['vs30'] = 760
+            cmaker = ContextMaker(src.tectonic_region_type, gsims, maxdist)
+            self.assertTrue(cmaker._planar(src))
+            pmap = cmaker.poe_map(src, sites, imtls, 3)
+            rupdata = cmaker.rupdata
+            # compare with the ruptures built as objects
+            with mock.patch.object(ContextMaker, '_planar',
+                                   lambda self, src: False):
+                expected = cmaker.poe_map(src, sites, imtls, 3)
+            self.assertEqual(sorted(pmap), sorted(expected))
+            for sid in pmap:
+                aac(pmap[sid].array, expected[sid].array)
+            if len(sites) <= FEWSITES:
+                for name in ('rrup', 'rjb', 'lon', 'lat', 'width', 'ztor'):
+                    if name in rupdata.dtype.names:
+                        aac(rupdata[name], cmaker.rupdata[name])
+
 
 class ContextTestCase(unittest.TestCase):
     def test_equality(self):
@@ -500,3 +583,20 @@ class CoeffsTableTestCase(unittest.TestCase):
         self.assertEqual(str(te.exception),
                          "CoeffsTable cannot be constructed with "
                          "inputs of the form 'int'")
+
+    def test_interpolation_cache(self):
+        table = CoeffsTable(sa_damping=5, table=self.coefficient_string)
+        c1 = table[SA(0.5)]
+        self.assertIs(table[SA(0.5)], c1)  # retrieved from the cache
+        self.assertEqual(list(table._interpolated), [SA(0.5)])
+        with self.assertRaises(KeyError):
+            table[SA(20.)]  # extrapolation is not possible
+
+    def test_get_coeffs(self):
+        table = CoeffsTable(sa_damping=5, table=self.coefficient_string)
+        imts = [PGA(), SA(0.1), SA(0.5), SA(1.0)]
+        arr = table.get_coeffs(imts)
+        self.assertEqual(arr.dtype.names, ('a', 'b'))
+        for rec, imt in zip(arr, imts):
+            self.assertAlmostEqual(rec['a'], table[imt]['a'])
+            self.assertAlmostEqual(rec['b'], table[imt]['b'])
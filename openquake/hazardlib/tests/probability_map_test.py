@@ -16,9 +16,12 @@
 #  You should have received a copy of the GNU Affero General Public License
 #  along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
 
+import pickle
 import unittest
 import numpy
-from openquake.hazardlib.probability_map import ProbabilityMap
+from openquake.baselib.general import DictArray
+from openquake.hazardlib.probability_map import (
+    ProbabilityMap, ProbabilityCurve)
 
 
 class ProbabilityMapTestCase(unittest.TestCase):
@@ -40,3 +43,53 @@ class ProbabilityMapTestCase(unittest.TestCase):
         # test pmap power
         pmap = pmap1 ** 2
         numpy.testing.assert_almost_equal(pmap[0].array, [[.16], [0], [0]])
+
+    def test_ior(self):
+        pmap1 = ProbabilityMap.build(3, 2, sids=[0, 2])
+        pmap1[0].array[:] = .5
+        pmap2 = ProbabilityMap.build(3, 2, sids=[1, 2], initvalue=.2)
+        pmap2[2] = ProbabilityCurve(numpy.full((3, 2), .6))  # not contiguous
+        pcurve = pmap1[0]
+        pmap1 |= pmap2
+        self.assertEqual(sorted(pmap1), [0, 1, 2])
+        self.assertIs(pmap1[0], pcurve)  # the curves are kept
+        numpy.testing.assert_allclose(pmap1[0].array, .5)
+        numpy.testing.assert_allclose(pmap1[1].array, .2)
+        numpy.testing.assert_allclose(pmap1[2].array, .6)
+
+        # the curves of pmap2 are copied, not shared
+        pmap1 |= pmap2
+        numpy.testing.assert_allclose(pmap1[1].array, .36)
+        numpy.testing.assert_allclose(pmap2[1].array, .2)
+
+    def test_grow(self):
+        pmap = ProbabilityMap(2)
+        for sid in range(10):
+            pmap |= ProbabilityMap.build(2, 1, [sid], initvalue=sid / 10.)
+        numpy.testing.assert_allclose(
+            pmap.array[:, 0, 0], numpy.arange(10) / 10.)
+        pmap[3].array[:] = 1  # the views are still valid after the growth
+        numpy.testing.assert_allclose(pmap.array[3], 1)
+
+    def test_invert_and_convert(self):
+        pmap = ProbabilityMap.build(2, 1, sids=[5, 1, 3], initvalue=.1)
+        pmap[3].array[:] = 1.
+        inv = ~pmap
+        self.assertEqual(sorted(inv), [1, 5])  # the ones are discarded
+        numpy.testing.assert_allclose(inv.array, .9)
+        imtls = DictArray({'PGA': [.1, .2]})
+        curves = pmap.convert(imtls, 6)
+        numpy.testing.assert_allclose(
+            curves['PGA'][:, 0], [0, .1, 0, 1, 0, .1])
+        curves = pmap.convert2(imtls, numpy.array([0, 3, 5]))
+        numpy.testing.assert_allclose(curves['PGA'][:, 0], [0, 1, .1])
+
+    def test_pickle(self):
+        pmap = ProbabilityMap.build(2, 3, sids=[4, 2], initvalue=.1)
+        pmap[2] = ProbabilityCurve(numpy.full((2, 3), .2))
+        pmap.eff_ruptures = 7
+        new = pickle.loads(pickle.dumps(pmap))
+        self.assertEqual(new.eff_ruptures, 7)
+        self.assertEqual(sorted(new), [2, 4])
+        numpy.testing.assert_equal(new.array, pmap.array)
+        self.assertEqual(new.extract(1).array.shape, (2, 2, 1))
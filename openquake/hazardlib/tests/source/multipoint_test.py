@@ -25,6 +25,7 @@ from openquake.hazardlib.geo.mesh import Mesh
 from openquake.hazardlib.scalerel.peer import PeerMSR
 from openquake.hazardlib.geo import NodalPlane
 from openquake.hazardlib.pmf import PMF
+from openquake.hazardlib.tom import PoissonTOM
 
 
 class MultiPointTestCase(unittest.TestCase):
@@ -83,3 +84,31 @@ multiPointSource{id='mp1', name='multi point source', tectonicRegion='Active Sha
         numpy.testing.assert_almost_equal(
             (-0.8994569916564479, -0.39932, 1.8994569916564479, 1.89932),
             bbox)
+
+    def test_rupture_arrays(self):
+        npd = PMF([(0.5, NodalPlane(1, 20, 3)),
+                   (0.5, NodalPlane(2, 80, 4))])
+        hd = PMF([(1, 14)])
+        mesh = Mesh(numpy.array([0, 1]), numpy.array([0.5, 1]))
+        mmfd = MultiMFD('incrementalMFD',
+                        size=2,
+                        min_mag=[4.5],
+                        bin_width=[2.0],
+                        occurRates=[[.3, .1], [.4, .2, .1]])
+        mps = MultiPointSource('mp1', 'multi point source',
+                               'Active Shallow Crust',
+                               mmfd, PeerMSR(), 1.0,
+                               10, 20, npd, hd, mesh, PoissonTOM(1.))
+        ruptures = list(mps.iter_ruptures())
+        rups = numpy.concatenate(list(mps.iter_rupture_arrays()))
+        self.assertEqual(len(rups), 10)
+        self.assertEqual(len(ruptures), 10)
+        for rupture, rec in zip(ruptures, rups):
+            rup = mps.rupture_from_array(rec)
+            self.assertEqual(rup.mag, rupture.mag)
+            self.assertEqual(rup.occurrence_rate, rupture.occurrence_rate)
+            self.assertEqual(rup.hypocenter, rupture.hypocenter)
+            numpy.testing.assert_allclose(
+                rup.surface.corner_lons, rupture.surface.corner_lons)
+            numpy.testing.assert_allclose(
+                rup.surface.corner_depths, rupture.surface.corner_depths)
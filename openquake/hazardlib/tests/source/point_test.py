@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import unittest
+import numpy
 from openquake.hazardlib.const import TRT
 from openquake.hazardlib.source.point import PointSource
 from openquake.hazardlib.source.rupture import ParametricProbabilisticRupture
@@ -404,6 +405,29 @@ class PointSourceIterRupturesTestCase(unittest.TestCase):
         self.assertEqual(len(ruptures), 1)
 
 
+class PointSourceRuptureArraysTestCase(unittest.TestCase):
+    def test_same_as_iter_ruptures(self):
+        src = make_point_source(
+            nodal_plane_distribution=PMF([(.3, NodalPlane(45, 90, 0)),
+                                          (.7, NodalPlane(10, 30, 90))]),
+            hypocenter_distribution=PMF([(.5, 2.), (.5, 4.)]),
+            magnitude_scaling_relationship=WC1994())
+        for hcdist, npdist in [(True, True), (False, False)]:
+            ruptures = list(src.iter_ruptures(hcdist, npdist))
+            [rups] = src.iter_rupture_arrays(hcdist, npdist)
+            self.assertEqual(len(rups), len(ruptures))
+            for rupture, rec in zip(ruptures, rups):
+                surface = rupture.surface
+                numpy.testing.assert_allclose(rec['corners'], [
+                    surface.corner_lons, surface.corner_lats,
+                    surface.corner_depths])
+                self.assertEqual(rec['mag'], rupture.mag)
+                self.assertEqual(rec['rate'], rupture.occurrence_rate)
+                rup = src.rupture_from_array(rec)
+                self.assertEqual(rup.hypocenter, rupture.hypocenter)
+                self.assertAlmostEqual(rup.surface.width, surface.width)
+
+
 class PointSourceMaxRupProjRadiusTestCase(unittest.TestCase):
     def test(self):
         mfd = TruncatedGRMFD(a_val=1, b_val=2, min_mag=3,
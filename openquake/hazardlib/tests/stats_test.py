@@ -1,7 +1,11 @@
+import functools
 import unittest
+import mock
 import numpy
+from openquake.baselib.general import DictArray
+from openquake.hazardlib.probability_map import ProbabilityMap
 from openquake.hazardlib.stats import (
-    mean_curve, quantile_curve, std_curve)
+    mean_curve, quantile_curve, std_curve, compute_pmap_stats)
 
 aaae = numpy.testing.assert_array_almost_equal
 
@@ -124,3 +128,38 @@ class QuantileCurveTestCase(unittest.TestCase):
         actual_curve = quantile_curve(quantile, curves, weights)
 
         numpy.testing.assert_allclose(expected_curve, actual_curve)
+
+    def test_compute_quantile_curve_many(self):
+        # compare with numpy.interp called on each element, also in
+        # presence of ties and zero weights
+        rng = numpy.random.RandomState(42)
+        curves = rng.randint(0, 5, size=(7, 4, 3)) / 4.
+        weights = numpy.array([.1, 0, .2, .15, .05, .3, .2])
+        for quantile in (0, .05, .1, .5, .85, 1):
+            actual = quantile_curve(quantile, curves, weights)
+            self.assertEqual(actual.shape, (4, 3))
+            for idx, value in numpy.ndenumerate(actual):
+                data = curves[(slice(None),) + idx]
+                sorted_idxs = numpy.argsort(data)
+                expected = numpy.interp(
+                    quantile, numpy.cumsum(weights[sorted_idxs]),
+                    data[sorted_idxs])
+                self.assertAlmostEqual(value, expected)
+
+
+class ComputePmapStatsTestCase(unittest.TestCase):
+    def test_chunks(self):
+        imtls = DictArray({'PGA': [.1, .2, .3], 'SA(1.0)': [.1, .2]})
+        weights = [{imt: w for imt in imtls} for w in (.2, .3, .5)]
+        rng = numpy.random.RandomState(42)
+        pmaps = [ProbabilityMap.from_array(rng.random_sample((4, 5)), sids)
+                 for sids in ([0, 1, 2, 5], [1, 2, 3, 5], [0, 2, 3, 4])]
+        stats = [mean_curve, functools.partial(quantile_curve, .5)]
+        expected = compute_pmap_stats(pmaps, stats, weights, imtls)
+        with mock.patch('openquake.hazardlib.stats.MAX_BYTES', 1):
+            actual = compute_pmap_stats(pmaps, stats, weights, imtls)
+        self.assertEqual(sorted(actual), [0, 1, 2, 3, 4, 5])
+        aaae(actual.array, expected.array)
+        # the missing curves count as zeros
+        curves = numpy.array([pmap.get_curves([4]) for pmap in pmaps])
+        aaae(actual[4].array[:, 0], mean_curve(curves[:, 0], [.2, .3, .5]))
@@ -22,6 +22,7 @@ import logging
 import collections
 from urllib.parse import unquote_plus
 import numpy
+from scipy import special
 
 from openquake.baselib import hdf5
 from openquake.baselib.general import (
@@ -34,6 +35,7 @@ class ValidationError(Exception):
 
 
 U32 = numpy.uint32
+U64 = numpy.uint64
 F32 = numpy.float32
 by_taxonomy = operator.attrgetter('taxonomy')
 
@@ -123,21 +125,24 @@ class CompositeRiskModel(collections.Mapping):
     # used in ebrisk
     def get_assets_ratios(self, assets, gmvs, imts):
         """
-        :param assets: assets on the same site
+        :param assets: assets on the same site, or an array with a field
+                       taxonomy as returned by AssetGetter.get_array
         :params gmvs: hazard on the given site, shape (E, M)
         :param imts: intensity measure types
         :returns: a list of (assets, loss_ratios) for each taxonomy on the site
         """
         imti = {imt: i for i, imt in enumerate(imts)}
-        assets_by_t = groupby(assets, operator.attrgetter('taxonomy'))
+        if isinstance(assets, numpy.ndarray):
+            assets_by_t = group_array(assets, 'taxonomy')
+        else:
+            assets_by_t = groupby(assets, operator.attrgetter('taxonomy'))
         assets_ratios = []
-        for taxo, rm in self.items():
-            t = self.taxonomy_dict[taxo]
-            try:
-                assets = assets_by_t[t]
-            except KeyError:  # there are no assets of taxonomy taxo
-                continue
-            assets_ratios.append((assets, rm.get_loss_ratios(gmvs, imti)))
+        # loop on the taxonomies on the site, not on all the taxonomies
+        for taxo, t in sorted((self.taxonomy[t], t) for t in assets_by_t):
+            if taxo in self._riskmodels:
+                rm = self._riskmodels[taxo]
+                assets_ratios.append(
+                    (assets_by_t[t], rm.get_loss_ratios(gmvs, imti)))
         return assets_ratios
 
     def init(self, oqparam):
@@ -359,7 +364,7 @@ class RiskInput(object):
     :param assets_by_site:
         array of assets, one per site
     :param eps_dict:
-        dictionary of epsilons (can be None)
+        dictionary of epsilons or LazyEpsilons instance (can be None)
     """
     def __init__(self, hazard_getter, assets_by_site, eps_dict=None):
         self.hazard_getter = hazard_getter
@@ -419,8 +424,9 @@ class EpsilonMatrix0(object):
         """
         eps = numpy.zeros((self.num_assets, len(self.seeds)), F32)
         for i, seed in enumerate(self.seeds):
-            numpy.random.seed(seed)
-            eps[:, i] = numpy.random.normal(size=self.num_assets)
+            # a local generator does not touch the global numpy state
+            rng = numpy.random.RandomState(seed)
+            eps[:, i] = rng.normal(size=self.num_assets)
         return eps
 
     def __getitem__(self, aid):
@@ -445,8 +451,7 @@ class EpsilonMatrix1(object):
         self.num_assets = num_assets
         self.num_events = num_events
         self.seed = seed
-        numpy.random.seed(seed)
-        self.eps = numpy.random.normal(size=num_events)
+        self.eps = numpy.random.RandomState(seed).normal(size=num_events)
 
     def __getitem__(self, item):
         if isinstance(item, tuple):
@@ -462,8 +467,77 @@ class EpsilonMatrix1(object):
         return self.num_assets
 
 
-def make_epsilon_getter(n_assets, n_events, correlation, master_seed, no_eps):
+def _mix(x):
+    # splitmix64 finalizer, a bijection of the 64 bit integers
+    x = (x ^ (x >> U64(30))) * U64(0xbf58476d1ce4e5b9)
+    x = (x ^ (x >> U64(27))) * U64(0x94d049bb133111eb)
+    return x ^ (x >> U64(31))
+
+
+class LazyEpsilons(object):
+    """
+    Mock-up for a matrix of epsilons of size A x E, where the epsilons are
+    computed on demand from a counter-based generator, i.e. by hashing the
+    master seed, the asset ordinal and the event index. Nothing is stored,
+    so the epsilons of a given asset and event are the same in any task
+    and the memory occupation does not depend on A x E. The correlation
+    between assets is obtained with a component shared by all assets:
+
+    eps[a, e] = sqrt(rho) * z[e] + sqrt(1 - rho) * z[a, e]
+
+    :param num_assets: number of assets
+    :param num_events: number of events
+    :param correlation: the asset correlation rho, between 0 and 1
+    :param seed: the master seed
+    :param start: index of the first event
+
+    >>> eps = LazyEpsilons(3, 2, 1, 42)
+    >>> (eps.get([0, 1, 2], [0, 1])[0] == eps[2, [0, 1]]).all()
+    True
     """
+    def __init__(self, num_assets, num_events, correlation, seed, start=0):
+        self.num_assets = num_assets
+        self.num_events = num_events
+        self.correlation = correlation
+        self.seed = seed
+        self.start = start
+
+    def _normal(self, stream, aids, eids):
+        key = _mix(numpy.array([self.seed * 2 + stream], U64))
+        rows = _mix(key ^ numpy.array(aids, U64))
+        cols = numpy.array(eids, U64) + U64(self.start)
+        bits = _mix(rows[:, None] ^ _mix(cols)) >> U64(11)  # 53 bits
+        return special.ndtri((bits + .5) / 2. ** 53)
+
+    def get(self, aids, eids):
+        """
+        :param aids: A' asset ordinals
+        :param eids: E' event indices
+        :returns: an array of epsilons of shape (A', E')
+        """
+        rho = self.correlation
+        eps = numpy.zeros((len(aids), len(eids)), F32)
+        if rho:  # component shared by all assets
+            eps += numpy.sqrt(rho) * self._normal(0, [0], eids)
+        if rho < 1:  # component specific of each asset
+            eps += numpy.sqrt(1 - rho) * self._normal(1, aids, eids)
+        return eps
+
+    def __getitem__(self, item):
+        if isinstance(item, tuple):
+            # item[0] is the asset index, item[1] the event indices
+            return self.get([item[0]], item[1])[0]
+        # item is an asset index
+        return self.get([item], numpy.arange(self.num_events))[0]
+
+    def __len__(self):
+        return self.num_assets
+
+
+def make_epsilon_getter(n_assets, n_events, correlation, master_seed, no_eps,
+                        lazy=False):
+    """
+    :param lazy: if True, return LazyEpsilons instead of matrices
     :returns: a function (start, stop) -> matrix of shape (n_assets, n_events)
     """
     assert n_assets > 0, n_assets
@@ -476,6 +550,9 @@ def make_epsilon_getter(n_assets, n_events, correlation, master_seed, no_eps):
     def get_eps(start=0, stop=n_events):
         if no_eps:
             eps = None
+        elif lazy:
+            eps = LazyEpsilons(
+                n_assets, stop - start, correlation, master_seed, start)
         elif correlation:
             eps = EpsilonMatrix1(n_assets, stop - start, master_seed)
         else:
@@ -506,20 +583,3 @@ def make_eps(assetcol, num_samples, seed, correlation):
         for asset, epsrow in zip(assets, epsilons):
             eps[asset.ordinal] = epsrow
     return eps
-
-
-def str2rsi(key):
-    """
-    Convert a string of the form 'rlz-XXXX/sid-YYYY/ZZZ'
-    into a triple (XXXX, YYYY, ZZZ)
-    """
-    rlzi, sid, imt = key.split('/')
-    return int(rlzi[4:]), int(sid[4:]), imt
-
-
-def rsi2str(rlzi, sid, imt):
-    """
-    Convert a triple (XXXX, YYYY, ZZZ) into a string of the form
-    'rlz-XXXX/sid-YYYY/ZZZ'
-    """
-    return 'rlz-%04d/sid-%04d/%s' % (rlzi, sid, imt)
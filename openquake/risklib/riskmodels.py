@@ -351,15 +351,14 @@ class ProbabilisticEventBased(RiskModel):
 
     def get_loss_ratios(self, gmvs, imti):  # used in ebrisk
         """
-        :param gmvs: an array of shape (E, M)
+        :param gmvs: an array of shape (E, M), or (N, E, M) for N sites
         :param imti: a dictionary imt -> imt index
-        :returns: loss_ratios of shape (L, E)
+        :returns: loss_ratios of shape (L, E), or (L, N, E)
         """
         out = []
-        E = len(gmvs)
         for lt, vf in self.risk_functions.items():
-            loss_ratios = numpy.zeros(E, F32)
-            means, covs, idxs = vf.interpolate(gmvs[:, imti[vf.imt]])
+            loss_ratios = numpy.zeros(gmvs.shape[:-1], F32)
+            means, covs, idxs = vf.interpolate(gmvs[..., imti[vf.imt]])
             loss_ratios[idxs] = vf.sample(means, covs, idxs, None)
             out.append(loss_ratios)
         return numpy.array(out)
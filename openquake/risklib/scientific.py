@@ -117,16 +117,27 @@ class VulnerabilityFunction(object):
         self.distribution_name = distribution
 
         # to be set in .init(), called also by __setstate__
-        (self.stddevs, self._mlr_i1d, self._covs_i1d,
+        (self.stddevs, self._mlr_slopes, self._covs_slopes,
          self.distribution) = None, None, None, None
         self.init()
 
     def init(self):
         self.stddevs = self.covs * self.mean_loss_ratios
-        self._mlr_i1d = interpolate.interp1d(self.imls, self.mean_loss_ratios)
-        self._covs_i1d = interpolate.interp1d(self.imls, self.covs)
+        # lookup tables with the slopes of the segments between the IMLs
+        dimls = numpy.diff(self.imls)
+        self._mlr_slopes = numpy.diff(self.mean_loss_ratios) / dimls
+        self._covs_slopes = numpy.diff(self.covs) / dimls
         self.set_distribution(None)
 
+    def _interp(self, imls, values, slopes):
+        # linear interpolation of imls in the range of the function, with
+        # the same segments and formula of scipy.interpolate.interp1d;
+        # works on arrays of any shape, like (sites, events)
+        hi = numpy.clip(
+            numpy.searchsorted(self.imls, imls), 1, len(self.imls) - 1)
+        lo = hi - 1
+        return slopes[lo] * (imls - self.imls[lo]) + values[lo]
+
     def set_distribution(self, epsilons=None):
         if (self.covs > 0).any():
             self.distribution = DISTRIBUTIONS[self.distribution_name]()
@@ -143,11 +154,12 @@ class VulnerabilityFunction(object):
            (interpolated loss ratios, interpolated covs, indices > min)
         """
         # gmvs are clipped to max(iml)
-        gmvs_curve = numpy.piecewise(
-            gmvs, [gmvs > self.imls[-1]], [self.imls[-1], lambda x: x])
+        gmvs_curve = numpy.minimum(gmvs, self.imls[-1])
         idxs = gmvs_curve >= self.imls[0]  # indices over the minimum
         gmvs_curve = gmvs_curve[idxs]
-        return self._mlr_i1d(gmvs_curve), self._cov_for(gmvs_curve), idxs
+        means = self._interp(
+            gmvs_curve, self.mean_loss_ratios, self._mlr_slopes)
+        return means, self._cov_for(gmvs_curve), idxs
 
     def sample(self, means, covs, idxs, epsilons):
         """
@@ -238,11 +250,9 @@ class VulnerabilityFunction(object):
         [0.0049, 0.006, 0.027], the clipped imls are
         [0.005,  0.006, 0.0269].
         """
-        return self._covs_i1d(
-            numpy.piecewise(
-                imls,
-                [imls > self.imls[-1], imls < self.imls[0]],
-                [self.imls[-1], self.imls[0], lambda x: x]))
+        return self._interp(
+            numpy.clip(imls, self.imls[0], self.imls[-1]),
+            self.covs, self._covs_slopes)
 
     def __getstate__(self):
         return (self.id, self.imt, self.imls, self.mean_loss_ratios,
@@ -1401,6 +1411,56 @@ class LossesByPeriodBuilder(object):
             loss_ratios, self.return_periods,
             self.num_events[rlzi], self.eff_time)
 
+    # used in event_based_risk
+    def build_curves(self, asset_values, loss_ratios, rlzi, partial=True):
+        """
+        Vectorized version of .build_curve for many assets at once.
+
+        :param asset_values: an array of A asset values
+        :param loss_ratios: an array of loss ratios of shape (A, E)
+        :param rlzi: the realization index
+        :param partial: if True, sort only the losses needed by the periods
+        :returns: an array of loss curves of shape (A, P)
+        """
+        A, E = loss_ratios.shape
+        P = len(self.return_periods)
+        if E == 0:  # zero-curves
+            return numpy.zeros((A, P))
+        num_events = self.num_events[rlzi]
+        if num_events < E:
+            raise ValueError(
+                'There are not enough events (%d) to compute the loss curve '
+                'from %d losses' % (num_events, E))
+        if num_events == 1:  # numpy.interp returns the only loss
+            return asset_values[:, None] * loss_ratios * numpy.ones(P)
+        # the periods do not depend on the asset, so the interpolation
+        # indices and weights can be computed once for all assets
+        logp = numpy.log(self.eff_time / numpy.arange(num_events, 0., -1))
+        ok = ((logp[0] <= numpy.log(self.return_periods)) &
+              (numpy.log(self.return_periods) <= logp[-1]))
+        curves = numpy.full((A, P), numpy.nan)
+        if not ok.any():
+            return curves
+        x = numpy.log(self.return_periods[ok])
+        j = numpy.searchsorted(logp, x, 'right') - 1
+        j = numpy.clip(j, 0, num_events - 2)
+        w = (x - logp[j]) / (logp[j + 1] - logp[j])
+        # only the largest losses enter in the interpolation; the
+        # indices are relative to the losses sorted in ascending order
+        # and padded with num_events - E zeros in front
+        k = num_events - j.min()
+        if partial and k < E:
+            top = numpy.partition(loss_ratios, E - k, axis=1)[:, E - k:]
+        else:
+            k = E
+            top = loss_ratios
+        top = numpy.sort(top, axis=1).astype(float)
+        padded = numpy.concatenate([numpy.zeros((A, 1)), top], axis=1)
+        lo = padded[:, numpy.maximum(j - num_events + k + 1, 0)]
+        hi = padded[:, numpy.maximum(j - num_events + k + 2, 0)]
+        curves[:, ok] = lo + w * (hi - lo)
+        return asset_values[:, None] * curves
+
     # used in event_based_risk
     def build_maps(self, losses, clp, stats=()):
         """
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2018 GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import numpy
+from openquake.risklib.riskinput import LazyEpsilons, make_epsilon_getter
+
+aae = numpy.testing.assert_almost_equal
+
+
+class LazyEpsilonsTestCase(unittest.TestCase):
+
+    def test_deterministic(self):
+        eps = LazyEpsilons(10, 20, .5, 42)
+        full = eps.get(numpy.arange(10), numpy.arange(20))
+        self.assertEqual(full.shape, (10, 20))
+        # the same epsilons for any batch of assets and events
+        numpy.testing.assert_equal(
+            eps.get([7, 2], [15, 3, 4]), full[[7, 2]][:, [15, 3, 4]])
+        numpy.testing.assert_equal(eps[5], full[5])
+        numpy.testing.assert_equal(eps[5, [1, 2]], full[5, [1, 2]])
+        # and for a new instance, as in a different task
+        numpy.testing.assert_equal(
+            LazyEpsilons(10, 20, .5, 42).get([3], [8]), full[3:4, 8:9])
+
+        # a different seed gives different epsilons
+        other = LazyEpsilons(10, 20, .5, 43).get(
+            numpy.arange(10), numpy.arange(20))
+        self.assertFalse((other == full).any())
+
+        # the event indices are relative to the start
+        eps = LazyEpsilons(10, 5, .5, 42, start=12)
+        numpy.testing.assert_equal(
+            eps.get(numpy.arange(10), numpy.arange(5)), full[:, 12:17])
+        get_eps = make_epsilon_getter(10, 20, 1, 42, False, lazy=True)
+        numpy.testing.assert_equal(
+            get_eps(12, 17).get([4], numpy.arange(5)),
+            LazyEpsilons(10, 20, 1, 42).get([4], numpy.arange(12, 17)))
+
+    def test_distribution(self):
+        A, E = 4, 100000
+        for rho in (0, .3, 1):
+            eps = LazyEpsilons(A, E, rho, 42).get(
+                numpy.arange(A), numpy.arange(E))
+            # the marginals are standard normal
+            aae(eps.mean(axis=1), numpy.zeros(A), decimal=2)
+            aae(eps.std(axis=1), numpy.ones(A), decimal=2)
+            aae(numpy.percentile(eps, [2.5, 50, 97.5], axis=1),
+                numpy.array([[-1.96] * A, [0] * A, [1.96] * A]), decimal=1)
+            # the assets are correlated with coefficient rho
+            corr = numpy.corrcoef(eps)
+            aae(corr[numpy.triu_indices(A, 1)],
+                numpy.ones(A * (A - 1) // 2) * rho, decimal=2)
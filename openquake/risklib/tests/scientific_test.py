@@ -196,6 +196,17 @@ class VulnerabilityFunctionTestCase(unittest.TestCase):
         numpy.testing.assert_allclose(
             expected_covs, self.test_func._cov_for(test_input))
 
+    def test_interpolate_block(self):
+        # a block of GMVs of shape (sites, events) is interpolated at once
+        gmvs = numpy.array([[0.004, 0.006, 0.0098], [0.01, 0.0269, 0.03]])
+        means, covs, idxs = self.test_func.interpolate(gmvs)
+        numpy.testing.assert_equal(
+            idxs, [[False, True, True], [True, True, True]])
+        numpy.testing.assert_allclose(
+            means, [0.055, 0.3, 0.31025641, 1., 1.])
+        numpy.testing.assert_allclose(
+            covs, [0.2, 0.3, 0.28461538, 10., 10.])
+
     def test_vuln_func_constructor_raises_on_invalid_lr_cov(self):
         # If a loss ratio is 0.0 and the corresponding CoV is > 0.0, we expect
         # a ValueError.
@@ -673,3 +684,33 @@ class ClassicalDamageTestCase(unittest.TestCase):
             fragility_functions, hazard_imls, hazard_poes,
             investigation_time, risk_investigation_time)
         aaae(poos, [0.56652127, 0.12513401, 0.1709355, 0.06555033, 0.07185889])
+
+
+class LossesByPeriodBuilderTestCase(unittest.TestCase):
+    def test_build_curves(self):
+        return_periods = numpy.array([1, 2, 5, 10, 20, 50, 100, 200])
+        builder = scientific.LossesByPeriodBuilder(
+            return_periods, None, [.5, .5], {0: 100, 1: 1}, 100., 50)
+        rng = numpy.random.RandomState(42)
+        loss_ratios = rng.random_sample((10, 60)).astype(numpy.float32)
+        loss_ratios[loss_ratios < .5] = 0
+        values = rng.random_sample(10) * 1000
+        expected = [builder.build_curve(value, ratios, 0)
+                    for value, ratios in zip(values, loss_ratios)]
+        for partial in (True, False):
+            curves = builder.build_curves(values, loss_ratios, 0, partial)
+            numpy.testing.assert_allclose(curves, expected)
+
+        # a single event
+        curves = builder.build_curves(values, loss_ratios[:, :1], 1)
+        expected = [builder.build_curve(value, ratios, 1)
+                    for value, ratios in zip(values, loss_ratios[:, :1])]
+        numpy.testing.assert_allclose(curves, expected)
+
+        # no events
+        curves = builder.build_curves(values, loss_ratios[:, :0], 0)
+        self.assertEqual(curves.shape, (10, 8))
+        self.assertEqual(curves.sum(), 0)
+
+        with self.assertRaises(ValueError):
+            builder.build_curves(values, loss_ratios[:, :2], 1)